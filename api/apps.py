@@ -1,5 +1,37 @@
 from django.apps import AppConfig
+from django.conf import settings
+
+import os
+import sys
+
+
+# programs running the management commands
+MANAGE_PROGRAMS = ['manage.py', 'django-admin', 'django-admin.py']
+
+
+def is_management_command():
+    '''
+    Checks whether this process runs a management command other than runserver
+    '''
+
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+
+    return program in MANAGE_PROGRAMS and sys.argv[1:2] != ['runserver']
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # connect the signal handlers of the region closure and price rollup
+        import api.regions
+        import api.rollup
+        # register the system checks
+        import api.checks
+
+        # jobs left by a restart or a dead process are drained from the first request on,
+        # without waiting for the next upload, processes without jobs wait for one
+        if getattr(settings, 'INGEST_WORKERS', 1) and not is_management_command():
+            from django.core.signals import request_started
+            from api.jobs import start_ingest_workers
+            request_started.connect(start_ingest_workers, dispatch_uid='start_ingest_workers')
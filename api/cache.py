@@ -0,0 +1,54 @@
+# Django imports
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache as BaseDatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def shared_cache():
+    '''
+    Returns the Django cache shared by all workers, settings.RATES_CACHE_ALIAS,
+    holding the invalidation events of the rates cache and the region generation
+    '''
+    return caches[getattr(settings, 'RATES_CACHE_ALIAS', 'default')]
+
+
+def web_concurrency():
+    '''
+    Returns settings.WEB_CONCURRENCY, the number of worker processes serving the API
+    '''
+    return getattr(settings, 'WEB_CONCURRENCY', 1)
+
+
+def is_process_local(cache):
+    '''
+    Checks whether a Django cache is private to this process,
+    so other workers never see what it holds
+    '''
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+class DatabaseCache(BaseDatabaseCache):
+    '''
+    Django's database cache with an atomic incr, the sequence of the
+    rates cache and the region generation are bumped by many processes
+    and a lost increment would hide an upload from the other workers.
+
+    Create its table with `python manage.py createcachetable`.
+    '''
+
+    def incr(self, key, delta=1, version=None):
+
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        table = connection.ops.quote_name(self._table)
+
+        with transaction.atomic(using=db):
+            # concurrent increments wait for the row lock, SQLite locks the whole database on write
+            if connection.features.has_select_for_update:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT cache_key FROM {0} WHERE cache_key = %s FOR UPDATE".format(table),
+                                   [self.make_key(key, version)])
+            return super().incr(key, delta, version)
@@ -0,0 +1,28 @@
+# Django imports
+from django.conf import settings
+from django.core.checks import Error, register
+
+# local imports
+from api.cache import is_process_local, shared_cache, web_concurrency
+
+
+@register('caches')
+def check_shared_cache(app_configs, **kwargs):
+    '''
+    Refuses a shared cache private to each process when several workers serve
+    the API, the rates cache, region closure, NumPy engine and summary index
+    of each worker would never see the uploads and region changes of the others,
+    the rates cache is disabled at runtime in that case
+    '''
+
+    errors = list()
+
+    if web_concurrency() > 1 and is_process_local(shared_cache()):
+        errors.append(Error(
+            "RATES_CACHE_ALIAS '{0}' is private to each process but WEB_CONCURRENCY is {1}".format(
+                getattr(settings, 'RATES_CACHE_ALIAS', 'default'), web_concurrency()),
+            hint="Use a cache shared by the workers, ie: api.cache.DatabaseCache or memcached.",
+            id='api.E001',
+            ))
+
+    return errors
@@ -0,0 +1,22 @@
+# Django imports
+from django.conf import settings
+
+# other imports
+import json
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def configuration():
+    '''
+    Reads settings.CONFIGURATION_FILE on first use instead of at import,
+    so a missing file only fails the requests which need it
+
+    Returns:
+        dict: returns the configuration data
+    '''
+
+    # open configuration file
+    with open(settings.CONFIGURATION_FILE) as config_file:
+        # get the configuration data from the file
+        return json.load(config_file)
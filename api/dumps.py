@@ -0,0 +1,75 @@
+# other imports
+import io
+
+
+def read_copy_rows(path, table):
+    '''
+    Takes a pg_dump file and a table name,
+    and yields the rows of the table's COPY block
+
+    Parameters:
+        path (str)  : The path of the dump file, ie: rates.sql.
+        table (str) : The table name, ie: api_prices.
+
+    Returns:
+        generator: yields dictionary of column name and value for each row,
+            \\N is returned as None
+    '''
+
+    # header line of the COPY block
+    header = "COPY public.{0} (".format(table)
+
+    with io.open(path, encoding='utf-8') as dump_file:
+        # find the COPY block of the table
+        for line in dump_file:
+            if line.startswith(header):
+                # column names between the brackets
+                column_names = [name.strip() for name in line[len(header):line.index(')')].split(',')]
+                break
+        else:
+            return
+
+        # rows until the end of data marker
+        for line in dump_file:
+            if line.startswith('\\.'):
+                break
+            values = [None if value == '\\N' else value for value in line.rstrip('\n').split('\t')]
+            yield dict(zip(column_names, values))
+
+
+def copy_block(path, table):
+    '''
+    Takes a pg_dump file and a table name,
+    and finds the rows of the table's COPY block without parsing them
+
+    Parameters:
+        path (str)  : The path of the dump file, ie: rates.sql.
+        table (str) : The table name, ie: api_prices.
+
+    Returns:
+        tuple: returns (list of column names, offset of the first row,
+            offset of the end of data marker), None if there is no block
+    '''
+
+    # header line of the COPY block
+    header = "COPY public.{0} (".format(table).encode('utf-8')
+
+    with io.open(path, 'rb') as dump_file:
+        # find the COPY block of the table
+        for line in iter(dump_file.readline, b''):
+            if line.startswith(header):
+                # column names between the brackets
+                column_names = [name.strip() for name in line[len(header):line.index(b')')].decode('utf-8').split(',')]
+                start = dump_file.tell()
+                break
+        else:
+            return None
+
+        # rows until the end of data marker
+        end = start
+        for line in iter(dump_file.readline, b''):
+            if line.startswith(b'\\.'):
+                break
+            end += len(line)
+
+    return column_names, start, end
@@ -0,0 +1,222 @@
+# local imports
+from api.models import Prices
+from api.snapshot import current_snapshot, open_snapshot
+from api.rates_cache import current_sequence, refresh_index, shared_cache, written_lanes
+
+# other imports
+import datetime
+import threading
+import numpy as np
+
+
+# days are stored as int32 days since 1970-01-01
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def to_day(date):
+    '''
+    Takes a date and returns it as days since the epoch
+    '''
+    return (date - EPOCH).days
+
+
+def code_id(code_ids, code):
+    '''
+    Takes the int ids of the port codes and
+    returns the id of a port code, adding it if new
+    '''
+    return code_ids.setdefault(code, len(code_ids))
+
+
+def lane_arrays(rows):
+    '''
+    Takes the (day, price) rows of one lane and
+    returns them as arrays sorted by day
+
+    Returns:
+        tuple: returns (days int32 array, prices int32 array)
+    '''
+
+    days = np.fromiter((to_day(day) for day, _ in rows), dtype=np.int32, count=len(rows))
+    prices = np.fromiter((price for _, price in rows), dtype=np.int32, count=len(rows))
+
+    order = np.argsort(days, kind='stable')
+
+    return days[order], prices[order]
+
+
+def read_lanes(code_ids, base, overlay, lanes):
+    '''
+    Takes the arrays of a cube and reads the given lanes whole from the database
+    into its overlay, dropping their snapshot rows which may have been updated
+    or deleted since, or missed while uncommitted when the snapshot was taken
+
+    Parameters:
+        code_ids (dict) : The int ids of the port codes, updated in place.
+        base (dict)     : The snapshot arrays per lane, updated in place.
+        overlay (dict)  : The database arrays per lane, updated in place.
+        lanes (set)     : The (orig_code, dest_code) lanes.
+    '''
+
+    for orig_code, dest_code in lanes:
+        rows = list(Prices.objects.filter(orig_code=orig_code, dest_code=dest_code).values_list('day', 'price'))
+        lane = (code_id(code_ids, orig_code), code_id(code_ids, dest_code))
+        base.pop(lane, None)
+        if rows:
+            overlay[lane] = lane_arrays(rows)
+        else:
+            overlay.pop(lane, None)
+
+
+class PriceCube(object):
+    '''
+    In-memory copy of api_prices with one pair of sorted NumPy arrays per lane,
+    answering the rates queries with searchsorted and bincount.
+
+    With settings.RATES_SNAPSHOT_DIR the lanes are views into a memory mapped
+    snapshot shared by all workers, and only the prices inserted after it are
+    read from the database into an overlay. A new snapshot is picked up on
+    the next query after the current symlink is swapped.
+
+    Lanes written by an upload, update or delete of any worker are found in
+    the invalidation events of the rates cache, since the snapshot was taken
+    or since the last query, and are read again whole from the database.
+    '''
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.code_ids   = dict()
+        self.base       = dict()
+        self.lanes      = None
+        self.sequence   = None
+        self.snapshot   = None
+        self.max_id     = 0
+
+    def load(self):
+        '''
+        Maps the snapshot if there is one and reads the prices inserted
+        after it, and the lanes written since it was taken, into per lane arrays
+        '''
+
+        code_ids, base, max_id, written = dict(), dict(), 0, set()
+
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            meta, lanes, days, prices = open_snapshot(snapshot)
+            shared = shared_cache()
+
+            # lanes written since the snapshot was taken, None when its events expired
+            since = meta.get('sequence')
+            stale = written_lanes(shared, since, current_sequence(shared)) if since is not None else None
+
+            # zero-copy views of the snapshot lanes, a snapshot too old
+            # to patch is skipped and all prices are read from the database
+            if stale is not None:
+                code_ids = {code: code_id for code_id, code in enumerate(meta['codes'])}
+                max_id, written = meta['max_id'], stale
+                for orig_id, dest_id, start, end in lanes:
+                    base[(int(orig_id), int(dest_id))] = (days[start:end], prices[start:end])
+
+        rows = Prices.objects.filter(id__gt=max_id).values_list('orig_code', 'dest_code', 'day', 'price').iterator()
+
+        # group the rows of each lane
+        lane_rows = dict()
+        for orig_code, dest_code, day, price in rows:
+            lane_rows.setdefault((code_id(code_ids, orig_code), code_id(code_ids, dest_code)), []).append((day, price))
+
+        overlay = {lane: lane_arrays(rows) for lane, rows in lane_rows.items()}
+        read_lanes(code_ids, base, overlay, written)
+
+        # swapped at once, queries never see a half loaded cube
+        self.code_ids, self.base, self.lanes = code_ids, base, overlay
+        self.snapshot, self.max_id = snapshot, max_id
+
+    def reload_lanes(self, lanes):
+        '''
+        Reads the given (orig_code, dest_code) lanes again whole from the database
+        '''
+
+        # copies swapped once complete, queries keep reading the current ones meanwhile
+        code_ids, base, overlay = dict(self.code_ids), dict(self.base), dict(self.lanes)
+        read_lanes(code_ids, base, overlay, lanes)
+
+        self.code_ids, self.base, self.lanes = code_ids, base, overlay
+
+    def refresh(self):
+        '''
+        Loads the arrays on first use or when a new snapshot is in place,
+        and applies the uploads since the last query
+        '''
+
+        refresh_index(self, reload=self.snapshot != current_snapshot())
+
+    def daily_rates(self, date_from, date_to, origin, destination):
+        '''
+        Takes the date range and port codes,
+        and aggregates the prices per day of every lane between them
+
+        Parameters:
+            date_from (date)    : The from date.
+            date_to (date)      : The to date.
+            origin (list)       : The origin port codes.
+            destination (list)  : The destination port codes.
+
+        Returns:
+            list: returns one row per day with price_sum and price_count
+        '''
+
+        self.refresh()
+
+        # the arrays of one load, a concurrent refresh swaps in new ones
+        with self.lock:
+            code_ids, base, overlay = self.code_ids, self.base, self.lanes
+
+        first_day, last_day = to_day(date_from), to_day(date_to)
+
+        # slice the window out of every lane
+        offsets, prices = list(), list()
+        for orig_code in set(origin):
+            for dest_code in set(destination):
+                if orig_code not in code_ids or dest_code not in code_ids:
+                    continue
+                lane = (code_ids[orig_code], code_ids[dest_code])
+                # snapshot and overlay arrays of the lane
+                for lane_days, lane_prices in filter(None, [base.get(lane), overlay.get(lane)]):
+                    start = np.searchsorted(lane_days, first_day, side='left')
+                    end = np.searchsorted(lane_days, last_day, side='right')
+                    offsets.append(lane_days[start:end] - first_day)
+                    prices.append(lane_prices[start:end])
+
+        if not offsets:
+            return []
+
+        offsets = np.concatenate(offsets)
+        prices = np.concatenate(prices)
+
+        # sum and count of each day of the window,
+        # float64 weights are exact for sums below 2**53
+        length = last_day - first_day + 1
+        price_counts = np.bincount(offsets, minlength=length)
+        price_sums = np.rint(np.bincount(offsets, weights=prices, minlength=length)).astype(np.int64)
+
+        return [{"day": date_from + datetime.timedelta(days=int(offset)),
+                 "price_sum": int(price_sums[offset]),
+                 "price_count": int(price_counts[offset])}
+                for offset in np.flatnonzero(price_counts)]
+
+    def clear(self):
+        '''
+        Drops the arrays, they are loaded again on next use
+        '''
+
+        with self.lock:
+            self.code_ids = dict()
+            self.base = dict()
+            self.lanes = None
+            self.sequence = None
+            self.snapshot = None
+            self.max_id = 0
+
+
+# engine of this worker
+price_cube = PriceCube()
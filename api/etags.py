@@ -0,0 +1,175 @@
+# Django imports
+from django.utils.http import parse_etags, quote_etag
+from django.utils.dateparse import parse_date
+
+# REST imports
+from rest_framework import status
+from rest_framework.response import Response
+
+# local imports
+from api.models import LaneVersion
+from api.serializers import MAX_WINDOW
+from api.regions import region_ports
+
+# other imports
+import hashlib
+import functools
+
+
+# header naming the backend which answered a rates request
+BACKEND_HEADER = 'X-Rates-Backend'
+
+
+def lane_versions(origin, destination):
+    '''
+    Takes the origin and destination port codes and
+    returns the data version of every lane between them
+
+    Parameters:
+        origin (list)       : The origin port codes.
+        destination (list)  : The destination port codes.
+
+    Returns:
+        list: returns sorted list of (orig_code, dest_code, version)
+    '''
+
+    versions = LaneVersion.objects.filter(
+                                orig_code__in=origin,
+                                dest_code__in=destination
+                                ).values_list('orig_code', 'dest_code', 'version')
+
+    return sorted(versions)
+
+
+def request_date(value):
+    '''
+    Takes a date of the rates URL and returns it as date,
+    None if it is invalid, which is answered by the view
+    '''
+
+    try:
+        return parse_date(value)
+    except ValueError:
+        # well formed but not a day, ie: 2016-02-30
+        return None
+
+
+def rates_window(request):
+    '''
+    Returns the rolling window in days asked with ?window=,
+    None if there is none or it is invalid, which is answered by the view
+    '''
+
+    window = request.query_params.get('window')
+
+    if window is None or not window.isdigit() or not 1 <= int(window) <= MAX_WINDOW:
+        return None
+
+    return int(window)
+
+
+def rates_etag(endpoint, date_from, date_to, origin, destination, format, window=None):
+    '''
+    Takes the request of a rates endpoint and
+    returns a strong ETag from the data versions of all its lanes
+
+    Parameters:
+        endpoint (str)      : The endpoint name.
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (str)        : The origin port or region slug.
+        destination (str)   : The destination port or region slug.
+        format (str)        : The format of the response.
+        window (int)        : The rolling window in days.
+
+    Returns:
+        str: returns the quoted ETag
+    '''
+
+    # every port pair the slugs expand to
+    origin_codes      = sorted(region_ports(origin) or (origin,))
+    destination_codes = sorted(region_ports(destination) or (destination,))
+
+    # one query for the versions of all the lanes
+    versions = lane_versions(origin_codes, destination_codes)
+
+    etag_text = "{0}|{1}|{2}|{3}|{4}|{5}|{6}|{7}".format(endpoint, date_from, date_to, format, window,
+                                                         origin_codes, destination_codes, versions)
+
+    return quote_etag(hashlib.sha1(etag_text.encode('utf-8')).hexdigest())
+
+
+def etag_matches(request, etag):
+    '''
+    Checks the If-None-Match header of the request against an ETag
+
+    Parameters:
+        request (Request)   : The request.
+        etag (str)          : The quoted ETag of the current data.
+
+    Returns:
+        bool: returns True if the client already has the data
+    '''
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+
+    # weak comparison as required for If-None-Match
+    client_etags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(if_none_match)]
+
+    return etag in client_etags or '*' in client_etags
+
+
+def not_modified(etag, backend_name=None):
+    '''
+    Returns the 304 Not Modified response of an ETag,
+    with the name of the backend of the rates endpoint if any
+    '''
+
+    headers = {'ETag': etag}
+    if backend_name is not None:
+        headers[BACKEND_HEADER] = backend_name
+
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def conditional_rates(endpoint, backend=None):
+    '''
+    Decorator adding an ETag to the successful responses of a rates endpoint
+    and answering 304 Not Modified when If-None-Match matches it
+
+    Parameters:
+        endpoint (str)      : The endpoint name.
+        backend (callable)  : Returns the backend of api.query answering the endpoint, if any.
+    '''
+
+    def decorator(view):
+
+        @functools.wraps(view)
+        def wrapper(request, date_from, date_to, origin, destination):
+
+            first_day, last_day = request_date(date_from), request_date(date_to)
+
+            # invalid dates are answered by the view
+            if first_day is None or last_day is None:
+                return view(request, date_from, date_to, origin, destination)
+
+            # computed before the data so a concurrent upload gives a stale tag, not stale data
+            etag = rates_etag(endpoint, first_day, last_day, origin, destination,
+                              request.accepted_renderer.format, rates_window(request))
+
+            # unchanged lanes cost only the version lookup
+            if etag_matches(request, etag):
+                return not_modified(etag, backend().name if backend is not None else None)
+
+            response = view(request, date_from, date_to, origin, destination)
+
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+
+            return response
+
+        return wrapper
+
+    return decorator
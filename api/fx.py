@@ -0,0 +1,420 @@
+# Django imports
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# local imports
+from api.config import configuration
+from api.models import FxRate
+
+# other imports
+import math
+import time
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# rows per FxRate insert statement
+FX_BATCH_SIZE = 500
+
+
+class FxRatesUnavailable(Exception):
+    '''
+    Raised when no exchange rate table could be fetched yet
+    '''
+
+
+class FxRateMissing(ValueError):
+    '''
+    Raised when days of a USD upload have no exchange rate of their time,
+    ie: older than the FxRate history of the currency
+    '''
+
+    def __init__(self, currency_code, days):
+        shown = ", ".join(str(day) for day in days[:10]) + (", ..." if len(days) > 10 else "")
+        super().__init__("no exchange rate of {0} for {1}".format(currency_code, shown))
+        self.currency_code = currency_code
+        self.days = days
+
+
+def is_valid_rate(usd_rate):
+    '''
+    Checks whether an exchange rate can convert prices, prices are divided by it
+    '''
+    return isinstance(usd_rate, (int, float)) and math.isfinite(usd_rate) and usd_rate > 0
+
+
+def fx_rate_max_age():
+    '''
+    Returns settings.FX_RATE_MAX_AGE_DAYS, the days a stored rate
+    converts after its own day, and the days before today
+    converted with the current table of the provider
+    '''
+    return getattr(settings, 'FX_RATE_MAX_AGE_DAYS', 7)
+
+
+class FxRateProvider(object):
+    '''
+    Source of the exchange rate table, the amount of each currency
+    worth one USD keyed by upper case currency code
+    '''
+
+    def rates(self):
+        '''
+        Returns the exchange rate table
+        '''
+        raise NotImplementedError
+
+    def status(self):
+        '''
+        Returns the age in seconds of the table, whether it is stale
+        and the state of the circuit breaker
+        '''
+        return {"age_seconds": 0, "stale": False, "breaker": "closed"}
+
+    def clear(self):
+        '''
+        Drops any cached table
+        '''
+
+
+class HTTPFxRateProvider(FxRateProvider):
+    '''
+    Exchange rate API of the configuration file read by a background
+    thread of the worker every settings.FX_RATE_TTL seconds, over a pooled
+    requests.Session with the connect and read timeouts of settings.FX_HTTP_TIMEOUT.
+
+    Uploads are only given the last good table and never wait for the API,
+    except for the first fetch of the worker. After settings.FX_BREAKER_FAILURES
+    failed fetches in a row the circuit breaker opens and the API is left alone
+    for settings.FX_BREAKER_RESET seconds, then tried once again. A table older
+    than settings.FX_RATE_STALE_TTL is still served but reported as stale.
+    '''
+
+    def __init__(self):
+        self.lock           = threading.Lock()
+        self.session        = None
+        self.table          = None
+        self.fetched_at     = None
+        self.failures       = 0
+        self.opened_at      = None
+        self.thread         = None
+        self.stop_event     = threading.Event()
+        self.first_attempt  = threading.Event()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'FX_RATE_TTL', 3600)
+
+    @property
+    def stale_ttl(self):
+        return getattr(settings, 'FX_RATE_STALE_TTL', 24 * 3600)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'FX_HTTP_TIMEOUT', (3.05, 5))
+
+    @property
+    def breaker_failures(self):
+        return getattr(settings, 'FX_BREAKER_FAILURES', 3)
+
+    @property
+    def breaker_reset(self):
+        return getattr(settings, 'FX_BREAKER_RESET', 60)
+
+    def http_session(self):
+        '''
+        Returns the session of this worker, its connections are kept alive between fetches
+        '''
+
+        with self.lock:
+            if self.session is None:
+                # imported on first use, only the USD uploads need it
+                import requests
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
+
+            return self.session
+
+    def breaker(self):
+        '''
+        Returns the state of the circuit breaker, closed, open or half_open
+        '''
+
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.breaker_reset:
+            return "open"
+        return "half_open"
+
+    def fetch(self):
+        '''
+        Reads the exchange rate table from the API and caches it
+        '''
+
+        # Configuration of exchange rate API
+        config_data = configuration()['exchange_rates']
+
+        response = self.http_session().get(config_data['url'], params={'app_id': config_data['app_id']},
+                                           timeout=self.timeout)
+        response.raise_for_status()
+        table = {currency.upper(): rate for currency, rate in response.json()['rates'].items()}
+
+        with self.lock:
+            self.table = table
+            self.fetched_at = time.monotonic()
+
+        return table
+
+    def refresh(self):
+        '''
+        Fetches the table unless the circuit breaker is open
+
+        Returns:
+            bool: returns True if a new table was fetched
+        '''
+
+        with self.lock:
+            breaker = self.breaker()
+        if breaker == "open":
+            return False
+
+        try:
+            self.fetch()
+        except Exception as error:
+            # the last good table is served meanwhile
+            logger.warning("exchange rate refresh failed: %s", error)
+            with self.lock:
+                self.failures += 1
+                # a failed trial opens the breaker again
+                if self.failures >= self.breaker_failures or breaker == "half_open":
+                    self.opened_at = time.monotonic()
+            return False
+        else:
+            with self.lock:
+                self.failures = 0
+                self.opened_at = None
+            return True
+        finally:
+            self.first_attempt.set()
+
+    def run(self):
+        '''
+        Loop of the background thread
+        '''
+
+        while not self.stop_event.is_set():
+            fetched = self.refresh()
+            # failures are retried sooner, an open breaker waits until it half opens
+            self.stop_event.wait(self.ttl if fetched else min(self.ttl, self.breaker_reset))
+
+    def start(self):
+        '''
+        Starts the background thread of this worker if it is not running
+        '''
+
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.run, name="fx-refresh", daemon=True)
+                self.thread.start()
+
+    def rates(self):
+
+        self.start()
+
+        # only the first fetch of the worker is waited for, bounded by the timeouts
+        if self.table is None:
+            connect_timeout, read_timeout = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+            self.first_attempt.wait(connect_timeout + read_timeout + 1)
+
+        with self.lock:
+            if self.table is None:
+                raise FxRatesUnavailable("no exchange rate table fetched yet")
+            return self.table
+
+    def status(self):
+
+        with self.lock:
+            age = time.monotonic() - self.fetched_at if self.fetched_at is not None else None
+            return {
+                    "age_seconds": int(age) if age is not None else None,
+                    "stale": age is None or age >= self.stale_ttl,
+                    "breaker": self.breaker()
+                    }
+
+    def clear(self):
+        '''
+        Stops the background thread and drops the table
+        '''
+
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        with self.lock:
+            self.thread = None
+            self.table = None
+            self.fetched_at = None
+            self.failures = 0
+            self.opened_at = None
+            self.first_attempt.clear()
+
+
+class StubFxRateProvider(FxRateProvider):
+    '''
+    Fixed table of settings.FX_STUB_RATES, for tests and offline development
+    '''
+
+    def rates(self):
+        return {currency.upper(): rate for currency, rate in getattr(settings, 'FX_STUB_RATES', {'USD': 1.0}).items()}
+
+
+# one provider per class path in each worker
+providers = dict()
+providers_lock = threading.Lock()
+
+
+def fx_provider():
+    '''
+    Returns the provider of settings.FX_RATE_PROVIDER
+    '''
+
+    path = getattr(settings, 'FX_RATE_PROVIDER', 'api.fx.HTTPFxRateProvider')
+
+    with providers_lock:
+        if path not in providers:
+            providers[path] = import_string(path)()
+
+        return providers[path]
+
+
+def store_fx_rates(rows):
+    '''
+    Takes exchange rates and stores them in the FxRate table,
+    replacing the stored rates of the same currency and day
+
+    Parameters:
+        rows (iterable) : The (currency, day, usd_rate) rows.
+
+    Returns:
+        int: returns number of rates stored
+    '''
+
+    # last rate of each currency and day wins
+    rates = {(currency.upper(), day): float(usd_rate) for currency, day, usd_rate in rows}
+
+    # prices are divided by the rates
+    invalid = sorted("{0} {1} {2}".format(currency, day, usd_rate)
+                     for (currency, day), usd_rate in rates.items() if not is_valid_rate(usd_rate))
+    if invalid:
+        raise ValueError("exchange rates must be positive: {0}".format(", ".join(invalid[:10])))
+
+    # stored days of each currency
+    days = dict()
+    for currency, day in rates:
+        days.setdefault(currency, set()).add(day)
+
+    with transaction.atomic():
+        for currency, currency_days in days.items():
+            FxRate.objects.filter(currency=currency, day__in=sorted(currency_days)).delete()
+        FxRate.objects.bulk_create([FxRate(currency=currency, day=day, usd_rate=usd_rate)
+                                    for (currency, day), usd_rate in rates.items()], batch_size=FX_BATCH_SIZE)
+
+    return len(rates)
+
+
+def usd_rates(currency_code, days):
+    '''
+    Takes a currency and the days of an upload and returns the rate of each day,
+    the latest stored on or before it up to settings.FX_RATE_MAX_AGE_DAYS old.
+    Recent and future days without one use the current table of the provider,
+    the other days are rejected, or converted with the current table as well
+    when the currency has no stored history at all
+
+    Parameters:
+        currency_code (str) : The currency of the prices.
+        days (list)         : The days of the prices.
+
+    Returns:
+        tuple: returns the amount of the currency worth one USD on each day,
+            and the status of the provider if its table was used, with the
+            number of past days it converted for lack of history as backdated
+    '''
+
+    # imported on first use, only the USD uploads need it
+    import numpy as np
+
+    currency_code = currency_code.upper()
+    if not days:
+        return [], None
+
+    max_age = np.timedelta64(fx_rate_max_age(), 'D')
+
+    # latest rate on or before the first day, then every rate up to the last day
+    first_rate_day = FxRate.objects.filter(currency=currency_code, day__lte=min(days)).order_by('-day').values_list('day', flat=True).first()
+    history = FxRate.objects.filter(currency=currency_code, day__lte=max(days)).order_by('day')
+    if first_rate_day is not None:
+        history = history.filter(day__gte=first_rate_day)
+    history = list(history.values_list('day', 'usd_rate'))
+
+    # the last entries stand for the missing rate, selected by -1
+    rate_days = np.array([day for day, _ in history] + [None], dtype='datetime64[D]')
+    rates = np.array([usd_rate for _, usd_rate in history] + [np.nan], dtype=np.float64)
+
+    # index of the latest rate of each day
+    day_values = np.array(days, dtype='datetime64[D]')
+    positions = np.searchsorted(rate_days[:-1], day_values, side='right') - 1
+    day_rates = rates[positions]
+
+    # rates older than the max age do not convert the day
+    day_rates[(positions >= 0) & (day_values - rate_days[positions] > max_age)] = np.nan
+
+    missing = np.isnan(day_rates)
+    if not missing.any():
+        return day_rates.tolist(), None
+
+    # the current table is the rate of recent and future days only
+    recent = day_values >= np.datetime64(timezone.localdate()) - max_age
+    has_history = bool(history) or FxRate.objects.filter(currency=currency_code).exists()
+    if has_history and (missing & ~recent).any():
+        raise FxRateMissing(currency_code, [day for day, rejected in zip(days, missing & ~recent) if rejected])
+
+    provider = fx_provider()
+    usd_rate = provider.rates()[currency_code]
+    if not is_valid_rate(usd_rate):
+        raise FxRateMissing(currency_code, [day for day, convert in zip(days, missing) if convert])
+
+    day_rates[missing] = usd_rate
+    fx_status = dict(provider.status(), backdated=int((missing & ~recent).sum()))
+
+    return day_rates.tolist(), fx_status
+
+
+def convert_to_usd(prices, currency_code, days):
+    '''
+    Takes the prices of an upload with their days and
+    converts each one with the rate of its own day
+
+    Parameters:
+        prices (list)       : The prices.
+        currency_code (str) : The currency of the prices.
+        days (list)         : The day of each price.
+
+    Returns:
+        tuple: returns the prices in USD truncated into integer like the stored prices,
+            and the status of the provider if its table was used
+    '''
+
+    # imported on first use, only the USD uploads need it
+    import numpy as np
+
+    day_rates, fx_status = usd_rates(currency_code, days)
+    usd_prices = np.array(prices, dtype=np.float64) / np.array(day_rates, dtype=np.float64)
+
+    return usd_prices.astype(np.int64).tolist(), fx_status
@@ -0,0 +1,373 @@
+# Django imports
+from django.conf import settings
+from django.db import connection, transaction
+
+# local imports
+from api.models import Prices
+from api.rollup import add_to_rollup
+
+# other imports
+import io
+import csv
+import json
+import time
+import datetime
+
+
+# columns of a price file, in the order of an unnamed CSV row
+PRICE_COLUMNS = ['orig_code', 'dest_code', 'day', 'price']
+
+# media types of the streamed uploads
+CSV_MEDIA_TYPE      = 'text/csv'
+NDJSON_MEDIA_TYPE   = 'application/x-ndjson'
+
+# load of a chunk of prices on PostgreSQL
+COPY_QUERY = "COPY {table} (orig_code, dest_code, day, price) FROM STDIN WITH (FORMAT csv)"
+
+# range of the price column
+MIN_PRICE = -2 ** 31
+MAX_PRICE = 2 ** 31 - 1
+
+
+def upload_batch_size():
+    '''
+    Returns settings.UPLOAD_BATCH_SIZE, the rows per INSERT statement of the uploads
+    '''
+    return getattr(settings, 'UPLOAD_BATCH_SIZE', 500)
+
+
+def ingest_chunk_size():
+    '''
+    Returns settings.INGEST_CHUNK_SIZE, the rows validated and loaded at once by a streamed upload
+    '''
+    return getattr(settings, 'INGEST_CHUNK_SIZE', 10000)
+
+
+def max_rejected_rows():
+    '''
+    Returns settings.INGEST_MAX_REJECTED_ROWS, the rejected rows detailed in a streamed upload report
+    '''
+    return getattr(settings, 'INGEST_MAX_REJECTED_ROWS', 100)
+
+
+def dates_between(date_from, date_to):
+    '''
+    Takes the date range and
+    returns every day of it, both ends included
+
+    Parameters:
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+
+    Returns:
+        list: returns list of dates
+    '''
+
+    return [date_from + datetime.timedelta(days=offset) for offset in range((date_to - date_from).days + 1)]
+
+
+def copy_prices(rows):
+    '''
+    Takes prices and loads them with one COPY FROM STDIN, PostgreSQL only
+
+    Parameters:
+        rows (list) : The list of (orig_code, dest_code, day, price).
+    '''
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(COPY_QUERY.format(table=Prices._meta.db_table), buffer)
+
+
+def insert_prices(rows, batch_size=None, copy=False):
+    '''
+    Takes prices and inserts them with one INSERT per batch
+    in a single transaction, with their rollup, sketches and lane versions
+
+    Parameters:
+        rows (list)         : The list of (orig_code, dest_code, day, price).
+        batch_size (int)    : The rows per INSERT statement, settings.UPLOAD_BATCH_SIZE by default.
+        copy (bool)         : Load with COPY instead on PostgreSQL.
+
+    Returns:
+        int: returns number of prices inserted
+    '''
+
+    rows = list(rows)
+
+    with transaction.atomic():
+        if copy and connection.vendor == 'postgresql':
+            copy_prices(rows)
+        else:
+            Prices.objects.bulk_create([Prices(orig_code=orig_code, dest_code=dest_code, day=day, price=price)
+                                        for orig_code, dest_code, day, price in rows],
+                                       batch_size=batch_size or upload_batch_size())
+        # bulk inserts skip the rollup signals
+        add_to_rollup(rows)
+
+    return len(rows)
+
+
+def decode_lines(stream):
+    '''
+    Takes a binary stream, ie: the body of a request,
+    and yields its lines as text without reading it all
+    '''
+
+    for line in stream:
+        yield line.decode('utf-8', errors='replace')
+
+
+def csv_records(lines):
+    '''
+    Takes the lines of a CSV price file and yields its rows,
+    a first row naming the columns maps them by name, otherwise
+    the rows are orig_code, dest_code, day, price
+
+    Returns:
+        generator: yields (line number, list of values, error message or None)
+    '''
+
+    reader = csv.reader(lines)
+    indexes = None
+    width = len(PRICE_COLUMNS)
+
+    for values in reader:
+        # blank line
+        if not values:
+            continue
+
+        if indexes is None:
+            names = [value.strip() for value in values]
+            # header row
+            if set(PRICE_COLUMNS) <= set(names):
+                indexes = [names.index(name) for name in PRICE_COLUMNS]
+                width = len(names)
+                continue
+            indexes = list(range(len(PRICE_COLUMNS)))
+
+        if len(values) != width:
+            yield reader.line_num, None, "expected {0} columns".format(width)
+        else:
+            yield reader.line_num, [values[index] for index in indexes], None
+
+
+def ndjson_records(lines):
+    '''
+    Takes the lines of a NDJSON price file and yields its rows, one object
+    with orig_code, dest_code, day and price or one array of them per line
+
+    Returns:
+        generator: yields (line number, list of values, error message or None)
+    '''
+
+    for number, line in enumerate(lines, 1):
+        # blank line
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, "invalid JSON"
+            continue
+
+        if isinstance(record, dict) and all(name in record for name in PRICE_COLUMNS):
+            values = [record[name] for name in PRICE_COLUMNS]
+        elif isinstance(record, list) and len(record) == len(PRICE_COLUMNS):
+            values = record
+        else:
+            yield number, None, "expected {0}".format(", ".join(PRICE_COLUMNS))
+            continue
+
+        # validated as text like the CSV values
+        yield number, ['' if value is None else str(value) for value in values], None
+
+
+def parse_days(values):
+    '''
+    Takes an array of YYYY-MM-DD strings and
+    returns them as datetime64[D], NaT where invalid
+    '''
+
+    import numpy as np
+
+    try:
+        days = values.astype('datetime64[D]')
+    except ValueError:
+        # some invalid, parsed one by one
+        days = np.array([parse_day(value) for value in values], dtype='datetime64[D]')
+
+    # years and months alone are parsed by NumPy as well
+    days[np.char.str_len(values) != 10] = np.datetime64('NaT')
+
+    return days
+
+
+def parse_day(value):
+    '''
+    Takes a YYYY-MM-DD string and returns it as datetime64[D], NaT if invalid
+    '''
+
+    import numpy as np
+
+    try:
+        return np.datetime64(value, 'D')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def parse_prices(values):
+    '''
+    Takes an array of integer strings and
+    returns them as int64 with the mask of the valid ones
+    '''
+
+    import numpy as np
+
+    try:
+        prices = values.astype(np.int64)
+        valid = np.ones(len(values), dtype=bool)
+    except (ValueError, OverflowError):
+        # some invalid, parsed one by one
+        parsed = [parse_price(value) for value in values]
+        prices = np.array([0 if price is None else price for price in parsed], dtype=np.int64)
+        valid = np.array([price is not None for price in parsed], dtype=bool)
+
+    return prices, valid & (prices >= MIN_PRICE) & (prices <= MAX_PRICE)
+
+
+def parse_price(value):
+    '''
+    Takes an integer string and returns it as int, None if invalid
+    '''
+
+    try:
+        price = int(value)
+    except ValueError:
+        return None
+
+    return price if MIN_PRICE <= price <= MAX_PRICE else None
+
+
+def validate_records(records):
+    '''
+    Takes a chunk of read rows and validates each column
+    for the whole chunk at once with NumPy
+
+    Parameters:
+        records (list)  : The list of (line number, list of values, error message or None).
+
+    Returns:
+        tuple: returns (list of valid (orig_code, dest_code, day, price),
+            list of (line number, error message) of the rejected rows)
+    '''
+
+    rejected = [(line, error) for line, _, error in records if error is not None]
+    records = [(line, values) for line, values, error in records if error is None]
+
+    if not records:
+        return [], rejected
+
+    lines = [line for line, _ in records]
+    rows, column_rejected = validate_columns(lines, list(zip(*[values for _, values in records])))
+
+    return rows, sorted(rejected + column_rejected)
+
+
+def validate_columns(lines, columns):
+    '''
+    Takes the line numbers and the orig_code, dest_code, day and price columns
+    of a chunk, and validates each column for the whole chunk at once with NumPy
+
+    Parameters:
+        lines (list)    : The line numbers of the rows.
+        columns (list)  : The four columns, as lists or arrays of strings.
+
+    Returns:
+        tuple: returns (list of valid (orig_code, dest_code, day, price),
+            list of (line number, error message) of the rejected rows)
+    '''
+
+    # imported on first use, workers without streamed uploads never load NumPy
+    import numpy as np
+
+    if not len(lines):
+        return [], []
+
+    lines = np.asarray(lines)
+    orig_codes, dest_codes, days, prices = [np.char.strip(np.asarray(column, dtype=str)) for column in columns]
+
+    # codes of one to five characters
+    orig_lengths = np.char.str_len(orig_codes)
+    dest_lengths = np.char.str_len(dest_codes)
+    days = parse_days(days)
+    prices, valid_prices = parse_prices(prices)
+
+    # first invalid column of each row
+    errors = np.select([(orig_lengths < 1) | (orig_lengths > 5),
+                        (dest_lengths < 1) | (dest_lengths > 5),
+                        np.isnat(days),
+                        ~valid_prices],
+                       ["invalid orig_code", "invalid dest_code", "invalid day", "invalid price"],
+                       default="")
+    valid = errors == ""
+
+    rows = list(zip(orig_codes[valid].tolist(), dest_codes[valid].tolist(),
+                    days[valid].astype(object).tolist(), prices[valid].tolist()))
+    rejected = list(zip(lines[~valid].tolist(), errors[~valid].tolist()))
+
+    return rows, rejected
+
+
+def ingest_stream(lines, media_type, chunk_size=None):
+    '''
+    Takes the lines of a CSV or NDJSON price file and loads it chunk by chunk,
+    each chunk validated at once and loaded in its own transaction with COPY
+    on PostgreSQL or batched INSERTs otherwise, so the file is never held in memory
+
+    Parameters:
+        lines (iterable)    : The text lines of the file.
+        media_type (str)    : CSV_MEDIA_TYPE or NDJSON_MEDIA_TYPE.
+        chunk_size (int)    : The rows per chunk, settings.INGEST_CHUNK_SIZE by default.
+
+    Returns:
+        generator: yields the report of the rows read, inserted and rejected after each chunk
+    '''
+
+    read_records = ndjson_records if media_type == NDJSON_MEDIA_TYPE else csv_records
+    chunk_size = chunk_size or ingest_chunk_size()
+    max_details = max_rejected_rows()
+
+    report = {"rows": 0, "inserted": 0, "rejected": 0, "rejected_rows": [], "seconds": 0.0, "rows_per_second": 0}
+    started = time.time()
+
+    def load(chunk):
+        rows, rejected = validate_records(chunk)
+        if rows:
+            insert_prices(rows, copy=True)
+
+        report["rows"] += len(chunk)
+        report["inserted"] += len(rows)
+        report["rejected"] += len(rejected)
+        # details of the first rejected rows only, the count covers all of them
+        for line, error in rejected[:max(max_details - len(report["rejected_rows"]), 0)]:
+            report["rejected_rows"].append({"line": line, "error": error})
+
+        seconds = time.time() - started
+        report["seconds"] = round(seconds, 3)
+        report["rows_per_second"] = int(report["inserted"] / seconds) if seconds else 0
+
+        return report
+
+    chunk = list()
+    for record in read_records(lines):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield load(chunk)
+            chunk = list()
+
+    yield load(chunk)
@@ -0,0 +1,301 @@
+# Django imports
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+# local imports
+from api.fx import convert_to_usd
+from api.models import IngestJob
+from api.ingest import dates_between, insert_prices
+
+# other imports
+import json
+import logging
+import datetime
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# kinds of job, one per upload endpoint
+PRICE_JOB       = 'price'
+USD_PRICE_JOB   = 'usd_price'
+
+# states of a job
+QUEUED  = 'queued'
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+
+
+def job_batch_size():
+    '''
+    Returns settings.INGEST_JOB_BATCH_SIZE, the jobs claimed and inserted in one transaction
+    '''
+    return getattr(settings, 'INGEST_JOB_BATCH_SIZE', 20)
+
+
+def job_timeout():
+    '''
+    Returns settings.INGEST_JOB_TIMEOUT, the seconds after which
+    a running job is taken as abandoned by a dead worker and run again
+    '''
+    return getattr(settings, 'INGEST_JOB_TIMEOUT', 600)
+
+
+class JobReclaimed(Exception):
+    '''
+    Raised when a running job was claimed again by another worker
+    after settings.INGEST_JOB_TIMEOUT, its batch is rolled back
+    '''
+
+    def __init__(self, job):
+        super().__init__("ingest job {0} was claimed again by another worker".format(job.pk))
+        self.job = job
+
+
+def enqueue_job(kind, payload, rows):
+    '''
+    Takes a validated upload and queues it,
+    the workers are woken once the job is committed
+
+    Parameters:
+        kind (str)      : PRICE_JOB or USD_PRICE_JOB.
+        payload (dict)  : The validated request data.
+        rows (int)      : The number of prices of the upload.
+
+    Returns:
+        IngestJob: returns the queued job
+    '''
+
+    job = IngestJob.objects.create(kind=kind, payload=json.dumps(payload), rows=rows)
+    transaction.on_commit(ingest_workers.wake)
+
+    return job
+
+
+def claim_jobs(limit=None):
+    '''
+    Takes the oldest queued jobs, and the running jobs abandoned
+    by a dead worker, and marks them as running for this worker
+
+    Parameters:
+        limit (int) : The number of jobs, settings.INGEST_JOB_BATCH_SIZE by default.
+
+    Returns:
+        list: returns the claimed jobs
+    '''
+
+    now = timezone.now()
+    abandoned = now - datetime.timedelta(seconds=job_timeout())
+
+    with transaction.atomic():
+        jobs = IngestJob.objects.filter(Q(status=QUEUED) | Q(status=RUNNING, started__lt=abandoned)).order_by('id')
+        # other workers skip the locked rows on PostgreSQL
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+
+        claimed = list()
+        for job in jobs[:limit or job_batch_size()]:
+            # a job claimed by another worker in between is not updated
+            if IngestJob.objects.filter(pk=job.pk, status=job.status, started=job.started).update(
+                    status=RUNNING, started=now, attempts=F('attempts') + 1):
+                job.status, job.started = RUNNING, now
+                claimed.append(job)
+
+    return claimed
+
+
+def job_rows(job):
+    '''
+    Takes a job and returns its prices, converted into USD for USD_PRICE_JOB
+
+    Returns:
+        list: returns the list of (orig_code, dest_code, day, price)
+    '''
+
+    payload = json.loads(job.payload)
+    days = dates_between(parse_date(payload['date_from']), parse_date(payload['date_to']))
+    prices = payload['price']
+
+    if job.kind == USD_PRICE_JOB:
+        prices, _ = convert_to_usd(prices, payload['currency_code'], days)
+
+    return [(payload['origin_code'], payload['destination_code'], day, price) for day, price in zip(days, prices)]
+
+
+def run_jobs(jobs):
+    '''
+    Takes claimed jobs and inserts their prices in one transaction,
+    each job is run alone when the batch fails so only the faulty ones fail
+
+    Returns:
+        int: returns number of jobs done
+    '''
+
+    rows = dict()
+    for job in jobs:
+        try:
+            rows[job.pk] = job_rows(job)
+        except Exception as error:
+            fail_job(job, error)
+
+    jobs = [job for job in jobs if job.pk in rows]
+    if not jobs:
+        return 0
+
+    try:
+        with transaction.atomic():
+            # one insert of the prices and the rollup for the whole batch
+            insert_prices([row for job in jobs for row in rows[job.pk]])
+            for job in jobs:
+                # only while this worker still owns the job, its prices are inserted by the new owner otherwise
+                if not running_job(job).update(status=DONE, inserted=len(rows[job.pk]), error='', finished=timezone.now()):
+                    raise JobReclaimed(job)
+        return len(jobs)
+
+    except JobReclaimed as reclaimed:
+        logger.warning("%s", reclaimed)
+        return run_jobs([job for job in jobs if job.pk != reclaimed.job.pk])
+
+    except Exception as error:
+        if len(jobs) == 1:
+            fail_job(jobs[0], error)
+            return 0
+
+    return sum(run_jobs([job]) for job in jobs)
+
+
+def running_job(job):
+    '''
+    Takes a claimed job and returns the queryset of its row
+    as long as it is still running under the claim of this worker
+    '''
+    return IngestJob.objects.filter(pk=job.pk, status=RUNNING, started=job.started)
+
+
+def fail_job(job, error):
+    '''
+    Takes a job and the error it raised, and marks it as failed
+    '''
+
+    logger.warning("ingest job %s failed: %s", job.pk, error)
+    running_job(job).update(status=FAILED, error=str(error) or error.__class__.__name__, finished=timezone.now())
+
+
+def drain_jobs():
+    '''
+    Runs batches of jobs until the queue is empty
+
+    Returns:
+        int: returns number of jobs claimed
+    '''
+
+    claimed = 0
+
+    while True:
+        jobs = claim_jobs()
+        if not jobs:
+            return claimed
+        claimed += len(jobs)
+        run_jobs(jobs)
+
+
+class IngestWorkers(object):
+    '''
+    Threads of this process draining the job queue, settings.INGEST_WORKERS
+    of them started by the first upload queued here, or by the first request
+    served by this process when jobs are pending, see api.apps. They are woken by the
+    commit of every job queued by this process, and look for jobs queued by
+    other processes every settings.INGEST_JOB_POLL_INTERVAL seconds.
+
+    Set INGEST_WORKERS = 0 when the queue is drained by
+    separate processes of manage.py run_ingest_jobs instead.
+    '''
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.threads    = list()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    @property
+    def count(self):
+        return getattr(settings, 'INGEST_WORKERS', 1)
+
+    @property
+    def poll_interval(self):
+        return getattr(settings, 'INGEST_JOB_POLL_INTERVAL', 1.0)
+
+    def run(self):
+        '''
+        Loop of a worker thread
+        '''
+
+        while not self.stop_event.is_set():
+            try:
+                drain_jobs()
+            except Exception:
+                logger.exception("ingest worker failed")
+            finally:
+                # connections of this thread past their CONN_MAX_AGE
+                close_old_connections()
+            self.wake_event.wait(self.poll_interval)
+            self.wake_event.clear()
+
+        connection.close()
+
+    def start(self):
+        '''
+        Starts the threads of this process if they are not running
+        '''
+
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            for number in range(len(self.threads), self.count):
+                self.stop_event.clear()
+                thread = threading.Thread(target=self.run, name="ingest-worker-{0}".format(number), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        '''
+        Starts the threads if needed and lets them look for jobs now
+        '''
+
+        if self.count:
+            self.start()
+            self.wake_event.set()
+
+    def stop(self):
+        '''
+        Stops the threads once their current batch is done
+        '''
+
+        self.stop_event.set()
+        self.wake_event.set()
+
+        with self.lock:
+            for thread in self.threads:
+                thread.join()
+            self.threads = list()
+
+
+# worker threads of this process
+ingest_workers = IngestWorkers()
+
+
+def start_ingest_workers(sender=None, **kwargs):
+    '''
+    Starts the worker threads with the first request served by this process
+    when jobs are left by a restart or a dead process, otherwise they are
+    started by the first upload queued here, processes never given a job do not poll
+    '''
+
+    request_started.disconnect(start_ingest_workers, dispatch_uid='start_ingest_workers')
+
+    if IngestJob.objects.filter(status__in=[QUEUED, RUNNING]).exists():
+        ingest_workers.start()
@@ -0,0 +1,131 @@
+# Django imports
+from django.conf import settings
+from django.db import connection
+from django.core.management.base import BaseCommand
+
+# local imports
+from api.dumps import read_copy_rows
+from api.rollup import rebuild_rollup
+from api.regions import invalidate_region_closure
+from api.models import Ports, Prices, Regions
+from api.query import daily_prices, slug_to_code
+
+# other imports
+import os
+import time
+
+
+# typical port to port and region to region lanes of the rates API
+DEFAULT_LANES = ["CNGGZ:EETLL", "china_south_main:north_europe_main"]
+
+
+class Command(BaseCommand):
+    '''
+    Reports the latency of the daily average query on the raw api_prices
+    table for typical lanes, with and without the lane/day index.
+    The rates API itself reads the daily lane rollup, see api.rollup,
+    the index serves the rollup rebuilds and the other price queries.
+
+    Usage:
+        python manage.py benchmark_rates --load rates.sql
+    '''
+
+    help = "Benchmark the api_prices daily average query before and after the lane/day index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--load', metavar='DUMP',
+                            help="load ports, regions and prices from a pg_dump file if the tables are empty")
+        parser.add_argument('--lane', action='append', dest='lanes', metavar='ORIGIN:DESTINATION',
+                            help="lane to benchmark, can be repeated")
+        parser.add_argument('--date-from', default='2016-01-01')
+        parser.add_argument('--date-to', default='2016-01-31')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+
+        # fill the tables from the dump
+        if options['load']:
+            self.load_dump(options['load'])
+
+        # resolve each lane into port codes once
+        lanes = list()
+        for lane in options['lanes'] or DEFAULT_LANES:
+            origin, destination = lane.split(':')
+            lanes.append((lane, slug_to_code(slug=origin), slug_to_code(slug=destination)))
+
+        self.stdout.write("{0} prices, {1} to {2}, {3} runs per lane".format(
+                            Prices.objects.count(), options['date_from'], options['date_to'], options['repeat']))
+
+        # the lane/day index declared on the model
+        index = Prices._meta.indexes[0]
+
+        # latency without the index
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(Prices, index)
+        try:
+            before = self.time_lanes(lanes, options)
+        finally:
+            # always restore the index
+            with connection.schema_editor() as schema_editor:
+                schema_editor.add_index(Prices, index)
+
+        # latency with the index
+        after = self.time_lanes(lanes, options)
+
+        self.stdout.write("{0:<45} {1:>12} {2:>12}".format("lane", "before (ms)", "after (ms)"))
+        for lane, _, _ in lanes:
+            self.stdout.write("{0:<45} {1:>12.3f} {2:>12.3f}".format(lane, before[lane], after[lane]))
+
+    def time_lanes(self, lanes, options):
+        '''
+        Takes the lanes and returns the median latency of each lane in milliseconds
+        '''
+
+        # refresh planner statistics
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE api_prices")
+
+        latency = dict()
+        for lane, origin, destination in lanes:
+            timings = list()
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                # daily averages straight from api_prices, as before the rollup
+                list(daily_prices(Prices.objects.filter(
+                                        day__range=[options['date_from'], options['date_to']],
+                                        orig_code__in=origin,
+                                        dest_code__in=destination
+                                        )))
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            latency[lane] = timings[len(timings) // 2] * 1000
+
+        return latency
+
+    def load_dump(self, path):
+        '''
+        Takes a pg_dump file and loads the api tables which are still empty
+        '''
+
+        # allow relative path from the project directory
+        if not os.path.exists(path):
+            path = os.path.join(settings.BASE_DIR, path)
+
+        loaded = list()
+        for model, table in [(Ports, 'api_ports'), (Regions, 'api_regions'), (Prices, 'api_prices')]:
+            # do not load twice
+            if model.objects.exists():
+                continue
+            # id column of the dump is ignored
+            objects = [model(**{key: value for key, value in row.items() if key != 'id'})
+                       for row in read_copy_rows(path, table)]
+            model.objects.bulk_create(objects, batch_size=500)
+            self.stdout.write("loaded {0} rows into {1}".format(len(objects), table))
+            loaded.append(model)
+
+        # bulk inserts skip the region closure and rollup signals
+        if Ports in loaded or Regions in loaded:
+            invalidate_region_closure()
+        if loaded:
+            rebuild_rollup()
@@ -0,0 +1,80 @@
+# Django imports
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# other imports
+import os
+import sys
+import json
+import subprocess
+
+
+# modules which must not be loaded by a worker before its first request
+HEAVY_MODULES = ['pandas', 'numpy', 'requests']
+
+# run in a fresh interpreter, as a worker boots and loads the URLconf
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import {urlconf}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_ms": elapsed * 1000,
+                   "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   "heavy_modules": [name for name in {heavy} if name in sys.modules]}}))
+'''
+
+
+def measure_startup():
+    '''
+    Boots Django and imports the URLconf in a new process
+
+    Returns:
+        dict: returns import_ms, max_rss_kb and the heavy_modules loaded
+    '''
+
+    script = STARTUP_SCRIPT.format(urlconf=settings.ROOT_URLCONF, heavy=HEAVY_MODULES)
+
+    # same settings as this process
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env)
+
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    '''
+    Reports the time and memory a worker needs to boot Django
+    and import the URLconf, and the heavy modules loaded on the way
+
+    Usage:
+        python manage.py benchmark_startup --repeat 5 --max-import-ms 800
+    '''
+
+    help = "Benchmark the import time and RSS of a worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--max-import-ms', type=float,
+                            help="fail when the median import time is above this")
+        parser.add_argument('--max-rss-mb', type=float,
+                            help="fail when the median RSS is above this")
+
+    def handle(self, *args, **options):
+
+        runs = [measure_startup() for _ in range(options['repeat'])]
+
+        # median of the runs
+        import_ms = sorted(run['import_ms'] for run in runs)[len(runs) // 2]
+        rss_mb = sorted(run['max_rss_kb'] for run in runs)[len(runs) // 2] / 1024.0
+        heavy_modules = sorted(set(name for run in runs for name in run['heavy_modules']))
+
+        self.stdout.write("{0} runs, import {1:.1f} ms, RSS {2:.1f} MB, heavy modules: {3}".format(
+                            len(runs), import_ms, rss_mb, ", ".join(heavy_modules) or "none"))
+
+        if options['max_import_ms'] is not None and import_ms > options['max_import_ms']:
+            raise CommandError("import took {0:.1f} ms, above {1} ms".format(import_ms, options['max_import_ms']))
+        if options['max_rss_mb'] is not None and rss_mb > options['max_rss_mb']:
+            raise CommandError("RSS is {0:.1f} MB, above {1} MB".format(rss_mb, options['max_rss_mb']))
@@ -0,0 +1,73 @@
+# Django imports
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.core.management.base import BaseCommand, CommandError
+
+# local imports
+from api.fx import fx_provider, is_valid_rate, store_fx_rates
+
+# other imports
+import os
+import csv
+
+
+class Command(BaseCommand):
+    '''
+    Loads exchange rate history into the FxRate table used to convert
+    the USD uploads, from a CSV file with a day,currency,usd_rate header
+    or from the current table of settings.FX_RATE_PROVIDER
+
+    Usage:
+        python manage.py load_fx_rates rates.csv
+        python manage.py load_fx_rates --latest
+    '''
+
+    help = "Load exchange rates per currency and day into api_fxrate"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', metavar='CSV',
+                            help="file with day,currency,usd_rate columns, usd_rate being the amount worth one USD")
+        parser.add_argument('--latest', action='store_true',
+                            help="store the current table of the exchange rate provider as the rates of today")
+
+    def handle(self, *args, **options):
+
+        if not options['path'] and not options['latest']:
+            raise CommandError("give a CSV file or --latest")
+
+        try:
+            if options['path']:
+                stored = store_fx_rates(self.read_csv(options['path']))
+                self.stdout.write("loaded {0} rates from {1}".format(stored, options['path']))
+
+            if options['latest']:
+                today = timezone.localdate()
+                stored = store_fx_rates((currency, today, usd_rate) for currency, usd_rate in fx_provider().rates().items())
+                self.stdout.write("loaded {0} rates for {1}".format(stored, today))
+
+        except ValueError as error:
+            # rates which are not positive, nothing is stored
+            raise CommandError(str(error))
+
+    def read_csv(self, path):
+        '''
+        Takes a CSV file and yields its (currency, day, usd_rate) rows
+        '''
+
+        # allow relative path from the project directory
+        if not os.path.exists(path):
+            path = os.path.join(settings.BASE_DIR, path)
+
+        with open(path, newline='') as csv_file:
+            for line, row in enumerate(csv.DictReader(csv_file), start=2):
+                day = parse_date(row['day'].strip())
+                if day is None:
+                    raise CommandError("{0}:{1}: invalid day {2!r}".format(path, line, row['day']))
+                try:
+                    usd_rate = float(row['usd_rate'])
+                except (TypeError, ValueError):
+                    raise CommandError("{0}:{1}: invalid usd_rate {2!r}".format(path, line, row['usd_rate']))
+                if not is_valid_rate(usd_rate):
+                    raise CommandError("{0}:{1}: usd_rate {2!r} is not a positive number".format(path, line, row['usd_rate']))
+                yield row['currency'].strip(), day, usd_rate
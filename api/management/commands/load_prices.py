@@ -0,0 +1,362 @@
+# Django imports
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.core.management.base import BaseCommand, CommandError
+
+# local imports
+from api.models import PriceLoad, Prices
+from api.dumps import copy_block
+from api.ingest import PRICE_COLUMNS, copy_prices, validate_columns
+from api.rollup import rebuild_rollup
+from api.rates_cache import rates_cache
+
+# other imports
+import io
+import os
+import csv
+import json
+import time
+import django
+import itertools
+import multiprocessing
+from collections import deque
+
+
+# batched insert of the parsed prices
+INSERT_QUERY = "INSERT INTO {table} (orig_code, dest_code, day, price) VALUES (%s, %s, %s, %s)"
+
+# bytes of a file parsed by one task
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# rejected rows printed per file
+MAX_REJECTED_LINES = 20
+
+# seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+def parse_range(task):
+    '''
+    Takes (path, start, end, delimiter, indexes, width) and parses the lines
+    starting between the two offsets, run by the worker processes
+
+    Returns:
+        tuple: returns (end offset, list of valid (orig_code, dest_code, day, price),
+            list of (offset, error message) of the rejected lines)
+    '''
+
+    # imported by the workers only
+    import numpy as np
+
+    path, start, end, delimiter, indexes, width = task
+
+    with io.open(path, 'rb') as price_file:
+        # the line running over start belongs to the previous range
+        if start > 0:
+            price_file.seek(start - 1)
+            price_file.readline()
+
+        # the lines starting before end, read at once
+        position = price_file.tell()
+        block = price_file.read(max(end - position, 0))
+        if block and not block.endswith(b'\n'):
+            block += price_file.readline()
+
+    byte_lines = block.split(b'\n')
+    offsets = list(itertools.accumulate([position] + [len(line) + 1 for line in byte_lines]))
+
+    # without the blank lines
+    texts = [line.decode('utf-8', errors='replace').rstrip('\r') for line in byte_lines]
+    numbers = [number for number, text in enumerate(texts) if text]
+    split = csv.reader([texts[number] for number in numbers], delimiter=delimiter) if delimiter == ',' else \
+            (texts[number].split(delimiter) for number in numbers)
+
+    lines, values, rejected = list(), list(), list()
+    for number, row in zip(numbers, split):
+        if len(row) == width:
+            lines.append(offsets[number])
+            values.append(row)
+        else:
+            rejected.append((offsets[number], "expected {0} columns".format(width)))
+
+    columns = [np.array([row[index] for row in values], dtype=str) for index in indexes]
+    # \N is the NULL of the COPY layout
+    for column in columns:
+        column[column == '\\N'] = ''
+
+    rows, column_rejected = validate_columns(lines, columns)
+
+    return end, rows, sorted(rejected + column_rejected)
+
+
+class Command(BaseCommand):
+    '''
+    Loads large CSV or TSV price files, or the api_prices COPY block of
+    pg_dump files, into api_prices. Byte ranges of the files are parsed
+    and validated by a pool of processes, and written in file order with
+    COPY on PostgreSQL or batched INSERTs, one transaction per range together
+    with the position reached in the file, so an interrupted load continues
+    where it stopped when run again. The daily lane rollup is rebuilt at the end,
+    or by the next run when it was interrupted before.
+
+    Files are tab separated except *.csv, with the columns named by a header
+    row, or orig_code, dest_code, day, price as in the COPY blocks of rates.sql.
+    Rows must not span lines.
+
+    Usage:
+        python manage.py load_prices prices-2015.tsv prices-2016.tsv
+        python manage.py load_prices backup.sql --workers 8 --drop-indexes
+    '''
+
+    help = "Load price files into api_prices in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='FILE',
+                            help="CSV, TSV or pg_dump files")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="parsing processes, 1 parses in this process")
+        parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES,
+                            help="bytes parsed per task and written per transaction")
+        parser.add_argument('--delimiter',
+                            help="column delimiter, tab by default and comma for *.csv")
+        parser.add_argument('--columns', default=",".join(PRICE_COLUMNS),
+                            help="column names of files without a header row")
+        parser.add_argument('--method', choices=['copy', 'insert'],
+                            help="COPY, PostgreSQL only and the default there, or batched INSERTs")
+        parser.add_argument('--drop-indexes', action='store_true',
+                            help="drop the indexes of api_prices during the load and create them afterwards")
+        parser.add_argument('--restart', action='store_true',
+                            help="ignore the positions reached by earlier loads of the files")
+        parser.add_argument('--no-rollup', action='store_true',
+                            help="do not rebuild the daily lane rollup afterwards")
+
+    def handle(self, *args, **options):
+
+        method = options['method'] or ('copy' if connection.vendor == 'postgresql' else 'insert')
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError("COPY needs PostgreSQL, use --method insert")
+
+        # every file is checked before loading any
+        layouts = [self.layout(path, options) for path in options['paths']]
+
+        if options['drop_indexes']:
+            self.drop_indexes()
+
+        # first and last day loaded on each lane
+        lanes = dict()
+        started = time.time()
+        loaded = 0
+
+        for layout in layouts:
+            loaded += self.load(layout, method, lanes, options)
+
+        if options['drop_indexes']:
+            self.stdout.write("creating indexes")
+            self.create_indexes()
+
+        seconds = time.time() - started
+        self.stdout.write("loaded {0} rows in {1:.1f}s, {2:.0f} rows/s".format(
+                            loaded, seconds, loaded / seconds if seconds else 0))
+
+        # drop the cached responses of the loaded lanes and days
+        rows = [(orig_code, dest_code, day, 0) for (orig_code, dest_code), days in lanes.items() for day in days]
+        rates_cache.invalidate(rows)
+
+        # files loaded by this run or by an interrupted one whose rollup was not rebuilt
+        pending = [] if options['no_rollup'] else list(PriceLoad.objects.filter(rollup_done=False))
+
+        if pending:
+            lane_days = rebuild_rollup()
+            self.stdout.write("rebuilt {0} lane days".format(lane_days))
+
+            # the lanes of the interrupted runs as well, before marking them rolled up
+            rates_cache.invalidate(rows + [(orig_code, dest_code, day, 0) for checkpoint in pending
+                                           for orig_code, dest_code, first_day, last_day in json.loads(checkpoint.lanes)
+                                           for day in (first_day, last_day)])
+            PriceLoad.objects.filter(pk__in=[checkpoint.pk for checkpoint in pending]).update(rollup_done=True, lanes='[]')
+
+    def layout(self, path, options):
+        '''
+        Takes a file and returns where its rows are and how to read them
+        '''
+
+        # allow relative path from the project directory
+        if not os.path.exists(path):
+            path = os.path.join(settings.BASE_DIR, path)
+        if not os.path.exists(path):
+            raise CommandError("{0} not found".format(path))
+
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        delimiter = options['delimiter'] or (',' if path.endswith('.csv') else '\t')
+        delimiter = '\t' if delimiter in ['\\t', 'tab'] else delimiter
+
+        if path.endswith('.sql'):
+            block = copy_block(path, Prices._meta.db_table)
+            if block is None:
+                raise CommandError("{0} has no COPY block of {1}".format(path, Prices._meta.db_table))
+            columns, start, end = block
+            delimiter = '\t'
+        else:
+            with io.open(path, 'rb') as price_file:
+                first_line = price_file.readline()
+            names = [name.strip() for name in first_line.decode('utf-8', errors='replace').rstrip('\r\n').split(delimiter)]
+            # header row
+            if set(PRICE_COLUMNS) <= set(names):
+                columns, start = names, len(first_line)
+            else:
+                columns, start = [name.strip() for name in options['columns'].split(',')], 0
+            end = size
+
+        missing = [name for name in PRICE_COLUMNS if name not in columns]
+        if missing:
+            raise CommandError("{0} has no {1} column".format(path, ", ".join(missing)))
+
+        return {
+                "path": path,
+                "size": size,
+                "start": start,
+                "end": end,
+                "delimiter": delimiter,
+                "indexes": [columns.index(name) for name in PRICE_COLUMNS],
+                "width": len(columns)
+                }
+
+    def load(self, layout, method, lanes, options):
+        '''
+        Loads the rows of a file from the position reached by the last load
+
+        Returns:
+            int: returns number of rows loaded
+        '''
+
+        path, start, end = layout['path'], layout['start'], layout['end']
+
+        checkpoint, created = PriceLoad.objects.get_or_create(path=path, defaults={"size": layout['size'], "position": start})
+        if options['restart'] and not created:
+            PriceLoad.objects.filter(pk=checkpoint.pk).update(size=layout['size'], position=start, rows=0, rejected=0)
+            checkpoint.position = start
+        elif checkpoint.size != layout['size']:
+            raise CommandError("{0} changed since it was partly loaded, use --restart to load it again".format(path))
+
+        position = max(checkpoint.position, start)
+        if position >= end:
+            self.stdout.write("{0}: already loaded".format(path))
+            return 0
+        if position > start:
+            self.stdout.write("{0}: continuing at byte {1}".format(path, position))
+
+        tasks = [(path, offset, min(offset + options['chunk_bytes'], end), layout['delimiter'], layout['indexes'], layout['width'])
+                 for offset in range(position, end, options['chunk_bytes'])]
+
+        # first and last day loaded on each lane of the file and not rolled up yet
+        file_lanes = {(orig_code, dest_code): [first_day, last_day]
+                      for orig_code, dest_code, first_day, last_day in json.loads(checkpoint.lanes)}
+
+        started = reported = time.time()
+        loaded = rejected_count = 0
+
+        for task_end, rows, rejected in self.parse(tasks, options['workers']):
+
+            for orig_code, dest_code, day, _ in rows:
+                days = lanes.setdefault((orig_code, dest_code), [day, day])
+                days[0], days[1] = min(days[0], day), max(days[1], day)
+                days = file_lanes.setdefault((orig_code, dest_code), [str(day), str(day)])
+                days[0], days[1] = min(days[0], str(day)), max(days[1], str(day))
+
+            # the rows, the position reached and the lanes waiting for the rollup are committed together
+            with transaction.atomic():
+                self.write_rows(rows, method)
+                PriceLoad.objects.filter(pk=checkpoint.pk).update(position=task_end,
+                                                                  rows=F('rows') + len(rows),
+                                                                  rejected=F('rejected') + len(rejected),
+                                                                  rollup_done=False if rows else F('rollup_done'),
+                                                                  lanes=json.dumps([list(lane) + days for lane, days in sorted(file_lanes.items())]))
+
+            for offset, error in rejected[:max(MAX_REJECTED_LINES - rejected_count, 0)]:
+                self.stderr.write("{0}@{1}: {2}".format(path, offset, error))
+
+            loaded += len(rows)
+            rejected_count += len(rejected)
+
+            # progress
+            now = time.time()
+            if now - reported >= PROGRESS_INTERVAL or task_end >= end:
+                reported = now
+                self.stdout.write("{0}: {1:5.1f}% {2} rows, {3} rejected, {4:.0f} rows/s".format(
+                                    path, 100.0 * (task_end - start) / (end - start),
+                                    loaded, rejected_count, loaded / (now - started) if now > started else 0))
+
+        return loaded
+
+    def parse(self, tasks, workers):
+        '''
+        Takes the byte ranges of a file and yields their parsed rows in file order,
+        with at most two ranges per worker parsed ahead of the writes
+        '''
+
+        if workers <= 1:
+            for task in tasks:
+                yield parse_range(task)
+            return
+
+        # forked or spawned workers only need the apps, never the database
+        pool = multiprocessing.Pool(workers, initializer=django.setup)
+        try:
+            tasks = iter(tasks)
+            pending = deque(pool.apply_async(parse_range, (task,)) for _, task in zip(range(2 * workers), tasks))
+            while pending:
+                result = pending.popleft().get()
+                for task in tasks:
+                    pending.append(pool.apply_async(parse_range, (task,)))
+                    break
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def write_rows(self, rows, method):
+        '''
+        Takes parsed prices and writes them with COPY or batched INSERTs
+        '''
+
+        if method == 'copy':
+            copy_prices(rows)
+        else:
+            # without building a model instance per row
+            with connection.cursor() as cursor:
+                cursor.executemany(INSERT_QUERY.format(table=Prices._meta.db_table), rows)
+
+    def index_names(self):
+        '''
+        Returns the names of the indexes and constraints of api_prices
+        '''
+
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, Prices._meta.db_table))
+
+    def drop_indexes(self):
+        '''
+        Drops the indexes of api_prices, a load interrupted before
+        creating them again leaves them dropped
+        '''
+
+        existing = self.index_names()
+
+        with connection.schema_editor() as editor:
+            for index in Prices._meta.indexes:
+                if index.name in existing:
+                    editor.remove_index(Prices, index)
+
+    def create_indexes(self):
+        '''
+        Creates the indexes of api_prices which are missing
+        '''
+
+        existing = self.index_names()
+
+        with connection.schema_editor() as editor:
+            for index in Prices._meta.indexes:
+                if index.name not in existing:
+                    editor.add_index(Prices, index)
@@ -0,0 +1,25 @@
+# Django imports
+from django.core.management.base import BaseCommand
+
+# local imports
+from api.models import DailyLaneSketch, RegionPairRollup
+from api.rollup import rebuild_rollup
+
+
+class Command(BaseCommand):
+    '''
+    Recomputes the daily lane rollup and the quantile sketches
+    from the Prices table and the materialized region pairs from the rollup
+
+    Usage:
+        python manage.py rebuild_rollup
+    '''
+
+    help = "Rebuild the daily lane rollup from api_prices"
+
+    def handle(self, *args, **options):
+
+        lane_days = rebuild_rollup()
+
+        self.stdout.write("rebuilt {0} lane days, {1} region pair days and {2} sketches".format(
+                            lane_days, RegionPairRollup.objects.count(), DailyLaneSketch.objects.count()))
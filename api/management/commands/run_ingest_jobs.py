@@ -0,0 +1,85 @@
+# Django imports
+from django.db import close_old_connections, connections
+from django.core.management.base import BaseCommand
+
+# local imports
+from api.jobs import drain_jobs, ingest_workers
+
+# other imports
+import time
+import logging
+import django
+import multiprocessing
+
+
+logger = logging.getLogger(__name__)
+
+
+def work(poll_interval, once):
+    '''
+    Drains the job queue, then looks for new jobs
+    every poll_interval seconds unless once is set
+    '''
+
+    # spawned processes start without the apps
+    django.setup()
+
+    while True:
+        try:
+            drain_jobs()
+        except Exception:
+            # ie: the database went away, looked for again on the next poll
+            logger.exception("ingest worker failed")
+            if once:
+                raise
+        finally:
+            # connections past their CONN_MAX_AGE or broken by the error
+            close_old_connections()
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    '''
+    Runs separate worker processes draining the jobs of the uploads
+    queued with ?async=true, for deployments with INGEST_WORKERS = 0
+
+    Usage:
+        python manage.py run_ingest_jobs --workers 4
+        python manage.py run_ingest_jobs --once
+    '''
+
+    help = "Insert the queued uploads in batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help="worker processes")
+        parser.add_argument('--poll-interval', type=float,
+                            help="seconds between two looks for new jobs, INGEST_JOB_POLL_INTERVAL by default")
+        parser.add_argument('--once', action='store_true',
+                            help="exit once the queue is empty")
+
+    def handle(self, *args, **options):
+
+        poll_interval = options['poll_interval'] or ingest_workers.poll_interval
+
+        if options['workers'] <= 1:
+            work(poll_interval, options['once'])
+            return
+
+        # every process opens its own connections
+        connections.close_all()
+
+        processes = [multiprocessing.Process(target=work, args=(poll_interval, options['once']),
+                                             name="ingest-worker-{0}".format(number))
+                     for number in range(options['workers'])]
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,38 @@
+# Django imports
+from django.core.management.base import BaseCommand, CommandError
+
+# local imports
+from api.snapshot import snapshot_dir, write_snapshot
+
+# other imports
+import time
+
+
+class Command(BaseCommand):
+    '''
+    Writes the Prices table into a memory mapped snapshot
+    read by the in-memory rates engine of every worker
+
+    Usage:
+        python manage.py write_price_snapshot
+    '''
+
+    help = "Write a binary snapshot of api_prices into settings.RATES_SNAPSHOT_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="snapshot directory, defaults to settings.RATES_SNAPSHOT_DIR")
+        parser.add_argument('--keep', type=int, default=2, help="number of snapshots to keep")
+
+    def handle(self, *args, **options):
+
+        directory = options['dir'] or snapshot_dir()
+        if not directory:
+            raise CommandError("set RATES_SNAPSHOT_DIR or pass --dir")
+        if options['keep'] < 1:
+            raise CommandError("--keep must be at least 1")
+
+        start = time.perf_counter()
+        meta = write_snapshot(directory, keep=options['keep'])
+
+        self.stdout.write("wrote {0} prices in {1} lanes up to id {2} in {3:.2f}s".format(
+                            meta['prices'], meta['lanes'], meta['max_id'], time.perf_counter() - start))
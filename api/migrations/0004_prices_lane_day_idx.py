@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_auto_20190615_1652'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prices',
+            index=models.Index(fields=['orig_code', 'dest_code', 'day', 'price'], name='api_prices_lane_day_idx'),
+        ),
+    ]
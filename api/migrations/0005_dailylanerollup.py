@@ -0,0 +1,36 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_prices_lane_day_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLaneRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orig_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('dest_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('day', models.DateField(verbose_name=models.Model)),
+                ('price_sum', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('price_count', models.IntegerField(default=0, verbose_name=models.Model)),
+            ],
+            options={
+                'unique_together': {('orig_code', 'dest_code', 'day')},
+            },
+        ),
+        # fill the rollup from the prices already stored
+        migrations.RunSQL(
+            sql=''' INSERT INTO api_dailylanerollup (orig_code, dest_code, day, price_sum, price_count)
+                    SELECT orig_code, dest_code, day, SUM(price), COUNT(*)
+                    FROM api_prices
+                    GROUP BY orig_code, dest_code, day
+                    ''',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
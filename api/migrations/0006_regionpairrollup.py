@@ -0,0 +1,27 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_dailylanerollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionPairRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orig_slug', models.CharField(max_length=200, verbose_name=models.Model)),
+                ('dest_slug', models.CharField(max_length=200, verbose_name=models.Model)),
+                ('day', models.DateField(verbose_name=models.Model)),
+                ('price_sum', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('price_count', models.IntegerField(default=0, verbose_name=models.Model)),
+            ],
+            options={
+                'unique_together': {('orig_slug', 'dest_slug', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_regionpairrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LaneVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orig_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('dest_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('version', models.BigIntegerField(default=0, verbose_name=models.Model)),
+            ],
+            options={
+                'unique_together': {('orig_code', 'dest_code')},
+            },
+        ),
+    ]
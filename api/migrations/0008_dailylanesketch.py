@@ -0,0 +1,47 @@
+# Generated by Django 2.2.2 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+from api.sketches import lane_day_sketches
+
+
+def fill_sketches(apps, schema_editor):
+    '''
+    Builds the sketch of every lane day from the prices already stored
+    '''
+
+    Prices = apps.get_model('api', 'Prices')
+    DailyLaneSketch = apps.get_model('api', 'DailyLaneSketch')
+
+    # prices of each lane day one after the other
+    rows = Prices.objects.values_list('orig_code', 'dest_code', 'day', 'price').order_by('orig_code', 'dest_code', 'day')
+
+    objects = [DailyLaneSketch(orig_code=orig_code, dest_code=dest_code, day=day, centroids=sketch.dumps())
+               for (orig_code, dest_code, day), sketch in lane_day_sketches(rows.iterator())]
+
+    DailyLaneSketch.objects.bulk_create(objects, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_laneversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLaneSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orig_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('dest_code', models.TextField(max_length=5, verbose_name=models.Model)),
+                ('day', models.DateField(verbose_name=models.Model)),
+                ('centroids', models.TextField(default='[]', verbose_name=models.Model)),
+            ],
+            options={
+                'unique_together': {('orig_code', 'dest_code', 'day')},
+            },
+        ),
+        # fill the sketches from the prices already stored
+        migrations.RunPython(fill_sketches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.2 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dailylanesketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, verbose_name=models.Model)),
+                ('day', models.DateField(verbose_name=models.Model)),
+                ('usd_rate', models.FloatField(verbose_name=models.Model)),
+            ],
+            options={
+                'unique_together': {('currency', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_fxrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceLoad',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(unique=True, verbose_name=models.Model)),
+                ('size', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('position', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('rows', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('rejected', models.BigIntegerField(default=0, verbose_name=models.Model)),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name=models.Model)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.2 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_priceload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name=models.Model)),
+                ('status', models.CharField(default='queued', max_length=10, verbose_name=models.Model)),
+                ('payload', models.TextField(verbose_name=models.Model)),
+                ('rows', models.IntegerField(default=0, verbose_name=models.Model)),
+                ('inserted', models.IntegerField(default=0, verbose_name=models.Model)),
+                ('attempts', models.IntegerField(default=0, verbose_name=models.Model)),
+                ('error', models.TextField(blank=True, default='', verbose_name=models.Model)),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name=models.Model)),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name=models.Model)),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name=models.Model)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ingestjob',
+            index=models.Index(fields=['status', 'id'], name='api_ingestjob_status_idx'),
+        ),
+    ]
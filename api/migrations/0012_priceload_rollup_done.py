@@ -0,0 +1,23 @@
+# Generated by Django 2.2.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='priceload',
+            name='rollup_done',
+            field=models.BooleanField(default=True, verbose_name=models.Model),
+        ),
+        migrations.AddField(
+            model_name='priceload',
+            name='lanes',
+            field=models.TextField(default='[]', verbose_name=models.Model),
+        ),
+    ]
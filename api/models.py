@@ -14,6 +14,13 @@ class Prices(models.Model):
     day         = models.DateField(models.Model)
     price       = models.IntegerField(models.Model, default=0)
 
+    class Meta:
+        # lane and day lookups of the rates API, price included
+        # so the daily average can be read from the index alone
+        indexes = [
+            models.Index(fields=['orig_code', 'dest_code', 'day', 'price'], name='api_prices_lane_day_idx'),
+        ]
+
     def get_price(self):
         return self.price
 
@@ -22,3 +29,90 @@ class Regions(models.Model):
     slug        = models.CharField(models.Model, max_length=200, primary_key=True)
     name        = models.CharField(models.Model, max_length=200)
     parent_slug = models.CharField(models.Model, max_length=200, null=True, blank=True)
+
+
+class DailyLaneRollup(models.Model):
+    orig_code   = models.TextField(models.Model, max_length=5)
+    dest_code   = models.TextField(models.Model, max_length=5)
+    day         = models.DateField(models.Model)
+    price_sum   = models.BigIntegerField(models.Model, default=0)
+    price_count = models.IntegerField(models.Model, default=0)
+
+    class Meta:
+        # one row per lane and day
+        unique_together = ('orig_code', 'dest_code', 'day')
+
+
+class RegionPairRollup(models.Model):
+    orig_slug   = models.CharField(models.Model, max_length=200)
+    dest_slug   = models.CharField(models.Model, max_length=200)
+    day         = models.DateField(models.Model)
+    price_sum   = models.BigIntegerField(models.Model, default=0)
+    price_count = models.IntegerField(models.Model, default=0)
+
+    class Meta:
+        # one row per region pair and day
+        unique_together = ('orig_slug', 'dest_slug', 'day')
+
+
+class LaneVersion(models.Model):
+    orig_code   = models.TextField(models.Model, max_length=5)
+    dest_code   = models.TextField(models.Model, max_length=5)
+    version     = models.BigIntegerField(models.Model, default=0)
+
+    class Meta:
+        # one version per lane
+        unique_together = ('orig_code', 'dest_code')
+
+
+class DailyLaneSketch(models.Model):
+    orig_code   = models.TextField(models.Model, max_length=5)
+    dest_code   = models.TextField(models.Model, max_length=5)
+    day         = models.DateField(models.Model)
+    centroids   = models.TextField(models.Model, default='[]')
+
+    class Meta:
+        # one quantile sketch per lane and day
+        unique_together = ('orig_code', 'dest_code', 'day')
+
+
+class FxRate(models.Model):
+    currency    = models.CharField(models.Model, max_length=3)
+    day         = models.DateField(models.Model)
+    usd_rate    = models.FloatField(models.Model)
+
+    class Meta:
+        # amount of the currency worth one USD on each day
+        unique_together = ('currency', 'day')
+
+
+class PriceLoad(models.Model):
+    path        = models.TextField(models.Model, unique=True)
+    size        = models.BigIntegerField(models.Model, default=0)
+    position    = models.BigIntegerField(models.Model, default=0)
+    rows        = models.BigIntegerField(models.Model, default=0)
+    rejected    = models.BigIntegerField(models.Model, default=0)
+    # False until the daily lane rollup is rebuilt after loading rows,
+    # lanes holds the [orig_code, dest_code, first_day, last_day] loaded meanwhile
+    rollup_done = models.BooleanField(models.Model, default=True)
+    lanes       = models.TextField(models.Model, default='[]')
+    updated     = models.DateTimeField(models.Model, auto_now=True)
+
+
+class IngestJob(models.Model):
+    kind        = models.CharField(models.Model, max_length=20)
+    status      = models.CharField(models.Model, max_length=10, default='queued')
+    payload     = models.TextField(models.Model)
+    rows        = models.IntegerField(models.Model, default=0)
+    inserted    = models.IntegerField(models.Model, default=0)
+    attempts    = models.IntegerField(models.Model, default=0)
+    error       = models.TextField(models.Model, blank=True, default='')
+    created     = models.DateTimeField(models.Model, auto_now_add=True)
+    started     = models.DateTimeField(models.Model, null=True, blank=True)
+    finished    = models.DateTimeField(models.Model, null=True, blank=True)
+
+    class Meta:
+        # queued jobs are claimed oldest first
+        indexes = [
+            models.Index(fields=['status', 'id'], name='api_ingestjob_status_idx'),
+        ]
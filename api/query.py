@@ -0,0 +1,336 @@
+# Django imports
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils.dateparse import parse_date
+
+# local imports
+from api.models import DailyLaneRollup, RegionPairRollup
+from api.rollup import is_materialized
+from api.regions import region_ports
+
+
+# rows fetched per round trip of a streamed response
+STREAM_CHUNK_SIZE = 500
+
+# per day totals of the lanes between two lists of port codes,
+# the lists are bound by bind_codes
+LANE_DAYS_QUERY = ''' SELECT  day, SUM(price_sum) AS price_sum, SUM(price_count) AS price_count
+                      FROM api_dailylanerollup
+                      WHERE ( day BETWEEN %s AND %s AND orig_code {origin} AND dest_code {destination} )
+                      GROUP BY day
+                      HAVING SUM(price_count) > 0
+                      ORDER BY day
+                      '''
+
+# per day totals of one item of a batch tagged with its index, the selects
+# of all the items are joined with UNION ALL and read in one round trip
+BATCH_LANE_DAYS_QUERY = ''' SELECT  %s AS item, day, SUM(price_sum) AS price_sum, SUM(price_count) AS price_count
+                            FROM api_dailylanerollup
+                            WHERE ( day BETWEEN %s AND %s AND orig_code {origin} AND dest_code {destination} )
+                            GROUP BY day
+                            HAVING SUM(price_count) > 0
+                            '''
+
+# same for a region pair in settings.MATERIALIZED_REGION_PAIRS
+BATCH_REGION_DAYS_QUERY = ''' SELECT  %s AS item, day, SUM(price_sum) AS price_sum, SUM(price_count) AS price_count
+                              FROM api_regionpairrollup
+                              WHERE ( day BETWEEN %s AND %s AND orig_slug = %s AND dest_slug = %s )
+                              GROUP BY day
+                              HAVING SUM(price_count) > 0
+                              '''
+
+
+def slug_to_code(slug):
+    '''
+    Takes slug as input and
+    finds the port codes of the slug and all its sub regions
+
+    Parameters:
+        slug (str)  : The slug.
+
+    Returns:
+        list: returns list of codes
+
+    '''
+
+    # all ports below the slug in the region tree
+    code_list = list(region_ports(slug))
+
+    # if slug is not a region enter
+    if not code_list:
+        # convert slug to a list
+        code_list = [slug]
+
+    return code_list
+
+def bind_codes(codes):
+    '''
+    Takes a list of port codes and
+    returns the condition matching a column against them with its parameters
+
+    Parameters:
+        codes (list)    : The port codes.
+
+    Returns:
+        tuple: returns (condition, list of parameters)
+    '''
+
+    # one array parameter, the same statement whatever the number of codes
+    if connection.vendor == 'postgresql':
+        return "= ANY(%s)", [list(codes)]
+
+    # one placeholder per code where arrays are not supported
+    return "IN ({0})".format(", ".join(["%s"] * len(codes))), list(codes)
+
+def batch_daily_totals(items):
+    '''
+    Takes the items of a batch request and
+    aggregates the rollup per day for every item in one query
+
+    Parameters:
+        items (list)    : The list of (date_from, date_to, origin slug, destination slug).
+
+    Returns:
+        list: returns one list of rows with day, price_sum and price_count per item
+    '''
+
+    selects, input = list(), list()
+    for item, (date_from, date_to, origin, destination) in enumerate(items):
+        # region pairs in settings.MATERIALIZED_REGION_PAIRS are read directly
+        if is_materialized(origin, destination):
+            selects.append(BATCH_REGION_DAYS_QUERY)
+            input += [item, date_from, date_to, origin, destination]
+        else:
+            origin_condition, origin_params = bind_codes(slug_to_code(slug=origin))
+            destination_condition, destination_params = bind_codes(slug_to_code(slug=destination))
+            selects.append(BATCH_LANE_DAYS_QUERY.format(origin=origin_condition, destination=destination_condition))
+            input += [item, date_from, date_to] + origin_params + destination_params
+
+    item_rows = [list() for _ in items]
+    if not selects:
+        return item_rows
+
+    for row in db_query(" UNION ALL ".join(selects) + " ORDER BY item, day", input):
+        item_rows[row.pop('item')].append(row)
+
+    return item_rows
+
+def db_query(sql_query, input):
+    '''
+    Takes the sql_query and the inputs,
+    and query the database
+
+    Parameters:
+        sql_query (str) : The sql_query.
+        input (tuple)   : The inputs for the sql_query.
+
+    Returns:
+        list: returns list of dictionary with columns as keys
+    '''
+    # connecting to database
+    with connection.cursor() as cursor:
+        # execute query along with inputs
+        cursor.execute(sql_query, input)
+        # make cursor response data into list of dictionaries
+        query_data = cursor_fetch_all(cursor)
+
+    return query_data
+
+def db_query_iter(sql_query, input):
+    '''
+    Takes the sql_query and the inputs,
+    and yields the rows from a server side cursor
+
+    Parameters:
+        sql_query (str) : The sql_query.
+        input (tuple)   : The inputs for the sql_query.
+
+    Returns:
+        generator: yields dictionary with columns as keys for each row
+    '''
+    # server side cursor where the database supports it
+    with connection.chunked_cursor() as cursor:
+        # execute query along with inputs
+        cursor.execute(sql_query, input)
+        # obtain the column names
+        column_names = [col[0] for col in cursor.description]
+        # fetch the rows chunk by chunk
+        for rows in iter(lambda: cursor.fetchmany(STREAM_CHUNK_SIZE), []):
+            for row in rows:
+                yield dict(zip(column_names, row))
+
+def cursor_fetch_all(cursor):
+    '''
+    Takes cursor object as input and
+     combines the rows and columns into list of dictionary
+
+    Parameters:
+        cursor (object) : The cursor object.
+
+    Returns:
+        list: returns list of dictionary with columns as keys
+            and rows as values
+    '''
+
+    # obtain the column names
+    column_names = [col[0] for col in cursor.description]
+    # initialize empty list
+    result_list = list()
+    # for each rows in response data
+    for row in cursor.fetchall():
+        # convert into
+        result_dict = dict(zip(column_names, row))
+        # append to result_list
+        result_list.append(result_dict)
+
+    return result_list
+
+def daily_prices(queryset):
+    '''
+    Takes a Prices queryset and
+    aggregates it per day inside the database
+
+    Parameters:
+        queryset (QuerySet) : The filtered Prices queryset.
+
+    Returns:
+        QuerySet: returns one row per day with price_sum and price_count
+    '''
+
+    # GROUP BY day with SUM(price) and COUNT(*) in a single query
+    daily_queryset = queryset.values('day').annotate(
+                                        price_sum=Sum('price'),
+                                        price_count=Count('id')
+                                        ).order_by('day')
+
+    return daily_queryset
+
+def daily_rollup(date_from, date_to, origin, destination):
+    '''
+    Takes the date range and port codes,
+    and aggregates the daily lane rollup per day
+
+    Parameters:
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (list)       : The origin port codes.
+        destination (list)  : The destination port codes.
+
+    Returns:
+        QuerySet: returns one row per day with price_sum and price_count
+    '''
+
+    # at most one rollup row per lane and day
+    daily_queryset = DailyLaneRollup.objects.filter(
+                                        day__range=[date_from, date_to],
+                                        orig_code__in=origin,
+                                        dest_code__in=destination
+                                        ).values('day').annotate(
+                                        price_sum=Sum('price_sum'),
+                                        price_count=Sum('price_count')
+                                        ).filter(price_count__gt=0).order_by('day')
+
+    return daily_queryset
+
+
+class RatesBackend(object):
+    '''
+    Source of the per day totals answering the rates endpoints,
+    every backend returns the same rows for the same request
+    '''
+
+    # name reported in the X-Rates-Backend header
+    name = None
+
+    def daily_rates(self, date_from, date_to, origin, destination, streamed=False):
+        '''
+        Takes the date range and the origin and destination slugs,
+        and aggregates the prices per day
+
+        Parameters:
+            date_from (date)    : The from date.
+            date_to (date)      : The to date.
+            origin (str)        : The origin port or region slug.
+            destination (str)   : The destination port or region slug.
+            streamed (bool)     : Whether the rows are streamed to the client.
+
+        Returns:
+            iterable: returns one row per day with day, price_sum and price_count
+        '''
+        raise NotImplementedError
+
+
+class ORMBackend(RatesBackend):
+    '''
+    Rollup tables read through the ORM, materialized region pairs directly
+    '''
+
+    name = 'orm'
+
+    def daily_rates(self, date_from, date_to, origin, destination, streamed=False):
+
+        # region pairs in settings.MATERIALIZED_REGION_PAIRS are read directly
+        if is_materialized(origin, destination):
+            return RegionPairRollup.objects.filter(
+                                            day__range=[date_from, date_to],
+                                            orig_slug=origin,
+                                            dest_slug=destination,
+                                            price_count__gt=0
+                                            ).values('day', 'price_sum', 'price_count').order_by('day')
+
+        return daily_rollup(date_from, date_to, slug_to_code(slug=origin), slug_to_code(slug=destination))
+
+
+class SQLBackend(RatesBackend):
+    '''
+    Daily lane rollup read with raw SQL, port codes bound as parameters
+    '''
+
+    name = 'sql'
+
+    def daily_rates(self, date_from, date_to, origin, destination, streamed=False):
+
+        # obtain corresponding code for slugs
+        origin_condition, origin_params = bind_codes(slug_to_code(slug=origin))
+        destination_condition, destination_params = bind_codes(slug_to_code(slug=destination))
+
+        sql_query = LANE_DAYS_QUERY.format(origin=origin_condition, destination=destination_condition)
+        input = [date_from, date_to] + origin_params + destination_params
+
+        # chunk by chunk when streamed
+        if streamed:
+            return db_query_iter(sql_query, input)
+
+        return db_query(sql_query, input)
+
+
+class NumpyBackend(RatesBackend):
+    '''
+    In-memory engine of this worker, see api.engine
+    '''
+
+    name = 'numpy'
+
+    def daily_rates(self, date_from, date_to, origin, destination, streamed=False):
+
+        # imported on first use, other backends never load NumPy
+        from api.engine import price_cube
+
+        return price_cube.daily_rates(parse_date(str(date_from)), parse_date(str(date_to)),
+                                      slug_to_code(slug=origin), slug_to_code(slug=destination))
+
+
+# backends by name
+BACKENDS = {backend.name: backend for backend in [ORMBackend(), SQLBackend(), NumpyBackend()]}
+
+
+def get_backend(name=None):
+    '''
+    Returns the backend by name, the one of settings.RATES_ENGINE by default
+    '''
+
+    if name is None:
+        name = getattr(settings, 'RATES_ENGINE', 'orm')
+
+    return BACKENDS[name]
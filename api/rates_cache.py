@@ -0,0 +1,399 @@
+# Django imports
+from django.conf import settings
+from django.db import transaction
+
+# REST imports
+from rest_framework import status
+from rest_framework.response import Response
+
+# local imports
+from api.cache import is_process_local, shared_cache, web_concurrency
+from api.etags import BACKEND_HEADER, etag_matches, not_modified, rates_window, request_date
+from api.regions import region_generation, region_ports
+
+# other imports
+import hashlib
+import datetime
+import functools
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+
+# keys of the shared tier
+SEQUENCE_KEY    = 'api:rates_cache:sequence'
+EVENT_KEY       = 'api:rates_cache:event:{0}'
+ENTRY_KEY       = 'api:rates_cache:entry:{0}'
+
+# a worker further behind than this flushes its local tier
+MAX_PENDING_EVENTS = 1000
+
+
+def event_timeout():
+    '''
+    Returns how long the invalidation events are kept in the shared tier,
+    cached responses older than that are recomputed
+    '''
+    return getattr(settings, 'RATES_CACHE_EVENT_TIMEOUT', 24 * 3600)
+
+
+def current_sequence(shared):
+    '''
+    Returns the number of the last invalidation event
+    '''
+
+    sequence = shared.get(SEQUENCE_KEY)
+
+    # first lookup or evicted from the cache
+    if sequence is None:
+        shared.add(SEQUENCE_KEY, 0, timeout=None)
+        sequence = shared.get(SEQUENCE_KEY, 0)
+
+    return sequence
+
+
+def read_events(shared, first, last):
+    '''
+    Takes a range of sequence numbers and
+    returns the invalidation events in it
+
+    Returns:
+        list: returns list of events, None if some of them expired
+    '''
+
+    if last < first:
+        return []
+    if last - first >= MAX_PENDING_EVENTS:
+        return None
+
+    keys = [EVENT_KEY.format(number) for number in range(first, last + 1)]
+    found = shared.get_many(keys)
+
+    # expired or evicted events can not be checked
+    if len(found) != len(keys):
+        return None
+
+    return [found[key] for key in keys]
+
+
+def written_lanes(shared, since, sequence):
+    '''
+    Takes the last sequence number seen by a worker and the current one,
+    and returns the lanes written by the uploads in between
+
+    Returns:
+        set: returns set of (orig_code, dest_code), None if some events expired
+    '''
+
+    events = read_events(shared, since + 1, sequence) if since <= sequence else None
+    if events is None:
+        return None
+
+    return set((orig_code, dest_code) for event in events for orig_code, dest_code, _, _ in event)
+
+
+def refresh_index(index, reload=False):
+    '''
+    Takes an in-memory index of the prices kept by each worker, ie: the NumPy
+    engine or the summary index, and applies the uploads of every worker since
+    its last refresh, reloading only the lanes they wrote
+
+    Parameters:
+        index (object)  : The index, with a lock, the sequence it was refreshed at,
+                          and load() and reload_lanes(lanes) methods.
+        reload (bool)   : Load the whole index again.
+    '''
+
+    shared = shared_cache()
+    sequence = current_sequence(shared)
+
+    with index.lock:
+        # built on first use, and loaded again when too far behind to know what changed
+        lanes = None if reload or index.sequence is None else written_lanes(shared, index.sequence, sequence)
+        if lanes is None:
+            index.load()
+        elif lanes:
+            index.reload_lanes(lanes)
+        index.sequence = sequence
+
+
+def overlaps(depends, event):
+    '''
+    Checks whether an invalidation event touches a cached response
+
+    Parameters:
+        depends (tuple) : The origin codes, destination codes, date_from and date_to of the response.
+        event (list)    : The list of (orig_code, dest_code, first_day, last_day) written by an upload.
+
+    Returns:
+        bool: returns True if a written lane and day is inside the response
+    '''
+
+    origin, destination, date_from, date_to = depends
+
+    for orig_code, dest_code, first_day, last_day in event:
+        if orig_code in origin and dest_code in destination and first_day <= date_to and last_day >= date_from:
+            return True
+
+    return False
+
+
+class RatesCache(object):
+    '''
+    Two tier cache of the rates responses, a bounded LRU in each worker
+    backed by Django's cache framework shared by all workers.
+
+    Uploads append an invalidation event with the lanes and days they wrote
+    to the shared tier, each worker replays the new events on its next lookup
+    and drops only the responses whose lanes and window they overlap.
+    '''
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.entries    = OrderedDict()
+        self.sequence   = None
+        self.stats      = Counter()
+
+    @property
+    def max_size(self):
+        # a tier private to each of several workers would miss the uploads of the others
+        if web_concurrency() > 1 and is_process_local(shared_cache()):
+            return 0
+        return getattr(settings, 'RATES_CACHE_SIZE', 1024)
+
+    def get(self, key, depends):
+        '''
+        Takes the response key and its dependencies,
+        and returns the cached (data, etag, backend name) or None
+        '''
+
+        shared = shared_cache()
+        sequence = current_sequence(shared)
+
+        with self.lock:
+            # drop local responses touched by uploads of any worker
+            self.replay(shared, sequence)
+
+            # local tier
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key][1]
+
+        # shared tier
+        entry = shared.get(ENTRY_KEY.format(key))
+        if entry is not None:
+            entry_sequence, entry_depends, data = entry
+            events = read_events(shared, entry_sequence + 1, sequence) if entry_sequence <= sequence else None
+            # valid if no upload since it was computed touches it
+            if events is not None and not any(overlaps(entry_depends, event) for event in events):
+                with self.lock:
+                    self.store_local(key, depends, data)
+                    self.stats['shared_hits'] += 1
+                return data
+
+        with self.lock:
+            self.stats['misses'] += 1
+
+        return None
+
+    def set(self, key, depends, data, sequence):
+        '''
+        Takes a computed response with the sequence number read
+        before computing it, and stores it in both tiers
+        '''
+
+        shared = shared_cache()
+        shared.set(ENTRY_KEY.format(key), (sequence, depends, data), timeout=event_timeout())
+
+        with self.lock:
+            # events replayed by another thread while this response was computed
+            if self.sequence is not None and self.sequence > sequence:
+                events = read_events(shared, sequence + 1, self.sequence)
+                if events is None or any(overlaps(depends, event) for event in events):
+                    return
+            self.store_local(key, depends, data)
+
+    def store_local(self, key, depends, data):
+        '''
+        Stores a response in the local tier, evicting the least recently used
+        '''
+
+        self.entries[key] = (depends, data)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def replay(self, shared, sequence):
+        '''
+        Applies the invalidation events this worker has not seen yet
+        '''
+
+        if self.sequence is not None and self.sequence < sequence:
+            events = read_events(shared, self.sequence + 1, sequence)
+            if events is None:
+                # too far behind to know what changed
+                self.stats['invalidations'] += len(self.entries)
+                self.entries.clear()
+            else:
+                for event in events:
+                    self.discard(event)
+        elif self.sequence is not None and self.sequence > sequence:
+            # shared tier was flushed
+            self.stats['invalidations'] += len(self.entries)
+            self.entries.clear()
+
+        self.sequence = sequence
+
+    def discard(self, event):
+        '''
+        Drops the local responses overlapping an invalidation event
+        '''
+
+        for key in [key for key, (depends, _) in self.entries.items() if overlaps(depends, event)]:
+            del self.entries[key]
+            self.stats['invalidations'] += 1
+
+    def invalidate(self, rows):
+        '''
+        Takes the written prices and
+        publishes an invalidation event for their lanes and days
+
+        Parameters:
+            rows (list) : The list of (orig_code, dest_code, day, price).
+        '''
+
+        # first and last day written on each lane
+        days = defaultdict(list)
+        for orig_code, dest_code, day, _ in rows:
+            days[(orig_code, dest_code)].append(str(day)[:10])
+        event = [(orig_code, dest_code, min(lane_days), max(lane_days))
+                 for (orig_code, dest_code), lane_days in days.items()]
+
+        if not event:
+            return
+
+        shared = shared_cache()
+        current_sequence(shared)
+        sequence = shared.incr(SEQUENCE_KEY)
+        shared.set(EVENT_KEY.format(sequence), event, timeout=event_timeout())
+
+        # this worker drops its responses right away
+        with self.lock:
+            self.discard(event)
+
+    def clear(self):
+        '''
+        Drops the local tier and the counters of this worker
+        '''
+
+        with self.lock:
+            self.entries.clear()
+            self.sequence = None
+            self.stats.clear()
+
+    def info(self):
+        '''
+        Returns the counters of this worker
+        '''
+
+        with self.lock:
+            info = {name: self.stats[name] for name in ['hits', 'shared_hits', 'misses', 'evictions', 'invalidations']}
+            info['size'] = len(self.entries)
+            info['max_size'] = self.max_size
+
+        return info
+
+
+# cache of this worker
+rates_cache = RatesCache()
+
+
+def invalidate_rates(rows):
+    '''
+    Takes the written prices and invalidates the cached responses
+    overlapping them once they are committed, other workers can not
+    see them before and the shared sequence is not locked until the commit
+
+    Parameters:
+        rows (list) : The list of (orig_code, dest_code, day, price).
+    '''
+
+    rows = list(rows)
+
+    transaction.on_commit(lambda: rates_cache.invalidate(rows))
+
+
+def flush_rates():
+    '''
+    Drops the cached responses of every worker, ie: after the rollup was rebuilt,
+    the sequence is bumped without an event, which the workers take as expired
+    events and answer by flushing their local tier and reloading their indexes
+    '''
+
+    shared = shared_cache()
+    current_sequence(shared)
+    shared.incr(SEQUENCE_KEY)
+
+
+def cache_rates(endpoint):
+    '''
+    Decorator caching the successful responses of a rates endpoint
+    keyed by (endpoint, date_from, date_to, origin, destination, format, window)
+
+    Parameters:
+        endpoint (str)  : The endpoint name.
+    '''
+
+    def decorator(view):
+
+        @functools.wraps(view)
+        def wrapper(request, date_from, date_to, origin, destination):
+
+            first_day, last_day = request_date(date_from), request_date(date_to)
+
+            # disabled, or invalid dates which are answered by the view
+            if not rates_cache.max_size or first_day is None or last_day is None:
+                return view(request, date_from, date_to, origin, destination)
+
+            window = rates_window(request)
+
+            # region tree changes give new keys
+            key_text = "{0}|{1}|{2}|{3}|{4}|{5}|{6}|{7}".format(endpoint, first_day, last_day, origin, destination,
+                                                                request.accepted_renderer.format, window, region_generation())
+            key = hashlib.md5(key_text.encode('utf-8')).hexdigest()
+
+            # lanes and days the response depends on, rolling windows read the leading days too
+            leading_days = datetime.timedelta(days=window - 1) if window else datetime.timedelta(0)
+            depends = (frozenset(region_ports(origin) or (origin,)),
+                       frozenset(region_ports(destination) or (destination,)),
+                       str(first_day - leading_days), str(last_day))
+
+            cached = rates_cache.get(key, depends)
+            if cached is not None:
+                data, etag, backend_name = cached
+                # conditional requests are answered with the lookup of the shared sequence alone
+                if etag is not None and etag_matches(request, etag):
+                    return not_modified(etag, backend_name)
+                response = Response(data, status=status.HTTP_200_OK)
+                if etag is not None:
+                    response['ETag'] = etag
+                if backend_name is not None:
+                    response[BACKEND_HEADER] = backend_name
+                return response
+
+            # uploads from now on invalidate the computed response
+            sequence = current_sequence(shared_cache())
+            response = view(request, date_from, date_to, origin, destination)
+
+            # cached with the ETag of the data versions it was computed from
+            # and the backend which answered, streamed responses are never cached
+            if response.status_code == status.HTTP_200_OK and not response.streaming:
+                rates_cache.set(key, depends, (response.data, response.get('ETag'), response.get(BACKEND_HEADER)), sequence)
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,205 @@
+# Django imports
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+# local imports
+from api.cache import shared_cache
+from api.models import Ports, Regions
+
+# other imports
+import time
+import threading
+from collections import defaultdict
+
+
+# key of the generation counter shared by all workers through the cache of settings.RATES_CACHE_ALIAS
+GENERATION_CACHE_KEY = 'api:region_closure:generation'
+
+# slug -> sorted tuple of all port codes below it, None until first use
+_closure = None
+# shared generation the closure was built at
+_closure_generation = None
+# last shared generation read by this worker, and when
+_checked_generation = None
+_checked_at = None
+_closure_lock = threading.Lock()
+
+
+def build_region_closure(ports, regions):
+    '''
+    Takes the ports and regions rows and
+    builds the closure of the region tree
+
+    Parameters:
+        ports (list)    : The list of (code, parent_slug) of every port.
+        regions (list)  : The list of (slug, parent_slug) of every region.
+
+    Returns:
+        dict: returns each slug with the sorted tuple of all
+            port codes directly or indirectly below it
+    '''
+
+    # ports directly below each slug
+    slug_ports = defaultdict(set)
+    for code, parent_slug in ports:
+        slug_ports[parent_slug].add(code)
+
+    # regions directly below each slug
+    slug_children = defaultdict(set)
+    for slug, parent_slug in regions:
+        if parent_slug:
+            slug_children[parent_slug].add(slug)
+
+    # every slug that appears in the tree
+    slugs = set(slug_ports) | set(slug_children) | set(slug for slug, _ in regions)
+
+    # initialize empty closure
+    closure = dict()
+
+    def descendants(slug, path):
+        # already resolved
+        if slug in closure:
+            return closure[slug]
+        codes = set(slug_ports.get(slug, ()))
+        for child in slug_children.get(slug, ()):
+            # skip cycles in the parent_slug data
+            if child not in path:
+                codes.update(descendants(child, path | {child}))
+        closure[slug] = codes
+        return codes
+
+    for slug in slugs:
+        descendants(slug, {slug})
+
+    return {slug: tuple(sorted(codes)) for slug, codes in closure.items()}
+
+
+def load_region_closure():
+    '''
+    Builds the region closure from the Ports and Regions tables
+
+    Returns:
+        dict: returns each slug with the sorted tuple of its port codes
+    '''
+
+    ports   = Ports.objects.values_list("code", "parent_slug")
+    regions = Regions.objects.values_list("slug", "parent_slug")
+
+    return build_region_closure(list(ports), list(regions))
+
+
+def closure_generation():
+    '''
+    Returns the generation of the Ports and Regions data shared by all workers,
+    bumped every time one of the tables changes
+    '''
+
+    cache = shared_cache()
+    generation = cache.get(GENERATION_CACHE_KEY)
+
+    # first lookup or evicted from the cache
+    if generation is None:
+        cache.add(GENERATION_CACHE_KEY, 0, timeout=None)
+        generation = cache.get(GENERATION_CACHE_KEY, 0)
+
+    return generation
+
+
+def generation_check_interval():
+    '''
+    Returns settings.REGION_GENERATION_CHECK_INTERVAL, the seconds a worker
+    trusts the shared generation it read before looking it up again
+    '''
+    return getattr(settings, 'REGION_GENERATION_CHECK_INTERVAL', 1.0)
+
+
+def region_generation():
+    '''
+    Returns the shared generation of the Ports and Regions data, looked up
+    in the shared cache at most once every settings.REGION_GENERATION_CHECK_INTERVAL
+    so the requests of a worker do not query it each time, changes made by
+    this worker are seen at once and those of other workers within the interval
+    '''
+    global _checked_generation, _checked_at
+
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= generation_check_interval():
+        _checked_generation, _checked_at = closure_generation(), now
+
+    return _checked_generation
+
+
+def region_ports(slug):
+    '''
+    Takes slug as input and
+    returns all the port codes below it in the region tree
+
+    Parameters:
+        slug (str)  : The region slug.
+
+    Returns:
+        tuple: returns tuple of port codes, empty if slug is not a region
+    '''
+    global _closure, _closure_generation
+
+    # the shared generation tells whether another worker changed the tables
+    generation = region_generation()
+
+    # build the closure lazily on first use or when stale
+    if _closure is None or _closure_generation != generation:
+        with _closure_lock:
+            if _closure is None or _closure_generation != generation:
+                _closure = load_region_closure()
+                _closure_generation = generation
+
+    return _closure.get(slug, ())
+
+
+def invalidate_region_closure(sender=None, **kwargs):
+    '''
+    Marks the region closure of every worker as stale
+    after a Ports or Regions row changed
+    '''
+
+    # bumped once more after the commit, other workers may rebuild from the uncommitted state in between
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+    # rebuilt on next use in this worker
+    clear_region_closure()
+
+
+def bump_generation():
+    '''
+    Bumps the shared generation of the Ports and Regions data
+    '''
+    global _checked_at
+
+    cache = shared_cache()
+    try:
+        cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        # key missing from the cache
+        cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+
+    # looked up again by the next request of this worker
+    _checked_at = None
+
+
+def clear_region_closure():
+    '''
+    Drops the region closure of this worker, it is rebuilt on next use
+    '''
+    global _closure, _closure_generation, _checked_at
+
+    with _closure_lock:
+        _closure = None
+        _closure_generation = None
+        _checked_at = None
+
+
+# keep the closure up to date with the dimension tables
+for model in (Ports, Regions):
+    post_save.connect(invalidate_region_closure, sender=model, dispatch_uid="region_closure_save_%s" % model.__name__)
+    post_delete.connect(invalidate_region_closure, sender=model, dispatch_uid="region_closure_delete_%s" % model.__name__)
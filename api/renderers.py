@@ -0,0 +1,72 @@
+# REST imports
+from rest_framework.utils import encoders
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+# other imports
+import json
+
+
+class NDJSONRenderer(BaseRenderer):
+    '''
+    Renders a list as newline delimited JSON, one element per line,
+    selected with `Accept: application/x-ndjson` or `?format=ndjson`
+    '''
+
+    media_type  = 'application/x-ndjson'
+    format      = 'ndjson'
+    charset     = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+
+        if data is None:
+            return b''
+
+        rows = data if isinstance(data, list) else [data]
+
+        return b''.join(json_line(row) for row in rows)
+
+
+def json_line(row):
+    '''
+    Takes a row and returns it as one line of newline delimited JSON
+    '''
+    return json.dumps(row, cls=encoders.JSONEncoder).encode('utf-8') + b'\n'
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    '''
+    Renders the rates as one array per column, ie: {"days": [...], "average_price": [...]},
+    selected with `Accept: application/vnd.rates.columnar+json` or `?format=columnar`
+    '''
+
+    media_type  = 'application/vnd.rates.columnar+json'
+    format      = 'columnar'
+
+
+class CSVRenderer(BaseRenderer):
+    '''
+    Renders the rates as CSV with a day and average_price column,
+    selected with `Accept: text/csv` or `?format=csv`
+    '''
+
+    media_type  = 'text/csv'
+    format      = 'csv'
+    charset     = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+
+        if data is None:
+            return b''
+
+        # rates columns
+        if isinstance(data, dict) and 'days' in data:
+            header = "day,average_price\n"
+            lines = ["{0},{1}\n".format(day, price) for day, price in zip(data['days'], data['average_price'])]
+        # error messages
+        else:
+            header = "error_code,error_message\n"
+            lines = ["{0},{1}\n".format(error['error_code'], json.dumps(str(error['error_message'])))
+                     for status in (data if isinstance(data, list) else [data])
+                     for error in status.get('data', {}).get('errors', [])]
+
+        return (header + "".join(lines)).encode(self.charset)
@@ -0,0 +1,462 @@
+# Django imports
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
+
+# local imports
+from api.regions import region_ports
+from api.rates_cache import flush_rates, invalidate_rates
+from api.models import DailyLaneRollup, DailyLaneSketch, LaneVersion, Ports, Prices, RegionPairRollup, Regions
+from api.sketches import TDigest, lane_day_sketches
+
+# other imports
+import threading
+from collections import defaultdict
+
+
+# upsert of the rollup rows, supported by PostgreSQL and SQLite >= 3.24
+UPSERT_QUERY = ''' INSERT INTO {table} ({orig}, {dest}, day, price_sum, price_count)
+                   VALUES {values}
+                   ON CONFLICT ({orig}, {dest}, day) DO UPDATE
+                   SET price_sum   = {table}.price_sum + excluded.price_sum,
+                       price_count = {table}.price_count + excluded.price_count
+                   '''
+
+# rebuild of the rollup from the raw prices
+REBUILD_QUERY = ''' INSERT INTO {rollup} (orig_code, dest_code, day, price_sum, price_count)
+                    SELECT orig_code, dest_code, day, SUM(price), COUNT(*)
+                    FROM {prices}
+                    GROUP BY orig_code, dest_code, day
+                    '''
+
+# rebuild of one region pair from the daily lane rollup
+REBUILD_REGION_PAIR_QUERY = ''' INSERT INTO {region_rollup} (orig_slug, dest_slug, day, price_sum, price_count)
+                                SELECT %s, %s, day, SUM(price_sum), SUM(price_count)
+                                FROM {rollup}
+                                WHERE ( orig_code IN ({origin}) AND dest_code IN ({destination}) )
+                                GROUP BY day
+                                '''
+
+# bump of the data version of the written lanes
+VERSION_QUERY = ''' INSERT INTO {table} (orig_code, dest_code, version)
+                    VALUES {values}
+                    ON CONFLICT (orig_code, dest_code) DO UPDATE
+                    SET version = {table}.version + 1
+                    '''
+
+# bump of the data version of every lane with prices,
+# WHERE true tells SQLite the ON CONFLICT is not part of the SELECT
+REBUILD_VERSION_QUERY = ''' INSERT INTO {table} (orig_code, dest_code, version)
+                            SELECT DISTINCT orig_code, dest_code, 1
+                            FROM {prices}
+                            WHERE true
+                            ON CONFLICT (orig_code, dest_code) DO UPDATE
+                            SET version = {table}.version + 1
+                            '''
+
+# rows per upsert statement
+UPSERT_BATCH_SIZE = 500
+
+# parameters per lane day filter, below the 999 of older SQLite
+LANE_FILTER_PARAMS = 500
+
+
+def upsert_totals(model, orig_column, dest_column, totals):
+    '''
+    Takes the sum and count of each key and
+    adds them into a rollup table
+
+    Parameters:
+        model (Model)       : The rollup model.
+        orig_column (str)   : The origin key column.
+        dest_column (str)   : The destination key column.
+        totals (dict)       : The (origin, destination, day) keys with [price_sum, price_count].
+    '''
+
+    # same lock order as every other upload, concurrent ones can not deadlock
+    keys = sorted(totals)
+    query = UPSERT_QUERY.format(table=model._meta.db_table, orig=orig_column, dest=dest_column, values='{values}')
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+            batch = keys[start:start + UPSERT_BATCH_SIZE]
+            # one placeholder group per key
+            values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+            params = list()
+            for key in batch:
+                params.extend(key)
+                params.extend(totals[key])
+            cursor.execute(query.format(values=values), params)
+
+
+def bump_lane_versions(lanes):
+    '''
+    Takes the written lanes and
+    increments their data version
+
+    Parameters:
+        lanes (list)    : The list of (orig_code, dest_code).
+    '''
+
+    lanes = sorted(set(lanes))
+    table = LaneVersion._meta.db_table
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(lanes), UPSERT_BATCH_SIZE):
+            batch = lanes[start:start + UPSERT_BATCH_SIZE]
+            # new lanes start at version 1
+            values = ", ".join(["(%s, %s, 1)"] * len(batch))
+            params = [code for lane in batch for code in lane]
+            cursor.execute(VERSION_QUERY.format(table=table, values=values), params)
+
+
+def lane_day_filters(keys):
+    '''
+    Takes (orig_code, dest_code, day) keys and returns the filters
+    matching them, one term per lane and at most LANE_FILTER_PARAMS
+    parameters per filter, SQLite refuses too large expression trees
+
+    Returns:
+        list: returns list of Q
+    '''
+
+    days = defaultdict(set)
+    for orig_code, dest_code, day in keys:
+        days[(orig_code, dest_code)].add(day)
+
+    # lanes with many days are split into several terms
+    terms = list()
+    for (orig_code, dest_code), lane_days in sorted(days.items()):
+        lane_days = sorted(lane_days)
+        for start in range(0, len(lane_days), LANE_FILTER_PARAMS - 2):
+            term_days = lane_days[start:start + LANE_FILTER_PARAMS - 2]
+            # orig_code, dest_code and the days of the term
+            terms.append((2 + len(term_days), Q(orig_code=orig_code, dest_code=dest_code, day__in=term_days)))
+
+    filters, lane_filter, params = list(), Q(), 0
+    for term_params, term in terms:
+        if params and params + term_params > LANE_FILTER_PARAMS:
+            filters.append(lane_filter)
+            lane_filter, params = Q(), 0
+        lane_filter |= term
+        params += term_params
+
+    if params:
+        filters.append(lane_filter)
+
+    return filters
+
+
+def rebuild_sketches(keys=None):
+    '''
+    Recomputes the quantile sketches of the given lane days,
+    of every lane day without keys, from the Prices table
+
+    Parameters:
+        keys (list) : The list of (orig_code, dest_code, day).
+
+    Returns:
+        int: returns number of sketches written
+    '''
+
+    # every lane day at once, or the lane days of each filter
+    filters = [Q()] if keys is None else lane_day_filters(keys)
+
+    written = 0
+    with transaction.atomic():
+        for lane_filter in filters:
+            # prices of each lane day one after the other
+            rows = Prices.objects.filter(lane_filter).values_list('orig_code', 'dest_code', 'day', 'price').order_by(
+                                                                 'orig_code', 'dest_code', 'day')
+
+            DailyLaneSketch.objects.filter(lane_filter).delete()
+            objects = [DailyLaneSketch(orig_code=orig_code, dest_code=dest_code, day=day, centroids=sketch.dumps())
+                       for (orig_code, dest_code, day), sketch in lane_day_sketches(rows.iterator())]
+            DailyLaneSketch.objects.bulk_create(objects, batch_size=UPSERT_BATCH_SIZE)
+            written += len(objects)
+
+    return written
+
+
+def update_sketches(rows, sign=1):
+    '''
+    Takes the written prices and adds them into the
+    quantile sketches of their lane days, sketches can not
+    forget a price so the lane days of deleted prices are rebuilt
+
+    Parameters:
+        rows (list) : The list of (orig_code, dest_code, day, price).
+        sign (int)  : 1 for inserted prices, -1 for deleted prices.
+    '''
+
+    # prices of each lane day
+    prices = defaultdict(list)
+    for orig_code, dest_code, day, price in rows:
+        prices[(orig_code, dest_code, day)].append(price)
+
+    if sign < 0:
+        rebuild_sketches(list(prices))
+        return
+
+    if not prices:
+        return
+
+    with transaction.atomic():
+        # stored sketches of the lane days, locked until the commit
+        stored = {(sketch.orig_code, sketch.dest_code, sketch.day): sketch
+                  for lane_filter in lane_day_filters(prices)
+                  for sketch in DailyLaneSketch.objects.select_for_update().filter(lane_filter)}
+
+        created = list()
+        for key, lane_day_prices in prices.items():
+            sketch = TDigest.loads(stored[key].centroids) if key in stored else TDigest()
+            sketch.add(lane_day_prices)
+            if key in stored:
+                stored[key].centroids = sketch.dumps()
+            else:
+                created.append(DailyLaneSketch(orig_code=key[0], dest_code=key[1], day=key[2], centroids=sketch.dumps()))
+
+        DailyLaneSketch.objects.bulk_update(list(stored.values()), ['centroids'], batch_size=UPSERT_BATCH_SIZE)
+        DailyLaneSketch.objects.bulk_create(created, batch_size=UPSERT_BATCH_SIZE)
+
+
+def materialized_region_pairs():
+    '''
+    Returns the region pairs of settings.MATERIALIZED_REGION_PAIRS
+    with the port codes of each side
+
+    Returns:
+        list: returns list of (orig_slug, dest_slug, origin codes, destination codes)
+    '''
+
+    pairs = list()
+    for orig_slug, dest_slug in getattr(settings, 'MATERIALIZED_REGION_PAIRS', []):
+        pairs.append((orig_slug, dest_slug, set(region_ports(orig_slug)), set(region_ports(dest_slug))))
+
+    return pairs
+
+
+def is_materialized(orig_slug, dest_slug):
+    '''
+    Checks whether the region pair is kept in the RegionPairRollup table
+    '''
+    return (orig_slug, dest_slug) in [tuple(pair) for pair in getattr(settings, 'MATERIALIZED_REGION_PAIRS', [])]
+
+
+def add_to_rollup(rows, sign=1):
+    '''
+    Takes the inserted prices and
+    adds them into the daily lane rollup,
+    the materialized region pairs and the quantile sketches,
+    bumps the lane versions and invalidates the cached rates responses
+
+    Parameters:
+        rows (list) : The list of (orig_code, dest_code, day, price).
+        sign (int)  : 1 for inserted prices, -1 for deleted prices.
+
+    Returns:
+        int: returns number of lane days updated
+    '''
+
+    rows = list(rows)
+
+    # sum and count of each lane day
+    totals = defaultdict(lambda: [0, 0])
+    for orig_code, dest_code, day, price in rows:
+        total = totals[(orig_code, dest_code, day)]
+        total[0] += sign * price
+        total[1] += sign
+
+    # sum and count of each materialized region pair day
+    region_totals = defaultdict(lambda: [0, 0])
+    for orig_slug, dest_slug, origin, destination in materialized_region_pairs():
+        for (orig_code, dest_code, day), (price_sum, price_count) in totals.items():
+            # lane below both regions of the pair
+            if orig_code in origin and dest_code in destination:
+                total = region_totals[(orig_slug, dest_slug, day)]
+                total[0] += price_sum
+                total[1] += price_count
+
+    with transaction.atomic():
+        upsert_totals(DailyLaneRollup, 'orig_code', 'dest_code', totals)
+        upsert_totals(RegionPairRollup, 'orig_slug', 'dest_slug', region_totals)
+        update_sketches(rows, sign)
+        bump_lane_versions((orig_code, dest_code) for orig_code, dest_code, _ in totals)
+
+    # drop the cached responses of the written lanes and days
+    invalidate_rates(rows)
+
+    return len(totals)
+
+
+def rebuild_region_rollup(pairs=None):
+    '''
+    Recomputes the materialized region pairs from the daily lane rollup,
+    all of them or only the given ones after the region tree changed
+
+    Parameters:
+        pairs (list)    : The (orig_slug, dest_slug) pairs to rebuild, all by default.
+
+    Returns:
+        int: returns number of region pair days in the rollup
+    '''
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if pairs is None:
+            RegionPairRollup.objects.all().delete()
+        else:
+            for orig_slug, dest_slug in pairs:
+                RegionPairRollup.objects.filter(orig_slug=orig_slug, dest_slug=dest_slug).delete()
+
+        for orig_slug, dest_slug, origin, destination in materialized_region_pairs():
+            if pairs is not None and (orig_slug, dest_slug) not in pairs:
+                continue
+            # empty regions have nothing to materialize
+            if not origin or not destination:
+                continue
+            query = REBUILD_REGION_PAIR_QUERY.format(
+                                    region_rollup=RegionPairRollup._meta.db_table,
+                                    rollup=DailyLaneRollup._meta.db_table,
+                                    origin=", ".join(["%s"] * len(origin)),
+                                    destination=", ".join(["%s"] * len(destination)))
+            cursor.execute(query, [orig_slug, dest_slug] + sorted(origin) + sorted(destination))
+
+    return RegionPairRollup.objects.count()
+
+
+def rebuild_rollup():
+    '''
+    Recomputes the daily lane rollup and the quantile sketches
+    from the Prices table, and the materialized region pairs from the rollup,
+    then flushes the rates responses cached by the workers
+
+    Returns:
+        int: returns number of lane days in the rollup
+    '''
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        DailyLaneRollup.objects.all().delete()
+        cursor.execute(REBUILD_QUERY.format(rollup=DailyLaneRollup._meta.db_table,
+                                            prices=Prices._meta.db_table))
+        # prices may have changed outside of the uploads
+        cursor.execute(REBUILD_VERSION_QUERY.format(table=LaneVersion._meta.db_table,
+                                                    prices=Prices._meta.db_table))
+        rebuild_region_rollup()
+        rebuild_sketches()
+        # cached responses and in-memory indexes of every worker are dropped
+        transaction.on_commit(flush_rates)
+
+    return DailyLaneRollup.objects.count()
+
+
+def price_row(instance):
+    '''
+    Takes a Prices instance and returns its rollup row
+    '''
+
+    # day may be given as datetime or string, and price as string
+    day = Prices._meta.get_field('day').to_python(instance.day)
+    price = Prices._meta.get_field('price').to_python(instance.price)
+
+    return (instance.orig_code, instance.dest_code, day, price)
+
+
+def remember_stored_price(sender, instance, raw=False, **kwargs):
+    '''
+    Keeps the stored values of an updated price
+    so they can be removed from the rollup after the save
+    '''
+
+    instance._rollup_stored_row = None
+    if instance.pk and not raw:
+        stored = Prices.objects.filter(pk=instance.pk).first()
+        if stored is not None:
+            instance._rollup_stored_row = price_row(stored)
+
+
+def price_saved(sender, instance, created, raw=False, **kwargs):
+    '''
+    Adds a saved price into the rollup
+    '''
+
+    if raw:
+        return
+    add_to_rollup([price_row(instance)])
+    # removed after adding, the sketch of its lane day
+    # is then rebuilt from the saved state
+    stored_row = getattr(instance, '_rollup_stored_row', None)
+    if stored_row is not None:
+        add_to_rollup([stored_row], sign=-1)
+
+
+def price_deleted(sender, instance, **kwargs):
+    '''
+    Removes a deleted price from the rollup
+    '''
+    add_to_rollup([price_row(instance)], sign=-1)
+
+
+def region_pair_ports():
+    '''
+    Returns the port codes of both sides of every materialized region pair
+    '''
+    return {(orig_slug, dest_slug): (origin, destination) for orig_slug, dest_slug, origin, destination in materialized_region_pairs()}
+
+
+def remember_region_pairs(sender, raw=False, **kwargs):
+    '''
+    Keeps the ports of the materialized region pairs
+    before a Ports or Regions row changes
+    '''
+
+    _region_pairs.ports = None
+    if not raw and getattr(settings, 'MATERIALIZED_REGION_PAIRS', []):
+        _region_pairs.ports = region_pair_ports()
+
+
+def region_tree_changed(sender, raw=False, **kwargs):
+    '''
+    Rebuilds the region pairs whose ports changed once the change is committed,
+    raw saves of loaddata are followed by `python manage.py rebuild_rollup`
+    '''
+
+    remembered, _region_pairs.ports = getattr(_region_pairs, 'ports', None), None
+    if raw or remembered is None:
+        return
+
+    transaction.on_commit(lambda: rebuild_changed_region_pairs(remembered))
+
+
+def rebuild_changed_region_pairs(remembered):
+    '''
+    Takes the ports of the materialized region pairs before a change
+    and rebuilds the pairs whose ports differ now
+
+    Returns:
+        list: returns the rebuilt (orig_slug, dest_slug) pairs
+    '''
+
+    changed = [pair for pair, ports in region_pair_ports().items() if remembered.get(pair) != ports]
+    if changed:
+        rebuild_region_rollup(changed)
+
+    return changed
+
+
+# ports of the materialized region pairs from the pre_save or pre_delete to the
+# post_save or post_delete of a Ports or Regions row, per thread
+_region_pairs = threading.local()
+
+# keep the rollup in step with prices saved one by one,
+# bulk inserts call add_to_rollup themselves
+pre_save.connect(remember_stored_price, sender=Prices, dispatch_uid="rollup_pre_save_prices")
+post_save.connect(price_saved, sender=Prices, dispatch_uid="rollup_post_save_prices")
+post_delete.connect(price_deleted, sender=Prices, dispatch_uid="rollup_post_delete_prices")
+
+# region pairs follow the region tree
+for model in (Ports, Regions):
+    pre_save.connect(remember_region_pairs, sender=model, dispatch_uid="region_rollup_pre_save_%s" % model.__name__)
+    pre_delete.connect(remember_region_pairs, sender=model, dispatch_uid="region_rollup_pre_delete_%s" % model.__name__)
+    post_save.connect(region_tree_changed, sender=model, dispatch_uid="region_rollup_save_%s" % model.__name__)
+    post_delete.connect(region_tree_changed, sender=model, dispatch_uid="region_rollup_delete_%s" % model.__name__)
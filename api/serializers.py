@@ -2,6 +2,9 @@
 from rest_framework import serializers
 
 
+# longest rolling window in days
+MAX_WINDOW = 366
+
 
 class RatesSerializer(serializers.Serializer):
 
@@ -9,6 +12,7 @@ class RatesSerializer(serializers.Serializer):
     destination    = serializers.CharField()
     date_from      = serializers.DateField()
     date_to        = serializers.DateField()
+    window         = serializers.IntegerField(required=False, min_value=1, max_value=MAX_WINDOW)
 
     def validate(self, data):
         """
@@ -22,6 +26,12 @@ class RatesSerializer(serializers.Serializer):
 
 
 
+class RatesBatchItemSerializer(RatesSerializer):
+
+    null_threshold = serializers.IntegerField(required=False, min_value=1)
+
+
+
 class UploadPricesSerializer(serializers.Serializer):
 
     origin_code         = serializers.CharField(max_length=5)
@@ -0,0 +1,139 @@
+# other imports
+import json
+
+
+# centroids kept by a sketch, lane days with fewer prices than
+# twice this are kept exactly
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest(object):
+    '''
+    Mergeable quantile sketch of a set of prices, a sorted list of
+    [mean, weight] centroids with small centroids near the tails and
+    larger ones around the median.
+
+    Sketches of many lane days merge into the sketch of their union,
+    so percentiles of a region lane never read the raw prices.
+    '''
+
+    def __init__(self, centroids=(), compression=DEFAULT_COMPRESSION):
+        self.compression    = compression
+        self.centroids      = [[float(mean), weight] for mean, weight in centroids]
+
+    @classmethod
+    def loads(cls, text):
+        '''
+        Takes the JSON text of a stored sketch and returns the sketch
+        '''
+        return cls(json.loads(text))
+
+    def dumps(self):
+        '''
+        Returns the sketch as JSON text
+        '''
+        return json.dumps(self.centroids)
+
+    @property
+    def count(self):
+        return sum(weight for _, weight in self.centroids)
+
+    def add(self, values):
+        '''
+        Takes a list of prices and adds them into the sketch
+        '''
+
+        self.centroids.extend([float(value), 1] for value in values)
+        self.compress()
+
+    def merge(self, other):
+        '''
+        Takes another sketch and adds its centroids into this one
+        '''
+
+        self.centroids.extend([mean, weight] for mean, weight in other.centroids)
+        self.compress()
+
+    def compress(self):
+        '''
+        Sorts the centroids and merges the neighbours whose
+        combined weight stays below the bound of their quantile
+        '''
+
+        total = self.count
+        merged = list()
+        cumulative = 0
+
+        for mean, weight in sorted(self.centroids):
+            if merged:
+                last = merged[-1]
+                proposed = last[1] + weight
+                # quantile at the center of the merged centroid
+                quantile = (cumulative - last[1] + proposed / 2.0) / total
+                if proposed <= 4 * total * quantile * (1 - quantile) / self.compression:
+                    last[0] += (mean - last[0]) * weight / proposed
+                    last[1] = proposed
+                    cumulative += weight
+                    continue
+            merged.append([mean, weight])
+            cumulative += weight
+
+        self.centroids = merged
+
+    def quantile(self, quantile):
+        '''
+        Takes a quantile between 0 and 1 and returns its estimated price,
+        interpolated between the centers of the neighbour centroids
+
+        Returns:
+            float: returns the price, None if the sketch is empty
+        '''
+
+        if not self.centroids:
+            return None
+
+        target = quantile * self.count
+        cumulative = 0
+        previous = None
+
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2.0
+            if target <= center:
+                if previous is None:
+                    return mean
+                previous_center, previous_mean = previous
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous = (center, mean)
+            cumulative += weight
+
+        return self.centroids[-1][0]
+
+
+def lane_day_sketches(rows):
+    '''
+    Takes the prices sorted by lane and day and
+    yields the sketch of each lane day
+
+    Parameters:
+        rows (iterator) : The (orig_code, dest_code, day, price) sorted by orig_code, dest_code and day.
+
+    Returns:
+        iterator: returns ((orig_code, dest_code, day), TDigest) per lane day
+    '''
+
+    key, prices = None, list()
+
+    for orig_code, dest_code, day, price in rows:
+        # first price of the next lane day
+        if (orig_code, dest_code, day) != key:
+            if prices:
+                sketch = TDigest()
+                sketch.add(prices)
+                yield key, sketch
+            key, prices = (orig_code, dest_code, day), list()
+        prices.append(price)
+
+    if prices:
+        sketch = TDigest()
+        sketch.add(prices)
+        yield key, sketch
@@ -0,0 +1,147 @@
+# Django imports
+from django.conf import settings
+
+# local imports
+from api.models import Prices
+from api.rates_cache import current_sequence, shared_cache
+
+# other imports
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+
+# name of the symlink pointing at the snapshot in use
+CURRENT_LINK = 'current'
+
+# files of a snapshot directory
+META_FILE   = 'meta.json'
+LANES_FILE  = 'lanes.npy'
+DAYS_FILE   = 'days.npy'
+PRICES_FILE = 'prices.npy'
+
+
+def snapshot_dir():
+    '''
+    Returns settings.RATES_SNAPSHOT_DIR, None if snapshots are disabled
+    '''
+    return getattr(settings, 'RATES_SNAPSHOT_DIR', None)
+
+
+def current_snapshot():
+    '''
+    Returns the resolved path of the snapshot in use, None if there is none
+    '''
+
+    directory = snapshot_dir()
+    if not directory:
+        return None
+
+    link = os.path.join(directory, CURRENT_LINK)
+    if not os.path.exists(link):
+        return None
+
+    return os.path.realpath(link)
+
+
+def write_snapshot(directory, keep=2):
+    '''
+    Takes a directory and writes the Prices table into a new snapshot in it,
+    then atomically points the current symlink at it
+
+    Parameters:
+        directory (str) : The snapshot directory.
+        keep (int)      : The number of snapshots to keep.
+
+    Returns:
+        dict: returns the meta data of the snapshot
+    '''
+
+    # lanes written from now on are read again from the database by the workers
+    sequence = current_sequence(shared_cache())
+
+    rows = Prices.objects.values_list('id', 'orig_code', 'dest_code', 'day', 'price').order_by()
+
+    # columns of the whole table
+    ids, orig_codes, dest_codes, days, prices = zip(*rows) if rows else ((), (), (), (), ())
+
+    # port codes as int ids
+    codes, code_ids = np.unique(np.array(orig_codes + dest_codes, dtype=object).astype(str), return_inverse=True)
+    orig_ids = code_ids[:len(orig_codes)].astype(np.int32)
+    dest_ids = code_ids[len(orig_codes):].astype(np.int32)
+
+    # days since the epoch and prices as int32
+    days = np.array(days, dtype='datetime64[D]').astype(np.int32)
+    prices = np.array(prices, dtype=np.int32)
+
+    # sort by lane then day
+    order = np.lexsort((days, dest_ids, orig_ids))
+    orig_ids, dest_ids, days, prices = orig_ids[order], dest_ids[order], days[order], prices[order]
+
+    # orig id, dest id, start and end of every lane
+    if len(days):
+        new_lane = np.r_[True, (orig_ids[1:] != orig_ids[:-1]) | (dest_ids[1:] != dest_ids[:-1])]
+        starts = np.flatnonzero(new_lane)
+        ends = np.r_[starts[1:], len(days)]
+        lanes = np.stack([orig_ids[starts], dest_ids[starts], starts, ends], axis=1).astype(np.int64)
+    else:
+        lanes = np.zeros((0, 4), dtype=np.int64)
+
+    meta = {
+            "codes": codes.tolist(),
+            "max_id": max(ids) if ids else 0,
+            "sequence": sequence,
+            "lanes": len(lanes),
+            "prices": len(days),
+            "created": time.time()
+            }
+
+    # write into a new directory
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "snapshot-{0}-{1}".format(meta['max_id'], int(meta['created'] * 1000)))
+    os.makedirs(path)
+    np.save(os.path.join(path, LANES_FILE), lanes)
+    np.save(os.path.join(path, DAYS_FILE), days)
+    np.save(os.path.join(path, PRICES_FILE), prices)
+    with open(os.path.join(path, META_FILE), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    # swap the current symlink atomically
+    link = os.path.join(directory, CURRENT_LINK)
+    temporary_link = link + '.tmp'
+    if os.path.lexists(temporary_link):
+        os.remove(temporary_link)
+    os.symlink(os.path.basename(path), temporary_link)
+    os.replace(temporary_link, link)
+
+    # remove the oldest snapshots, workers still mapping them keep their pages
+    snapshots = sorted((name for name in os.listdir(directory) if name.startswith('snapshot-')),
+                       key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+    for name in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    return meta
+
+
+def open_snapshot(path):
+    '''
+    Takes a snapshot directory and maps its arrays into memory,
+    shared through the page cache by all workers
+
+    Parameters:
+        path (str)  : The snapshot directory.
+
+    Returns:
+        tuple: returns (meta data, lanes array, days memmap, prices memmap)
+    '''
+
+    with open(os.path.join(path, META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+
+    lanes = np.load(os.path.join(path, LANES_FILE))
+    days = np.load(os.path.join(path, DAYS_FILE), mmap_mode='r')
+    prices = np.load(os.path.join(path, PRICES_FILE), mmap_mode='r')
+
+    return meta, lanes, days, prices
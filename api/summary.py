@@ -0,0 +1,194 @@
+# Django imports
+from django.db.models import Count, Max, Min, Sum
+
+# local imports
+from api.models import Prices
+from api.engine import to_day
+from api.rates_cache import refresh_index
+
+# other imports
+import threading
+import numpy as np
+
+
+def sparse_table(values, reduce):
+    '''
+    Takes an array and a pairwise reduction, ie: np.minimum,
+    and returns the levels of its sparse table, level k reducing 2**k values
+
+    Returns:
+        list: returns list of arrays
+    '''
+
+    table = [values]
+    width = 1
+    while 2 * width <= len(values):
+        previous = table[-1]
+        table.append(reduce(previous[:-width], previous[width:]))
+        width *= 2
+
+    return table
+
+
+def range_query(table, start, end, reduce):
+    '''
+    Takes a sparse table and reduces the values in [start, end) with two lookups
+    '''
+
+    level = int(end - start).bit_length() - 1
+    return reduce(table[level][start], table[level][end - (1 << level)])
+
+
+class LaneSummary(object):
+    '''
+    Summary arrays of one lane over its days with prices: cumulative sums
+    and counts for the average and count, sparse tables for min and max
+    '''
+
+    def __init__(self, rows):
+
+        # rows sorted by day
+        rows = sorted(rows)
+        self.days = np.array([to_day(day) for day, _, _, _, _ in rows], dtype=np.int32)
+
+        # cumulative sum and count, starting at 0
+        self.price_sums = np.concatenate([[0], np.cumsum([row[1] for row in rows], dtype=np.int64)])
+        self.price_counts = np.concatenate([[0], np.cumsum([row[2] for row in rows], dtype=np.int64)])
+
+        self.min_table = sparse_table(np.array([row[3] for row in rows], dtype=np.int64), np.minimum)
+        self.max_table = sparse_table(np.array([row[4] for row in rows], dtype=np.int64), np.maximum)
+
+    def summary(self, first_day, last_day):
+        '''
+        Takes a window of days since the epoch and
+        returns (price_sum, price_count, min_price, max_price), None if it is empty
+        '''
+
+        start = int(np.searchsorted(self.days, first_day, side='left'))
+        end = int(np.searchsorted(self.days, last_day, side='right'))
+
+        if start >= end:
+            return None
+
+        return (int(self.price_sums[end] - self.price_sums[start]),
+                int(self.price_counts[end] - self.price_counts[start]),
+                int(range_query(self.min_table, start, end, min)),
+                int(range_query(self.max_table, start, end, max)))
+
+
+def lane_day_rows(queryset):
+    '''
+    Takes a Prices queryset and
+    aggregates it per lane and day with sum, count, min and max
+    '''
+
+    return queryset.values('orig_code', 'dest_code', 'day').annotate(
+                                        price_sum=Sum('price'),
+                                        price_count=Count('id'),
+                                        min_price=Min('price'),
+                                        max_price=Max('price')
+                                        ).values_list('orig_code', 'dest_code', 'day', 'price_sum',
+                                                      'price_count', 'min_price', 'max_price').order_by()
+
+
+class SummaryIndex(object):
+    '''
+    Per lane summary arrays answering the average, min, max and count
+    of any window with a fixed number of lookups per lane.
+
+    Built on first use from one grouped query, the lanes written by an upload
+    of any worker are rebuilt from the invalidation events of the rates cache.
+    '''
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.lanes      = None
+        self.sequence   = None
+
+    def load(self):
+        '''
+        Builds the summary of every lane
+        '''
+
+        lane_rows = dict()
+        for orig_code, dest_code, day, price_sum, price_count, min_price, max_price in lane_day_rows(Prices.objects.all()).iterator():
+            lane_rows.setdefault((orig_code, dest_code), []).append((day, price_sum, price_count, min_price, max_price))
+
+        self.lanes = {lane: LaneSummary(rows) for lane, rows in lane_rows.items()}
+
+    def reload_lanes(self, lanes):
+        '''
+        Rebuilds the summary of the given (orig_code, dest_code) lanes
+        '''
+
+        # copy swapped once complete, as in the NumPy engine
+        summaries = dict(self.lanes)
+
+        for orig_code, dest_code in lanes:
+            rows = [row[2:] for row in lane_day_rows(Prices.objects.filter(orig_code=orig_code, dest_code=dest_code))]
+            if rows:
+                summaries[(orig_code, dest_code)] = LaneSummary(rows)
+            else:
+                summaries.pop((orig_code, dest_code), None)
+
+        self.lanes = summaries
+
+    def refresh(self):
+        '''
+        Builds the index on first use and applies the uploads since the last query
+        '''
+
+        refresh_index(self)
+
+    def summary(self, date_from, date_to, origin, destination):
+        '''
+        Takes the date range and port codes,
+        and summarizes the prices of every lane between them
+
+        Parameters:
+            date_from (date)    : The from date.
+            date_to (date)      : The to date.
+            origin (list)       : The origin port codes.
+            destination (list)  : The destination port codes.
+
+        Returns:
+            dict: returns average_price, min_price, max_price and price_count
+        '''
+
+        self.refresh()
+        summaries = self.lanes
+
+        first_day, last_day = to_day(date_from), to_day(date_to)
+
+        # combine the summary of every lane
+        price_sum, price_count, min_price, max_price = 0, 0, None, None
+        for orig_code in set(origin):
+            for dest_code in set(destination):
+                lane = summaries.get((orig_code, dest_code))
+                window = lane.summary(first_day, last_day) if lane is not None else None
+                if window is None:
+                    continue
+                price_sum += window[0]
+                price_count += window[1]
+                min_price = window[2] if min_price is None else min(min_price, window[2])
+                max_price = window[3] if max_price is None else max(max_price, window[3])
+
+        return {
+                "average_price": price_sum // price_count if price_count else None,
+                "min_price": min_price,
+                "max_price": max_price,
+                "price_count": price_count
+                }
+
+    def clear(self):
+        '''
+        Drops the index, it is built again on next use
+        '''
+
+        with self.lock:
+            self.lanes = None
+            self.sequence = None
+
+
+# summary index of this worker
+summary_index = SummaryIndex()
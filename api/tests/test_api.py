@@ -1,19 +1,74 @@
 from django.urls import reverse
-from django.test import TestCase, Client
+from django.core.signals import request_started
+from django.core.cache import cache, caches
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 # REST imports
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 # other imports
+import io
+import os
+import sys
+import json
+import logging
 import datetime
+import tempfile
+import time
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # local imports
-from api.models import Prices
+from api.views import slug_to_code
+from api.cache import DatabaseCache
+from api.checks import check_shared_cache
+from api.query import BACKENDS, bind_codes
+from api.config import configuration
+from api.fx import fx_provider, store_fx_rates
+from api.jobs import claim_jobs, drain_jobs, ingest_workers, run_jobs
+from api.management.commands import run_ingest_jobs
+from api.management.commands.benchmark_startup import measure_startup
+from api.management.commands.load_prices import Command as LoadPricesCommand
+from api.dumps import read_copy_rows
+from api.ingest import insert_prices
+from api.regions import GENERATION_CACHE_KEY, clear_region_closure, closure_generation
+from api.engine import lane_arrays, price_cube
+from api.summary import summary_index
+from api.snapshot import write_snapshot
+from api.rollup import rebuild_region_rollup, rebuild_rollup, rebuild_sketches
+from api.sketches import TDigest
+from api.rates_cache import RatesCache, current_sequence, rates_cache, shared_cache
+from api.models import DailyLaneRollup, DailyLaneSketch, FxRate, IngestJob, Ports, PriceLoad, Prices, RegionPairRollup, Regions
 
 # initialize client
 client = Client()
 
+logger = logging.getLogger(__name__)
+
+# shared tier in memory, so the query counts cover the prices only
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+def run_on_commit(test_class):
+    '''
+    TestCase never commits, the on_commit callbacks of the tests and their setUp,
+    ie: the invalidation events of the uploads, run at once as in autocommit
+    '''
+
+    run_at_once = mock.patch('django.db.transaction.on_commit', lambda callback, using=None: callback())
+    test_class.setUp = run_at_once(test_class.setUp)
+
+    return run_at_once(test_class)
+
 # Test Prices Model
 class PricesTest(TestCase):
     '''
@@ -155,6 +210,7 @@ class Test_A_UploadPriceAPI(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 # POST API upload_usd_price Test
+@override_settings(FX_RATE_PROVIDER='api.fx.StubFxRateProvider', FX_STUB_RATES={'USD': 1.0, 'INR': 70.0})
 class Test_B_UploadUSDPriceAPI(APITestCase):
 
     # initialize inputs
@@ -389,3 +445,1897 @@ class Test_D_RatesNullAPI(APITestCase):
 
         # checking wether the response is success
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+# GET API rates_sql Test
+@run_on_commit
+class Test_E_RatesSqlAPI(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # three prices on the first day, one on the second
+        for price in [10, 20, 31]:
+            Prices.objects.create(
+                orig_code='CNGGZ',
+                dest_code='EETLL',
+                day=datetime.datetime.strptime('2016-01-01', '%Y-%m-%d'),
+                price=price
+                )
+
+        Prices.objects.create(
+            orig_code='CNGGZ',
+            dest_code='EETLL',
+            day=datetime.datetime.strptime('2016-01-02', '%Y-%m-%d'),
+            price=20
+            )
+
+    def test_valid_rates_sql(self):
+
+        # structure of the output data
+        output_data = [{
+                        "status": "success",
+                        "data": [{
+                            "day": "2016-01-01",
+                            "average_price": 20
+                        }, {
+                            "day": "2016-01-02",
+                            "average_price": 20
+                        }]
+                    }]
+
+        # url to be tested
+        url = reverse('rates_sql', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+        # Obtaining the GET response
+        response = self.client.get(url)
+
+        # checking weather the outputa data is as per the requirement
+        self.assertEqual(response.data, output_data)
+
+        # checking wether the response is success
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_rates_null_threshold(self):
+
+        # structure of the output data
+        output_data = [{
+                        "status": "success",
+                        "data": [{
+                            "day": "2016-01-01",
+                            "average_price": 20
+                        }, {
+                            "day": "2016-01-02",
+                            "average_price": "null"
+                        }]
+                    }]
+
+        # url to be tested
+        url = reverse('rates_null', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+        # Obtaining the GET response
+        response = self.client.get(url)
+
+        # checking weather the outputa data is as per the requirement
+        self.assertEqual(response.data, output_data)
+
+        # checking wether the response is success
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+# Region closure Test
+@override_settings(CACHES=LOCAL_CACHES)
+class Test_F_RegionClosure(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure is kept per process, start from the test data
+        clear_region_closure()
+
+        Regions.objects.create(slug='northern_europe', name='Northern Europe', parent_slug=None)
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug='northern_europe')
+        Regions.objects.create(slug='stockholm_area', name='Stockholm Area', parent_slug='scandinavia')
+
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='stockholm_area')
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='EETLL', name='Tallinn', parent_slug='northern_europe')
+
+    def tearDown(self):
+
+        # drop the closure built from the rolled back test data
+        clear_region_closure()
+
+    def test_slug_to_code(self):
+
+        # parent regions include the ports of all sub regions
+        self.assertEqual(slug_to_code('northern_europe'), ['EETLL', 'SEGOT', 'SESTO'])
+        self.assertEqual(slug_to_code('scandinavia'), ['SEGOT', 'SESTO'])
+        self.assertEqual(slug_to_code('stockholm_area'), ['SESTO'])
+
+        # port codes are returned as they are
+        self.assertEqual(slug_to_code('CNGGZ'), ['CNGGZ'])
+
+        # resolving does not query the database once the closure is built
+        with self.assertNumQueries(0):
+            slug_to_code('northern_europe')
+
+    def test_closure_update(self):
+
+        # warm up the closure
+        slug_to_code('scandinavia')
+
+        # new port below a sub region
+        Ports.objects.create(code='NOOSL', name='Oslo', parent_slug='stockholm_area')
+        self.assertEqual(slug_to_code('scandinavia'), ['NOOSL', 'SEGOT', 'SESTO'])
+
+        # moving a region moves its ports
+        Regions.objects.filter(slug='stockholm_area').update(parent_slug=None)
+        Regions.objects.get(slug='stockholm_area').save()
+        self.assertEqual(slug_to_code('scandinavia'), ['SEGOT'])
+
+    def test_shared_generation(self):
+
+        # warm up the closure
+        slug_to_code('scandinavia')
+
+        # rows written without signals, ie: by another process
+        Ports.objects.bulk_create([Ports(code='NOOSL', name='Oslo', parent_slug='scandinavia')])
+        self.assertEqual(slug_to_code('scandinavia'), ['SEGOT', 'SESTO'])
+
+        # another worker bumps the shared generation, seen after the check interval
+        cache.incr(GENERATION_CACHE_KEY)
+        self.assertEqual(slug_to_code('scandinavia'), ['SEGOT', 'SESTO'])
+        with self.settings(REGION_GENERATION_CHECK_INTERVAL=0):
+            self.assertEqual(slug_to_code('scandinavia'), ['NOOSL', 'SEGOT', 'SESTO'])
+
+    def test_rates_query_count(self):
+
+        # url to be tested
+        url = reverse('rates', args=("2016-01-01", "2016-01-02", "northern_europe", "scandinavia"))
+
+        # warm up the closure
+        slug_to_code('northern_europe')
+
+        # only the lane versions and prices queries are left on the request path
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        # checking wether the response is success
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+# Daily lane rollup Test
+class Test_G_DailyLaneRollup(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        self.valid_input = {"date_from": "2016-01-01",
+                            "date_to": "2016-01-02",
+                            "origin_code": "CNGGZ",
+                            "destination_code": "EETLL",
+                            "price": [217, 315]
+                            }
+
+    def get_rollup(self):
+
+        # rollup rows as tuples
+        return list(DailyLaneRollup.objects.order_by('day').values_list(
+                        'orig_code', 'dest_code', 'day', 'price_sum', 'price_count'))
+
+    def test_upload_updates_rollup(self):
+
+        # upload twice
+        self.client.post(reverse('upload_price'), self.valid_input, format='json')
+        self.client.post(reverse('upload_price'), self.valid_input, format='json')
+
+        self.assertEqual(self.get_rollup(), [
+                        ('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 434, 2),
+                        ('CNGGZ', 'EETLL', datetime.date(2016, 1, 2), 630, 2),
+                        ])
+
+    def test_update_and_delete(self):
+
+        price = Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=10)
+        Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=20)
+
+        # changing a price replaces it in the rollup
+        price.price = 40
+        price.save()
+        self.assertEqual(self.get_rollup(), [('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 60, 2)])
+
+        # deleting a price removes it from the rollup
+        price.delete()
+        self.assertEqual(self.get_rollup(), [('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 20, 1)])
+
+    def test_rebuild(self):
+
+        # bulk inserts do not go through the signals
+        Prices.objects.bulk_create([
+            Prices(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=10),
+            Prices(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=21),
+            ])
+        self.assertEqual(self.get_rollup(), [])
+
+        self.assertEqual(rebuild_rollup(), 1)
+        self.assertEqual(self.get_rollup(), [('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 31, 2)])
+
+    def test_string_price(self):
+
+        # saved prices given as strings are added as int
+        Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day='2016-01-01', price="5")
+        self.assertEqual(self.get_rollup(), [('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 5, 1)])
+
+# Region pair rollup Test
+@override_settings(MATERIALIZED_REGION_PAIRS=[('china_main', 'scandinavia')], CACHES=LOCAL_CACHES)
+class Test_H_RegionPairRollup(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure is kept per process, start from the test data
+        clear_region_closure()
+
+        Regions.objects.create(slug='china_main', name='China Main', parent_slug=None)
+        Regions.objects.create(slug='china_south_main', name='China South Main', parent_slug='china_main')
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+
+        Ports.objects.create(code='CNGGZ', name='Guangzhou', parent_slug='china_south_main')
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, prices in [('SEGOT', [10, 20]), ('SESTO', [30, 40]), ('EETLL', [50, 60])]:
+            self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                       "date_to": "2016-01-02",
+                                                       "origin_code": "CNGGZ",
+                                                       "destination_code": destination_code,
+                                                       "price": prices}, format='json')
+
+    def tearDown(self):
+
+        # drop the closure built from the rolled back test data
+        clear_region_closure()
+
+    def test_uploads_update_region_pair(self):
+
+        # only the lanes below both regions are aggregated
+        self.assertEqual(list(RegionPairRollup.objects.order_by('day').values_list('day', 'price_sum', 'price_count')), [
+                        (datetime.date(2016, 1, 1), 40, 2),
+                        (datetime.date(2016, 1, 2), 60, 2),
+                        ])
+
+    def test_rates_from_region_pair(self):
+
+        # url to be tested
+        url = reverse('rates', args=("2016-01-01", "2016-01-02", "china_main", "scandinavia"))
+
+        # lane versions and a single query on the region pair rollup
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        # same result as the lane rollup
+        with self.settings(MATERIALIZED_REGION_PAIRS=[], RATES_CACHE_SIZE=0):
+            self.assertEqual(response.data, self.client.get(url).data)
+
+        self.assertEqual(response.data[0]["data"], [{"day": "2016-01-01", "average_price": 20},
+                                                    {"day": "2016-01-02", "average_price": 30}])
+
+    def test_batch_with_region_pair(self):
+
+        items = [{"date_from": "2016-01-01", "date_to": "2016-01-02", "origin": "china_main", "destination": "scandinavia"},
+                 {"date_from": "2016-01-02", "date_to": "2016-01-02", "origin": "CNGGZ", "destination": "EETLL", "window": 2}]
+
+        # lanes and region pairs of all the items in one query
+        slug_to_code('scandinavia')
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('rates_batch'), items, format='json')
+
+        self.assertEqual([item["data"] for item in response.data[0]["data"]], [
+                        [{"day": "2016-01-01", "average_price": 20}, {"day": "2016-01-02", "average_price": 30}],
+                        [{"day": "2016-01-02", "average_price": 55}],
+                        ])
+
+# Region tree change Test, the region pairs are rebuilt on commit
+@override_settings(MATERIALIZED_REGION_PAIRS=[('china_main', 'scandinavia')], CACHES=LOCAL_CACHES)
+class Test_HA_RegionTreeChange(APITransactionTestCase):
+
+    # same inputs as the region pair rollup Test
+    setUp = Test_H_RegionPairRollup.setUp
+    tearDown = Test_H_RegionPairRollup.tearDown
+
+    def test_region_tree_change(self):
+
+        with mock.patch('api.rollup.rebuild_region_rollup', wraps=rebuild_region_rollup) as rebuild:
+            # moving a port into the region rebuilds the region pair
+            Ports.objects.create(code='EETLL', name='Tallinn', parent_slug='scandinavia')
+            rebuild.assert_called_once_with([('china_main', 'scandinavia')])
+
+            # ports outside the regions of the pair leave it alone
+            Ports.objects.create(code='USNYC', name='New York', parent_slug='north_america')
+            # raw saves of loaddata wait for rebuild_rollup
+            Ports(code='SEMMA', name='Malmo', parent_slug='scandinavia').save_base(raw=True)
+            self.assertEqual(rebuild.call_count, 1)
+
+        self.assertEqual(list(RegionPairRollup.objects.order_by('day').values_list('day', 'price_sum', 'price_count')), [
+                        (datetime.date(2016, 1, 1), 90, 3),
+                        (datetime.date(2016, 1, 2), 120, 3),
+                        ])
+
+# Rates response cache Test
+@override_settings(CACHES=LOCAL_CACHES)
+@run_on_commit
+class Test_I_RatesCache(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # start from an empty local tier
+        rates_cache.clear()
+
+        Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=10)
+        Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 2), price=20)
+
+        # url to be tested
+        self.url = reverse('rates', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+    def upload(self, destination_code, date_from, date_to, prices):
+
+        # upload prices of one lane
+        self.client.post(reverse('upload_price'), {"date_from": date_from,
+                                                   "date_to": date_to,
+                                                   "origin_code": "CNGGZ",
+                                                   "destination_code": destination_code,
+                                                   "price": prices}, format='json')
+
+    def test_cache_hit(self):
+
+        first = self.client.get(self.url)
+
+        # second request is answered from the cache
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(rates_cache.info()['hits'], 1)
+
+        # shared tier answers a worker with an empty local tier
+        rates_cache.clear()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.assertEqual(rates_cache.info()['shared_hits'], 1)
+        self.assertEqual(rates_cache.info()['hits'], 0)
+
+    def test_upload_invalidation(self):
+
+        self.client.get(self.url)
+
+        # other lane and days outside the window keep the response
+        self.upload("SEGOT", "2016-01-01", "2016-01-02", [1, 2])
+        self.upload("EETLL", "2016-01-03", "2016-01-04", [1, 2])
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        # overlapping upload drops it
+        self.upload("EETLL", "2016-01-02", "2016-01-03", [40, 50])
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[0]["data"][1], {"day": "2016-01-02", "average_price": 30})
+
+    def test_other_worker_invalidation(self):
+
+        self.client.get(self.url)
+
+        # another worker publishes an overlapping upload
+        RatesCache().invalidate([('CNGGZ', 'EETLL', datetime.date(2016, 1, 1), 0)])
+
+        # the local response is dropped on next lookup
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+        self.assertEqual(rates_cache.info()['invalidations'], 1)
+
+    def test_rebuild_invalidation(self):
+
+        self.client.get(self.url)
+
+        # prices written without the signals, then the rollup rebuilt
+        Prices.objects.bulk_create([Prices(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=30)])
+        rebuild_rollup()
+
+        # every cached response is dropped
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[0]["data"][0], {"day": "2016-01-01", "average_price": 20})
+        self.assertEqual(rates_cache.info()['hits'], 0)
+
+    def test_stale_set(self):
+
+        key, depends = 'stale', (frozenset(['CNGGZ']), frozenset(['EETLL']), '2016-01-01', '2016-01-02')
+        sequence = current_sequence(shared_cache())
+
+        # an overlapping upload replayed by another thread while the response was computed
+        RatesCache().invalidate([('CNGGZ', 'EETLL', datetime.date(2016, 1, 2), 0)])
+        rates_cache.get('other', depends)
+        rates_cache.set(key, depends, 'stale data', sequence)
+
+        # neither tier answers with it
+        self.assertIsNone(rates_cache.get(key, depends))
+
+    @override_settings(RATES_CACHE_SIZE=1)
+    def test_eviction(self):
+
+        self.client.get(self.url)
+        self.client.get(reverse('rates_null', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL")))
+
+        info = self.client.get(reverse('rates_cache_stats')).data[0]["data"]
+        self.assertEqual((info['size'], info['evictions'], info['misses']), (1, 1, 2))
+
+# Rates ETag Test
+@override_settings(CACHES=LOCAL_CACHES)
+@run_on_commit
+class Test_J_RatesETag(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure and cache are kept per process, start from the test data
+        clear_region_closure()
+        rates_cache.clear()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        Prices.objects.create(orig_code='CNGGZ', dest_code='SEGOT', day=datetime.date(2016, 1, 1), price=10)
+
+        # url to be tested
+        self.url = reverse('rates', args=("2016-01-01", "2016-01-02", "CNGGZ", "scandinavia"))
+
+    def tearDown(self):
+
+        # drop the closure built from the rolled back test data
+        clear_region_closure()
+
+    def upload(self, destination_code):
+
+        # upload prices of one lane
+        self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                   "date_to": "2016-01-02",
+                                                   "origin_code": "CNGGZ",
+                                                   "destination_code": destination_code,
+                                                   "price": [20, 30]}, format='json')
+
+    def test_not_modified(self):
+
+        etag = self.client.get(self.url)['ETag']
+
+        # answered from the cached ETag
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # answered from the lane versions alone
+        with self.settings(RATES_CACHE_SIZE=0):
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other", W/%s' % etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_region_lane_upload(self):
+
+        etag = self.client.get(self.url)['ETag']
+
+        # upload on any port pair of the region lane changes the ETag
+        self.upload("SESTO")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # lanes outside the region keep it
+        etag = response['ETag']
+        self.upload("EETLL")
+        with self.settings(RATES_CACHE_SIZE=0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_invalid_day(self):
+
+        # well formed dates which are not days are rejected by the serializer
+        for name in ['rates', 'rates_null', 'rates_sql', 'rates_summary', 'rates_percentile']:
+            for date_from in ["2016-02-30", "2016-13-01"]:
+                response = self.client.get(reverse(name, args=(date_from, "2016-03-01", "CNGGZ", "scandinavia")))
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (name, date_from))
+
+# POST API rates batch Test
+@override_settings(CACHES=LOCAL_CACHES)
+class Test_K_RatesBatchAPI(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure is kept per process, start from the test data
+        clear_region_closure()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, price in [('SEGOT', 10), ('SESTO', 20), ('SESTO', 30), ('EETLL', 40)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, 1), price=price)
+        Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 2), price=50)
+
+        self.valid_input = [{"date_from": "2016-01-01", "date_to": "2016-01-02", "origin": "CNGGZ", "destination": "EETLL"},
+                            {"date_from": "2016-01-01", "date_to": "2016-01-02", "origin": "CNGGZ", "destination": "scandinavia",
+                             "null_threshold": 3},
+                            {"date_from": "2016-01-02", "date_to": "2016-01-01", "origin": "CNGGZ", "destination": "EETLL"},
+                            {"date_from": "2016-01-02", "date_to": "2016-01-02", "origin": "CNGGZ", "destination": "EETLL"}]
+
+    def tearDown(self):
+
+        # drop the closure built from the rolled back test data
+        clear_region_closure()
+
+    def test_valid_batch(self):
+
+        # structure of the output data
+        output_data = [{
+                        "status": "success",
+                        "data": [{
+                            "status": "success",
+                            "data": [{"day": "2016-01-01", "average_price": 40},
+                                     {"day": "2016-01-02", "average_price": 50}]
+                        }, {
+                            "status": "success",
+                            "data": [{"day": "2016-01-01", "average_price": 20}]
+                        }, {
+                            "status": "error",
+                            "data": {
+                                "http_code": "400 BAD REQUEST",
+                                "errors": [{
+                                    "error_code": 2000,
+                                    "error_message": "{'non_field_errors': [ErrorDetail(string='date_from must be less than or equal to date_to', code='invalid')]}"
+                                }]
+                            }
+                        }, {
+                            "status": "success",
+                            "data": [{"day": "2016-01-02", "average_price": 50}]
+                        }]
+                    }]
+
+        # warm up the closure
+        slug_to_code('scandinavia')
+
+        # all the items are answered with one query
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('rates_batch'), self.valid_input, format='json')
+
+        # checking weather the outputa data is as per the requirement
+        self.assertEqual(response.data, output_data)
+
+        # checking wether the response is success
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(RATES_BATCH_MAX_ITEMS=2)
+    def test_invalid_batch(self):
+
+        # too many items
+        response = self.client.post(reverse('rates_batch'), self.valid_input, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # not a list
+        response = self.client.post(reverse('rates_batch'), self.valid_input[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+# GET API rates streaming Test
+class Test_L_RatesStreamAPI(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        for day, price in [(1, 10), (1, 20), (1, 30), (2, 40)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, day), price=price)
+
+    def test_stream(self):
+
+        # lines of the output data
+        output_lines = {'rates': [{"day": "2016-01-01", "average_price": 20}, {"day": "2016-01-02", "average_price": 40}],
+                        'rates_sql': [{"day": "2016-01-01", "average_price": 20}, {"day": "2016-01-02", "average_price": 40}],
+                        'rates_null': [{"day": "2016-01-01", "average_price": 20}, {"day": "2016-01-02", "average_price": "null"}]}
+
+        for endpoint, lines in output_lines.items():
+
+            # url to be tested
+            url = reverse(endpoint, args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+            for response in [self.client.get(url, HTTP_ACCEPT='application/x-ndjson'),
+                             self.client.get(url + '?format=ndjson')]:
+
+                # checking wether the response is streamed
+                self.assertTrue(response.streaming)
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+                # one JSON document per day
+                content = b''.join(response.streaming_content).decode('utf-8')
+                self.assertEqual([json.loads(line) for line in content.splitlines()], lines)
+
+    def test_stream_error(self):
+
+        # url to be tested
+        url = reverse('rates', args=("2016-01-02", "2016-01-01", "CNGGZ", "EETLL"))
+
+        # errors are sent as a single line
+        response = self.client.get(url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))["status"], "error")
+
+# GET API rates formats Test
+class Test_M_RatesFormatAPI(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        for day, price in [(1, 10), (1, 20), (1, 30), (2, 40)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, day), price=price)
+
+    def test_columnar(self):
+
+        for endpoint in ['rates', 'rates_sql']:
+
+            # url to be tested
+            url = reverse(endpoint, args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+            response = self.client.get(url, HTTP_ACCEPT='application/vnd.rates.columnar+json')
+
+            # one array per column
+            self.assertEqual(json.loads(response.content.decode('utf-8')),
+                             {"days": ["2016-01-01", "2016-01-02"], "average_price": [20, 40]})
+
+        # null days
+        url = reverse('rates_null', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+        response = self.client.get(url + '?format=columnar')
+        self.assertEqual(response.data, {"days": ["2016-01-01", "2016-01-02"], "average_price": [20, "null"]})
+
+    def test_csv(self):
+
+        # url to be tested
+        url = reverse('rates_null', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+
+        response = self.client.get(url, HTTP_ACCEPT='text/csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response.content.decode('utf-8'), "day,average_price\n2016-01-01,20\n2016-01-02,null\n")
+
+        # formats are cached and tagged separately
+        json_response = self.client.get(url)
+        self.assertEqual(json_response.data[0]["status"], "success")
+        self.assertNotEqual(json_response['ETag'], response['ETag'])
+
+    def test_csv_error(self):
+
+        # url to be tested
+        url = reverse('rates', args=("2016-01-02", "2016-01-01", "CNGGZ", "EETLL"))
+
+        response = self.client.get(url + '?format=csv')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.decode('utf-8').startswith("error_code,error_message\n2000,"))
+
+# In-memory rates engine Test
+@override_settings(RATES_CACHE_SIZE=0)
+@run_on_commit
+class Test_N_PriceCube(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure and engine are kept per process, start from the test data
+        clear_region_closure()
+        price_cube.clear()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, day, price in [('SEGOT', 1, 10), ('SESTO', 1, 25), ('SESTO', 1, 31), ('SESTO', 3, 7),
+                                             ('EETLL', 2, 40), ('SEGOT', 5, 12), ('SEGOT', 3, 8)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, day), price=price)
+
+    def tearDown(self):
+
+        # drop the state built from the rolled back test data
+        clear_region_closure()
+        price_cube.clear()
+
+    def get_all(self):
+
+        # every endpoint, window and lane
+        responses = list()
+        for endpoint in ['rates', 'rates_null']:
+            for date_from, date_to in [("2016-01-01", "2016-01-05"), ("2016-01-02", "2016-01-03"), ("2015-12-01", "2015-12-31")]:
+                for destination in ['scandinavia', 'SESTO', 'EETLL', 'XXXXX']:
+                    url = reverse(endpoint, args=(date_from, date_to, "CNGGZ", destination))
+                    responses.append(self.client.get(url).data)
+
+        return responses
+
+    def test_same_results(self):
+
+        # identical to the database engine
+        expected = self.get_all()
+        with self.settings(RATES_ENGINE='numpy'):
+            self.assertEqual(self.get_all(), expected)
+
+    def test_uploads(self):
+
+        with self.settings(RATES_ENGINE='numpy'):
+            self.get_all()
+
+            # uploads are applied before the next query
+            self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                       "date_to": "2016-01-02",
+                                                       "origin_code": "CNGGZ",
+                                                       "destination_code": "SESTO",
+                                                       "price": [100, 200]}, format='json')
+            numpy_responses = self.get_all()
+
+        self.assertEqual(numpy_responses, self.get_all())
+
+    def test_load_swaps_at_once(self):
+
+        with self.settings(RATES_ENGINE='numpy'):
+            self.get_all()
+        current, seen = [price_cube.code_ids, price_cube.lanes], list()
+
+        def reading_lane_arrays(rows):
+            # a query during the load still sees the previous arrays whole
+            seen.append(price_cube.code_ids is current[0] and price_cube.lanes is current[1])
+            return lane_arrays(rows)
+
+        with mock.patch('api.engine.lane_arrays', reading_lane_arrays):
+            price_cube.load()
+            self.assertIsNot(price_cube.lanes, current[1])
+            current[:] = [price_cube.code_ids, price_cube.lanes]
+            price_cube.reload_lanes([('CNGGZ', 'SESTO')])
+            self.assertIsNot(price_cube.lanes, current[1])
+
+        self.assertEqual(seen, [True] * 4)
+
+    def test_snapshot(self):
+
+        expected = self.get_all()
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(RATES_ENGINE='numpy', RATES_SNAPSHOT_DIR=directory):
+
+            # snapshot of the current prices
+            write_snapshot(directory)
+            self.assertEqual(self.get_all(), expected)
+
+            # prices inserted after the snapshot are overlaid from the database
+            Prices.objects.create(orig_code='CNGGZ', dest_code='SEGOT', day=datetime.date(2016, 1, 2), price=99)
+            with self.settings(RATES_ENGINE='orm'):
+                expected = self.get_all()
+            self.assertEqual(self.get_all(), expected)
+
+            # a new snapshot is picked up on the next query
+            write_snapshot(directory, keep=1)
+            self.assertEqual(self.get_all(), expected)
+            self.assertEqual(price_cube.max_id, Prices.objects.latest('id').id)
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_snapshot_changes(self):
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(RATES_ENGINE='numpy', RATES_SNAPSHOT_DIR=directory):
+            write_snapshot(directory)
+            self.get_all()
+
+            # deletes and updates of prices in the snapshot are read from the database
+            Prices.objects.filter(dest_code='SESTO', price=25).get().delete()
+            price = Prices.objects.get(dest_code='SEGOT', price=10)
+            price.price = 90
+            price.save()
+            numpy_responses = self.get_all()
+
+            # also by workers loading the snapshot afterwards
+            price_cube.clear()
+            loaded_responses = self.get_all()
+
+        self.assertEqual(numpy_responses, self.get_all())
+        self.assertEqual(loaded_responses, self.get_all())
+
+
+@override_settings(RATES_CACHE_SIZE=0)
+@run_on_commit
+class Test_O_RatesSummary(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure and index are kept per process, start from the test data
+        clear_region_closure()
+        summary_index.clear()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, day, price in [('SEGOT', 1, 10), ('SESTO', 1, 25), ('SESTO', 1, 31), ('SESTO', 3, 7),
+                                             ('EETLL', 2, 40), ('SEGOT', 5, 12), ('SEGOT', 3, 8), ('SESTO', 9, 50)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, day), price=price)
+
+    def tearDown(self):
+
+        # drop the state built from the rolled back test data
+        clear_region_closure()
+        summary_index.clear()
+
+    def expected(self, date_from, date_to, destination):
+
+        # summary computed from every price of the range
+        prices = list(Prices.objects.filter(orig_code='CNGGZ', dest_code__in=slug_to_code(destination),
+                                            day__range=(date_from, date_to)).values_list('price', flat=True))
+
+        return {
+                "average_price": sum(prices) // len(prices) if prices else None,
+                "min_price": min(prices) if prices else None,
+                "max_price": max(prices) if prices else None,
+                "price_count": len(prices)
+                }
+
+    def test_ranges(self):
+
+        # every window and lane
+        for day_from in range(1, 11):
+            for day_to in range(day_from, 11):
+                for destination in ['scandinavia', 'SESTO', 'EETLL', 'XXXXX']:
+                    date_from, date_to = "2016-01-%02d" % day_from, "2016-01-%02d" % day_to
+                    url = reverse('rates_summary', args=(date_from, date_to, "CNGGZ", destination))
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertEqual(response.data[0]['data'], self.expected(date_from, date_to, destination))
+
+    def test_uploads(self):
+
+        url = reverse('rates_summary', args=("2016-01-01", "2016-01-31", "CNGGZ", "scandinavia"))
+        self.client.get(url)
+
+        # uploads are applied before the next query
+        self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                   "date_to": "2016-01-02",
+                                                   "origin_code": "CNGGZ",
+                                                   "destination_code": "SESTO",
+                                                   "price": [1, 200]}, format='json')
+
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['data'], self.expected("2016-01-01", "2016-01-31", "scandinavia"))
+        self.assertEqual(response.data[0]['data']['min_price'], 1)
+        self.assertEqual(response.data[0]['data']['max_price'], 200)
+
+    def test_invalid(self):
+
+        # invalid dates are reported as data errors
+        url = reverse('rates_summary', args=("2016-01-xx", "2016-01-31", "CNGGZ", "scandinavia"))
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['status'], 'error')
+
+
+@override_settings(RATES_CACHE_SIZE=0)
+class Test_P_RatesWindow(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        clear_region_closure()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, day, price in [('SEGOT', 1, 10), ('SESTO', 1, 25), ('SESTO', 1, 31), ('SESTO', 3, 7),
+                                             ('SEGOT', 5, 12), ('SEGOT', 3, 8), ('SESTO', 9, 50), ('SESTO', 10, 3)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, day), price=price)
+
+    def tearDown(self):
+
+        clear_region_closure()
+
+    def expected(self, date_from, date_to, window):
+
+        # quote weighted average of the prices of the window ending on each day
+        expected = list()
+        day = date_from
+        while day <= date_to:
+            prices = list(Prices.objects.filter(day__range=(day - datetime.timedelta(days=window - 1), day)).values_list('price', flat=True))
+            if prices:
+                expected.append({"day": str(day), "average_price": sum(prices) // len(prices)})
+            day += datetime.timedelta(days=1)
+
+        return expected
+
+    def test_window(self):
+
+        for endpoint in ['rates', 'rates_sql']:
+            for window in [1, 3, 7]:
+                url = reverse(endpoint, args=("2016-01-03", "2016-01-12", "CNGGZ", "scandinavia")) + "?window={0}".format(window)
+                response = self.client.get(url)
+                self.assertEqual(response.data[0]['data'],
+                                 self.expected(datetime.date(2016, 1, 3), datetime.date(2016, 1, 12), window))
+
+    def test_window_null(self):
+
+        # days are null when the whole window has less than 3 prices
+        url = reverse('rates_null', args=("2016-01-03", "2016-01-05", "CNGGZ", "scandinavia")) + "?window=2"
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['data'], [{"day": "2016-01-03", "average_price": "null"},
+                                                    {"day": "2016-01-04", "average_price": "null"},
+                                                    {"day": "2016-01-05", "average_price": "null"}])
+
+        url = reverse('rates_null', args=("2016-01-03", "2016-01-03", "CNGGZ", "scandinavia")) + "?window=3"
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['data'], [{"day": "2016-01-03", "average_price": 16}])
+
+    def test_window_batch(self):
+
+        url = reverse('rates_batch')
+        response = self.client.post(url, [{"date_from": "2016-01-03", "date_to": "2016-01-12", "origin": "CNGGZ",
+                                           "destination": "scandinavia", "window": 7}], format='json')
+        self.assertEqual(response.data[0]['data'][0]['data'],
+                         self.expected(datetime.date(2016, 1, 3), datetime.date(2016, 1, 12), 7))
+
+    def test_invalid_window(self):
+
+        for window in ['0', 'x', '367']:
+            url = reverse('rates', args=("2016-01-03", "2016-01-12", "CNGGZ", "scandinavia")) + "?window=" + window
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RATES_CACHE_SIZE=0)
+class Test_Q_RatesPercentile(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        clear_region_closure()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, day, price in [('SEGOT', 1, 10), ('SESTO', 1, 25), ('SESTO', 1, 31), ('SEGOT', 1, 1000),
+                                             ('SEGOT', 1, 20), ('SESTO', 2, 7), ('EETLL', 1, 40)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, day), price=price)
+
+    def tearDown(self):
+
+        clear_region_closure()
+
+    def get_data(self, destination):
+
+        url = reverse('rates_percentile', args=("2016-01-01", "2016-01-02", "CNGGZ", destination))
+        return self.client.get(url).data[0]['data']
+
+    def test_percentile(self):
+
+        # median of the merged lanes is not moved by the outlier
+        data = self.get_data('scandinavia')
+        self.assertEqual(data[0]['day'], "2016-01-01")
+        self.assertEqual(data[0]['median'], 25)
+        self.assertEqual(data[1], {"day": "2016-01-02", "p10": 7, "median": 7, "p90": 7})
+        self.assertEqual(self.get_data('XXXXX'), [])
+
+    def test_sketches_follow_prices(self):
+
+        # upload, update and delete
+        self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                   "date_to": "2016-01-02",
+                                                   "origin_code": "CNGGZ",
+                                                   "destination_code": "SESTO",
+                                                   "price": [26, 27]}, format='json')
+        price = Prices.objects.get(price=1000)
+        price.price = 24
+        price.save()
+        Prices.objects.get(price=7).delete()
+
+        # identical to the sketches rebuilt from the prices
+        incremental = sorted(DailyLaneSketch.objects.values_list('orig_code', 'dest_code', 'day', 'centroids'))
+        rebuild_rollup()
+        self.assertEqual(sorted(DailyLaneSketch.objects.values_list('orig_code', 'dest_code', 'day', 'centroids')), incremental)
+        self.assertEqual(self.get_data('SESTO')[0]['median'], 26)
+
+    def test_many_lanes(self):
+
+        # more lanes than SQLite accepts in one expression
+        rows = [('CNGGZ', 'X%04d' % lane, datetime.date(2016, 1, day), lane) for lane in range(1500) for day in (1, 2)]
+        insert_prices(rows)
+        self.assertEqual(DailyLaneSketch.objects.filter(dest_code__startswith='X').count(), 3000)
+
+        # and rebuilt from the prices
+        self.assertEqual(rebuild_sketches([row[:3] for row in rows]), 3000)
+
+    def test_sketch_accuracy(self):
+
+        # merged sketches of many lane days stay close to the exact quantiles
+        prices = [(price * 7919) % 10007 for price in range(20000)]
+        merged = TDigest()
+        for start in range(0, len(prices), 400):
+            sketch = TDigest()
+            sketch.add(prices[start:start + 400])
+            merged.merge(sketch)
+
+        prices.sort()
+        for quantile in [0.1, 0.5, 0.9]:
+            self.assertLess(abs(merged.quantile(quantile) - prices[int(quantile * len(prices))]), 0.01 * 10007)
+
+
+@override_settings(RATES_CACHE_SIZE=0)
+class Test_R_RatesBackend(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # closure and engine are kept per process, start from the test data
+        clear_region_closure()
+        price_cube.clear()
+
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+        Ports.objects.create(code='SESTO', name='Stockholm', parent_slug='scandinavia')
+
+        for destination_code, day, price in [('SEGOT', 1, 10), ('SESTO', 1, 25), ('SESTO', 1, 31), ('SESTO', 3, 7),
+                                             ('EETLL', 2, 40), ('SEGOT', 5, 12)]:
+            Prices.objects.create(orig_code='CNGGZ', dest_code=destination_code, day=datetime.date(2016, 1, day), price=price)
+
+    def tearDown(self):
+
+        clear_region_closure()
+        price_cube.clear()
+
+    def test_same_results(self):
+
+        # every backend returns the same rows, one element lists included
+        for destination in ['scandinavia', 'SESTO', 'XXXXX']:
+            results = list()
+            for name in ['orm', 'sql', 'numpy']:
+                rows = BACKENDS[name].daily_rates(datetime.date(2016, 1, 1), datetime.date(2016, 1, 5), 'CNGGZ', destination)
+                results.append([(str(row['day']), row['price_sum'], row['price_count']) for row in rows])
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0], results[2])
+
+    def test_header(self):
+
+        url = reverse('rates', args=("2016-01-01", "2016-01-05", "CNGGZ", "scandinavia"))
+        self.assertEqual(self.client.get(url)['X-Rates-Backend'], 'orm')
+        with self.settings(RATES_ENGINE='numpy'):
+            self.assertEqual(self.client.get(url)['X-Rates-Backend'], 'numpy')
+
+        url = reverse('rates_sql', args=("2016-01-01", "2016-01-05", "CNGGZ", "SESTO"))
+        response = self.client.get(url)
+        self.assertEqual(response['X-Rates-Backend'], 'sql')
+        self.assertEqual(response.data[0]['data'], [{"day": "2016-01-01", "average_price": 28},
+                                                    {"day": "2016-01-03", "average_price": 7}])
+
+    def test_header_without_query(self):
+
+        url = reverse('rates_sql', args=("2016-01-01", "2016-01-05", "CNGGZ", "SESTO"))
+        rates_cache.clear()
+
+        # cache hits and 304 answers name the backend as well
+        with self.settings(RATES_CACHE_SIZE=16):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url)['X-Rates-Backend'], 'sql')
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['X-Rates-Backend'], 'sql')
+            self.assertEqual(rates_cache.info()['hits'], 2)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['X-Rates-Backend'], 'sql')
+
+    def test_bind_codes(self):
+
+        # codes are always parameters, never part of the statement
+        condition, params = bind_codes(["CNGGZ", "x') OR ('1'='1"])
+        self.assertNotIn("CNGGZ", condition)
+        self.assertEqual(len(params), 1 if condition == "= ANY(%s)" else 2)
+
+
+class Test_S_Startup(APITestCase):
+
+    def test_no_heavy_imports(self):
+
+        # a new worker loads neither pandas nor NumPy
+        startup = measure_startup()
+        self.assertNotIn('pandas', startup['heavy_modules'])
+        self.assertNotIn('numpy', startup['heavy_modules'])
+
+    def test_configuration_on_first_use(self):
+
+        # the rates API does not need the configuration file
+        configuration.cache_clear()
+        try:
+            with self.settings(CONFIGURATION_FILE='/nonexistent/config.json'):
+                url = reverse('rates', args=("2016-01-01", "2016-01-02", "CNGGZ", "EETLL"))
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+                with self.assertRaises(IOError):
+                    configuration()
+        finally:
+            configuration.cache_clear()
+
+    def test_upload_single_day(self):
+
+        # date_from equal to date_to is one day
+        response = self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                              "date_to": "2016-01-01",
+                                                              "origin_code": "CNGGZ",
+                                                              "destination_code": "EETLL",
+                                                              "price": [100]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Prices.objects.filter(day=datetime.date(2016, 1, 1), price=100).count(), 1)
+
+
+class ExchangeRatesHandler(BaseHTTPRequestHandler):
+
+    # requests answered by the stub server, its status code and delay
+    hits = 0
+    status_code = 200
+    delay = 0
+
+    def do_GET(self):
+
+        ExchangeRatesHandler.hits += 1
+        time.sleep(ExchangeRatesHandler.delay)
+        body = json.dumps({"rates": {"USD": 1.0, "INR": 70.0}}).encode('utf-8')
+        try:
+            self.send_response(ExchangeRatesHandler.status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up after its timeout
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_until(condition, timeout=5):
+
+    # poll a condition set by a background thread
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+class Test_T_FxRateProvider(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # local exchange rate API
+        ExchangeRatesHandler.hits = 0
+        ExchangeRatesHandler.status_code = 200
+        ExchangeRatesHandler.delay = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ExchangeRatesHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # configuration file pointing at it
+        self.directory = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.directory.name, 'config.json')
+        with open(config_path, 'w') as config_file:
+            json.dump({"exchange_rates": {"app_id": "test",
+                                          "url": "http://127.0.0.1:{0}/latest.json".format(self.server.server_port)}},
+                      config_file)
+
+        self.settings_override = self.settings(CONFIGURATION_FILE=config_path, FX_RATE_PROVIDER='api.fx.HTTPFxRateProvider')
+        self.settings_override.enable()
+        configuration.cache_clear()
+        fx_provider().clear()
+
+    def tearDown(self):
+
+        fx_provider().clear()
+        configuration.cache_clear()
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def upload(self):
+
+        # a month of prices older than the FxRate history
+        return self.client.post(reverse('upload_usd_price'), {"date_from": "2016-01-01",
+                                                              "date_to": "2016-01-30",
+                                                              "origin_code": "CNGGZ",
+                                                              "destination_code": "EETLL",
+                                                              "price": [700] * 30,
+                                                              "currency_code": "inr"}, format='json')
+
+    def test_one_fetch_per_upload(self):
+
+        # converted with a single request
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ExchangeRatesHandler.hits, 1)
+        self.assertEqual(set(Prices.objects.values_list('price', flat=True)), {10})
+        self.assertEqual(response['X-FX-Rates-Stale'], 'false')
+
+        # cached for the next uploads
+        self.upload()
+        self.assertEqual(ExchangeRatesHandler.hits, 1)
+
+    def test_background_refresh(self):
+
+        with self.settings(FX_RATE_TTL=0.05):
+            fx_provider().rates()
+            # fetched again by the background thread only
+            self.assertTrue(wait_until(lambda: ExchangeRatesHandler.hits >= 3))
+
+    def test_circuit_breaker(self):
+
+        with self.settings(FX_RATE_TTL=0.01, FX_RATE_STALE_TTL=0.5, FX_BREAKER_FAILURES=2, FX_BREAKER_RESET=60):
+            fx_provider().rates()
+
+            # the API goes down, the breaker opens after 2 failures
+            ExchangeRatesHandler.status_code = 500
+            self.assertTrue(wait_until(lambda: fx_provider().status()['breaker'] == 'open'))
+            hits = ExchangeRatesHandler.hits
+            time.sleep(0.2)
+            self.assertEqual(ExchangeRatesHandler.hits, hits)
+
+            # the last good table is still served, then reported as stale
+            self.assertTrue(wait_until(lambda: fx_provider().status()['stale']))
+            response = self.upload()
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response['X-FX-Rates-Stale'], 'true')
+
+        # the API is back, the breaker closes after its trial request
+        ExchangeRatesHandler.status_code = 200
+        with self.settings(FX_RATE_TTL=0.01, FX_BREAKER_RESET=0.05):
+            self.assertTrue(wait_until(lambda: fx_provider().status()['breaker'] == 'closed'))
+            self.assertFalse(fx_provider().status()['stale'])
+
+    def test_timeout(self):
+
+        # a slow API does not hold the upload longer than the timeouts
+        ExchangeRatesHandler.delay = 2
+        with self.settings(FX_HTTP_TIMEOUT=(0.5, 0.2)):
+            start = time.monotonic()
+            response = self.upload()
+            self.assertLess(time.monotonic() - start, 1.9)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+@override_settings(FX_RATE_PROVIDER='api.fx.StubFxRateProvider', FX_STUB_RATES={'USD': 1.0, 'INR': 100.0})
+class Test_U_FxRate(APITestCase):
+
+    # initialize inputs
+    def setUp(self):
+
+        # rates of INR on the 2nd and 4th, the 3rd uses the rate of the 2nd
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write("day,currency,usd_rate\n2016-01-02,inr,50\n2016-01-04,INR,20\n2016-01-04,EUR,0.5\n")
+            self.csv_path = csv_file.name
+
+        call_command('load_fx_rates', self.csv_path, stdout=open(os.devnull, 'w'))
+
+    def tearDown(self):
+
+        os.remove(self.csv_path)
+
+    def test_load(self):
+
+        self.assertEqual(sorted(FxRate.objects.values_list('currency', 'day', 'usd_rate')),
+                         [('EUR', datetime.date(2016, 1, 4), 0.5),
+                          ('INR', datetime.date(2016, 1, 2), 50.0),
+                          ('INR', datetime.date(2016, 1, 4), 20.0)])
+
+        # loading again replaces the stored rates
+        call_command('load_fx_rates', self.csv_path, stdout=open(os.devnull, 'w'))
+        self.assertEqual(FxRate.objects.count(), 3)
+
+        # current table of the provider stored for today
+        call_command('load_fx_rates', latest=True, stdout=open(os.devnull, 'w'))
+        self.assertEqual(FxRate.objects.count(), 5)
+
+    def upload(self, date_from, date_to, currency_code="INR"):
+
+        days = (parse_date(date_to) - parse_date(date_from)).days + 1
+        return self.client.post(reverse('upload_usd_price'), {"date_from": date_from,
+                                                              "date_to": date_to,
+                                                              "origin_code": "CNGGZ",
+                                                              "destination_code": "EETLL",
+                                                              "price": [1000] * days,
+                                                              "currency_code": currency_code}, format='json')
+
+    def test_rate_of_each_day(self):
+
+        response = self.upload("2016-01-02", "2016-01-05")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Prices.objects.order_by('day').values_list('price', flat=True)), [20, 20, 50, 50])
+
+    def test_days_without_rate(self):
+
+        # before the history, or past the max age of the last rate
+        for date_from, date_to in [("2016-01-01", "2016-01-02"), ("2016-01-12", "2016-01-13")]:
+            response = self.upload(date_from, date_to)
+            self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            self.assertIn("no exchange rate of INR for {0}".format(date_from), response.data[0]["data"]["message"])
+        self.assertFalse(Prices.objects.exists())
+
+        # recent days use the provider table
+        today = str(timezone.localdate())
+        response = self.upload(today, today)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['X-FX-Rates-Backdated'], '0')
+
+        # currencies without history are converted with it as well, and flagged
+        with self.settings(FX_STUB_RATES={'USD': 1.0, 'INR': 100.0, 'AED': 4.0}):
+            response = self.upload("2016-01-01", "2016-01-02", "AED")
+        self.assertEqual(response['X-FX-Rates-Backdated'], '2')
+        self.assertEqual(list(Prices.objects.order_by('day').values_list('price', flat=True)), [250, 250, 10])
+
+    def test_positive_rates(self):
+
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write("day,currency,usd_rate\n2016-01-06,INR,0\n")
+
+        with self.assertRaises(CommandError):
+            call_command('load_fx_rates', self.csv_path, stdout=open(os.devnull, 'w'))
+        with self.assertRaises(ValueError):
+            store_fx_rates([('INR', datetime.date(2016, 1, 6), -1)])
+        self.assertEqual(FxRate.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class Test_V_UploadBulk(APITestCase):
+
+    def upload(self, days, origin_code='CNGGZ'):
+
+        # one price per day from 2016-01-01
+        date_to = datetime.date(2016, 1, 1) + datetime.timedelta(days=days - 1)
+        return self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                          "date_to": str(date_to),
+                                                          "origin_code": origin_code,
+                                                          "destination_code": "EETLL",
+                                                          "price": list(range(days))}, format='json')
+
+    def test_queries_per_upload(self):
+
+        # a year costs as many statements as a month
+        with CaptureQueriesContext(connection) as month:
+            self.upload(30, 'CNSHA')
+        with CaptureQueriesContext(connection) as year:
+            start = time.perf_counter()
+            response = self.upload(365)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(year), len(month))
+        self.assertEqual(Prices.objects.filter(orig_code='CNGGZ').count(), 365)
+
+        # throughput of the whole request, rollup included, reported only as it depends on the machine
+        logger.info("upload of 365 prices: %.0f prices per second", 365 / elapsed)
+
+    @override_settings(UPLOAD_BATCH_SIZE=100)
+    def test_batch_size(self):
+
+        with CaptureQueriesContext(connection) as queries:
+            self.upload(365)
+
+        # 4 INSERT statements into api_prices
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "api_prices"')]), 4)
+
+    def test_atomic(self):
+
+        # a failure while updating the rollup leaves no price behind
+        with mock.patch('api.ingest.add_to_rollup', side_effect=RuntimeError):
+            response = self.upload(365)
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Prices.objects.count(), 0)
+
+    def test_string_prices(self):
+
+        # numeric strings are accepted by the serializer and stored as int
+        response = self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                              "date_to": "2016-01-02",
+                                                              "origin_code": "CNGGZ",
+                                                              "destination_code": "EETLL",
+                                                              "price": ["217", "315"]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(Prices.objects.values_list('price', flat=True)), [217, 315])
+        self.assertEqual(DailyLaneRollup.objects.get(day='2016-01-02').price_sum, 315)
+
+
+@run_on_commit
+class Test_W_UploadStream(APITestCase):
+
+    def upload(self, body, content_type='text/csv'):
+
+        return self.client.generic('POST', reverse('upload_price_stream'), body, content_type=content_type)
+
+    def test_csv(self):
+
+        body = "orig_code,dest_code,day,price\n" + "".join("CNGGZ,EETLL,2016-01-{0:02d},{1}\n".format(day, day * 10)
+                                                          for day in range(1, 32))
+        response = self.upload(body)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['rows'], 31)
+        self.assertEqual(response.data['inserted'], 31)
+        self.assertEqual(response.data['rejected'], 0)
+        self.assertIn('rows_per_second', response.data)
+        self.assertEqual(Prices.objects.filter(orig_code='CNGGZ', dest_code='EETLL').count(), 31)
+
+        # rollup and rates follow the loaded prices
+        self.assertEqual(DailyLaneRollup.objects.get(orig_code='CNGGZ', day='2016-01-03').price_sum, 30)
+        response = self.client.get(reverse('rates', args=['2016-01-01', '2016-01-02', 'CNGGZ', 'EETLL']))
+        self.assertEqual([row['average_price'] for row in response.data[0]['data']], [10, 20])
+
+    def test_ndjson(self):
+
+        body = ('{"orig_code": "CNGGZ", "dest_code": "EETLL", "day": "2016-01-01", "price": 100}\n'
+                '\n'
+                '["CNSHA", "EETLL", "2016-01-02", 200]\n')
+        response = self.upload(body, 'application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['inserted'], 2)
+        self.assertEqual(sorted(Prices.objects.values_list('orig_code', 'price')), [('CNGGZ', 100), ('CNSHA', 200)])
+
+    def test_rejected_rows(self):
+
+        body = ("CNGGZ,EETLL,2016-01-01,100\n"
+                "CNGGZ,EETLL,2016-02-30,100\n"
+                "CNGGZ,EETLL,2016,100\n"
+                "CNGGZ,EETLL,2016-01-02,1.5\n"
+                "TOOLONG,EETLL,2016-01-03,100\n"
+                "CNGGZ,EETLL\n"
+                "CNGGZ,EETLL,2016-01-04,100\n")
+        response = self.upload(body)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['inserted'], 2)
+        self.assertEqual(response.data['rejected'], 5)
+        self.assertEqual(response.data['rejected_rows'], [{"line": 2, "error": "invalid day"},
+                                                          {"line": 3, "error": "invalid day"},
+                                                          {"line": 4, "error": "invalid price"},
+                                                          {"line": 5, "error": "invalid orig_code"},
+                                                          {"line": 6, "error": "expected 4 columns"}])
+        self.assertEqual(Prices.objects.count(), 2)
+
+    @override_settings(INGEST_CHUNK_SIZE=10, INGEST_MAX_REJECTED_ROWS=3)
+    def test_chunks(self):
+
+        body = "".join("CNGGZ,EETLL,2016-01-{0:02d},{1}\n".format(day % 28 + 1, "x" if day % 5 == 0 else day)
+                       for day in range(100))
+
+        # one insert of the prices per chunk
+        with CaptureQueriesContext(connection) as queries:
+            response = self.upload(body)
+
+        self.assertEqual(response.data['rows'], 100)
+        self.assertEqual(response.data['inserted'], 80)
+        self.assertEqual(response.data['rejected'], 20)
+        self.assertEqual(len(response.data['rejected_rows']), 3)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "api_prices"')]), 10)
+
+    def test_invalid_content_type(self):
+
+        response = self.upload('{"price": 1}', 'application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Prices.objects.count(), 0)
+
+
+class Test_X_LoadPrices(APITestCase):
+
+    def setUp(self):
+
+        # tab separated rows as in the COPY blocks, two of them invalid
+        self.path = tempfile.mktemp(suffix='.tsv')
+        with open(self.path, 'w') as price_file:
+            for day in range(1, 501):
+                price_file.write("CNGGZ\tEETLL\t{0}\t{1}\n".format(datetime.date(2016, 1, 1) + datetime.timedelta(days=day % 100), day))
+            price_file.write("CNGGZ\tEETLL\t2016-13-01\t100\n")
+            price_file.write("CNGGZ\t\\N\t2016-01-01\t100\n")
+
+    def tearDown(self):
+
+        os.remove(self.path)
+
+    def load(self, *args, **options):
+
+        out = io.StringIO()
+        call_command('load_prices', *args, stdout=out, stderr=io.StringIO(), chunk_bytes=2048, **options)
+        return out.getvalue()
+
+    def test_load(self):
+
+        output = self.load(self.path, workers=2)
+
+        self.assertIn("100.0% 500 rows, 2 rejected", output)
+        self.assertIn("rows/s", output)
+        self.assertEqual(Prices.objects.count(), 500)
+        self.assertEqual(sum(Prices.objects.values_list('price', flat=True)), sum(range(1, 501)))
+
+        # rollup rebuilt from the loaded prices
+        self.assertEqual(DailyLaneRollup.objects.get(orig_code='CNGGZ', day='2016-01-02').price_count, 5)
+
+        # a finished file is not loaded again
+        self.assertIn("already loaded", self.load(self.path, workers=1))
+        self.assertEqual(Prices.objects.count(), 500)
+
+    def test_dump(self):
+
+        self.load('rates.sql', workers=1)
+
+        # same rows as the COPY block of the dump
+        self.assertEqual(Prices.objects.count(), sum(1 for _ in read_copy_rows(os.path.join(settings.BASE_DIR, 'rates.sql'), 'api_prices')))
+
+    def test_header(self):
+
+        # CSV with named columns in another order
+        with open(self.path, 'w') as price_file:
+            price_file.write("id,price,day,dest_code,orig_code\n1,217,2016-01-01,EETLL,CNGGZ\n2,315,2016-01-02,EETLL,CNGGZ\n")
+        os.rename(self.path, self.path[:-4] + '.csv')
+        self.path = self.path[:-4] + '.csv'
+
+        self.load(self.path, workers=1)
+
+        self.assertEqual(sorted(Prices.objects.values_list('orig_code', 'dest_code', 'price')),
+                         [('CNGGZ', 'EETLL', 217), ('CNGGZ', 'EETLL', 315)])
+
+    def test_restart(self):
+
+        write_rows = LoadPricesCommand.write_rows
+        calls = list()
+
+        def failing_write_rows(command, rows, method):
+            # interrupted while writing the third range
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            write_rows(command, rows, method)
+
+        with mock.patch.object(LoadPricesCommand, 'write_rows', failing_write_rows):
+            with self.assertRaises(KeyboardInterrupt):
+                self.load(self.path, workers=2)
+
+        # the committed ranges are kept, the interrupted one is not
+        self.assertEqual(Prices.objects.count(), sum(calls[:2]))
+        checkpoint = PriceLoad.objects.get()
+        self.assertEqual(checkpoint.rows, sum(calls[:2]))
+
+        # continues after the last committed range
+        output = self.load(self.path, workers=2)
+        self.assertIn("continuing at byte {0}".format(checkpoint.position), output)
+        self.assertEqual(Prices.objects.count(), 500)
+        self.assertEqual(PriceLoad.objects.get().rows, 500)
+
+    def test_rollup_restart(self):
+
+        # interrupted after the last range was committed
+        with mock.patch('api.management.commands.load_prices.rebuild_rollup', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.load(self.path, workers=1)
+        self.assertFalse(DailyLaneRollup.objects.exists())
+        self.assertFalse(PriceLoad.objects.get().rollup_done)
+
+        # the next run rebuilds it and drops the cached responses of the loaded lanes
+        with mock.patch.object(rates_cache, 'invalidate') as invalidate:
+            output = self.load(self.path, workers=1)
+
+        self.assertIn("already loaded", output)
+        self.assertIn("rebuilt", output)
+        self.assertEqual(DailyLaneRollup.objects.get(orig_code='CNGGZ', day='2016-01-02').price_count, 5)
+        self.assertIn(('CNGGZ', 'EETLL', '2016-04-09', 0), invalidate.call_args[0][0])
+        self.assertTrue(PriceLoad.objects.get().rollup_done)
+
+        # nothing left to rebuild
+        self.assertNotIn("rebuilt", self.load(self.path, workers=1))
+
+    def test_changed_file(self):
+
+        self.load(self.path, workers=1)
+
+        with open(self.path, 'a') as price_file:
+            price_file.write("CNGGZ\tEETLL\t2016-01-01\t100\n")
+
+        with self.assertRaises(CommandError):
+            self.load(self.path, workers=1)
+
+        # loaded again from the start
+        self.load(self.path, workers=1, restart=True)
+        self.assertEqual(Prices.objects.count(), 1001)
+
+
+class Test_Y_LoadPricesIndexes(APITransactionTestCase):
+
+    def test_drop_indexes(self):
+
+        path = tempfile.mktemp(suffix='.tsv')
+        with open(path, 'w') as price_file:
+            price_file.write("CNGGZ\tEETLL\t2016-01-01\t100\n")
+
+        dropped = list()
+        drop_indexes = LoadPricesCommand.drop_indexes
+
+        def recording_drop_indexes(command):
+            drop_indexes(command)
+            dropped.extend(command.index_names())
+
+        try:
+            with mock.patch.object(LoadPricesCommand, 'drop_indexes', recording_drop_indexes):
+                call_command('load_prices', path, workers=1, drop_indexes=True, stdout=io.StringIO())
+        finally:
+            os.remove(path)
+
+        # dropped during the load and created again afterwards
+        self.assertNotIn('api_prices_lane_day_idx', dropped)
+        self.assertIn('api_prices_lane_day_idx', LoadPricesCommand().index_names())
+        self.assertEqual(Prices.objects.count(), 1)
+
+
+@override_settings(INGEST_WORKERS=0, FX_RATE_PROVIDER='api.fx.StubFxRateProvider', FX_STUB_RATES={'USD': 1.0, 'INR': 70.0})
+class Test_Z_IngestJobs(APITestCase):
+
+    def upload(self, origin_code='CNGGZ', prices=(217, 315), currency_code=None, **extra):
+
+        data = {"date_from": "2016-01-01",
+                "date_to": str(datetime.date(2016, 1, 1) + datetime.timedelta(days=len(prices) - 1)),
+                "origin_code": origin_code,
+                "destination_code": "EETLL",
+                "price": list(prices)}
+        if currency_code is not None:
+            data["currency_code"] = currency_code
+            return self.client.post(reverse('upload_usd_price') + '?async=true', data, format='json', **extra)
+
+        return self.client.post(reverse('upload_price') + '?async=true', data, format='json', **extra)
+
+    def job(self, job_id):
+
+        return self.client.get(reverse('job_status', args=[job_id])).data[0]['data']
+
+    def test_async_upload(self):
+
+        response = self.upload()
+
+        # queued, nothing inserted yet
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data[0]['data']['job_id']
+        self.assertTrue(response['Location'].endswith(reverse('job_status', args=[job_id])))
+        self.assertEqual(self.job(job_id)['status'], 'queued')
+        self.assertEqual(Prices.objects.count(), 0)
+
+        self.assertEqual(drain_jobs(), 1)
+
+        job = self.job(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['rows'], 2)
+        self.assertEqual(job['inserted'], 2)
+        self.assertEqual(sorted(Prices.objects.values_list('day', 'price')),
+                         [(datetime.date(2016, 1, 1), 217), (datetime.date(2016, 1, 2), 315)])
+        self.assertEqual(DailyLaneRollup.objects.get(orig_code='CNGGZ', day='2016-01-02').price_sum, 315)
+
+    def test_prefer_header(self):
+
+        response = self.client.post(reverse('upload_price'), {"date_from": "2016-01-01",
+                                                              "date_to": "2016-01-01",
+                                                              "origin_code": "CNGGZ",
+                                                              "destination_code": "EETLL",
+                                                              "price": [217]}, format='json', HTTP_PREFER='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_invalid_upload(self):
+
+        # validated before queueing
+        response = self.client.post(reverse('upload_price') + '?async=true', {"date_from": "2016-01-02",
+                                                                              "date_to": "2016-01-01",
+                                                                              "origin_code": "CNGGZ",
+                                                                              "destination_code": "EETLL",
+                                                                              "price": [217]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(IngestJob.objects.count(), 0)
+
+    def test_usd_upload(self):
+
+        job_id = self.upload(prices=[700, 1400], currency_code='INR').data[0]['data']['job_id']
+
+        drain_jobs()
+
+        self.assertEqual(self.job(job_id)['status'], 'done')
+        self.assertEqual(sorted(Prices.objects.values_list('price', flat=True)), [10, 20])
+
+    def test_batched_transaction(self):
+
+        for origin_code in ['CNGGZ', 'CNSHA', 'CNSGH', 'CNYTN', 'CNNGB']:
+            self.upload(origin_code)
+
+        # one INSERT of the prices for the whole batch
+        with CaptureQueriesContext(connection) as queries:
+            drain_jobs()
+
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "api_prices"')]), 1)
+        self.assertEqual(Prices.objects.count(), 10)
+        self.assertEqual(IngestJob.objects.filter(status='done').count(), 5)
+
+    def test_failed_job(self):
+
+        good_id = self.upload().data[0]['data']['job_id']
+        bad_id = self.upload('CNSHA', currency_code='XXX').data[0]['data']['job_id']
+
+        with self.assertLogs('api.jobs', 'WARNING'):
+            drain_jobs()
+
+        # only the faulty job of the batch fails
+        self.assertEqual(self.job(good_id)['status'], 'done')
+        job = self.job(bad_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('XXX', job['error'])
+        self.assertEqual(Prices.objects.count(), 2)
+
+    def test_abandoned_job(self):
+
+        job_id = self.upload().data[0]['data']['job_id']
+
+        # claimed by a worker which died, and run again after the timeout
+        self.assertEqual(len(claim_jobs()), 1)
+        self.assertEqual(claim_jobs(), [])
+        IngestJob.objects.filter(pk=job_id).update(started=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(drain_jobs(), 1)
+
+        job = self.job(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['attempts'], 2)
+        self.assertEqual(Prices.objects.count(), 2)
+
+    def test_reclaimed_job(self):
+
+        job_id = self.upload().data[0]['data']['job_id']
+        other_id = self.upload('CNSHA').data[0]['data']['job_id']
+        jobs = claim_jobs()
+
+        # taken over by another worker after the timeout while this one still runs it
+        IngestJob.objects.filter(pk=job_id).update(started=timezone.now() + datetime.timedelta(seconds=1))
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(run_jobs(jobs), 1)
+
+        # its prices are left to the new owner, the rest of the batch is inserted
+        self.assertEqual(self.job(job_id)['status'], 'running')
+        self.assertEqual(self.job(other_id)['status'], 'done')
+        self.assertEqual(list(Prices.objects.values_list('orig_code', flat=True).distinct()), ['CNSHA'])
+
+    def test_run_ingest_jobs(self):
+
+        self.upload()
+
+        call_command('run_ingest_jobs', once=True)
+
+        self.assertEqual(Prices.objects.count(), 2)
+
+    def test_started_by_first_request(self):
+
+        config = apps.get_app_config('api')
+
+        def first_requests(argv):
+            with mock.patch.object(sys, 'argv', argv), mock.patch.object(ingest_workers, 'start') as start, \
+                 self.settings(INGEST_WORKERS=1):
+                config.ready()
+                request_started.send(sender=None)
+                request_started.send(sender=None)
+            return start.call_count
+
+        # no thread polls while no job was ever queued
+        self.assertEqual(first_requests(['gunicorn', 'rate_api.wsgi']), 0)
+
+        # pending jobs are drained under a WSGI server and runserver, not under the other commands
+        self.upload()
+        for argv, started in [(['gunicorn', 'rate_api.wsgi'], True),
+                              (['manage.py', 'runserver'], True),
+                              (['manage.py', 'migrate'], False)]:
+            self.assertEqual(first_requests(argv), 1 if started else 0, argv)
+
+    def test_command_survives_errors(self):
+
+        # a failing drain is logged and the worker keeps polling
+        with mock.patch('api.management.commands.run_ingest_jobs.drain_jobs', side_effect=[Exception("gone"), 0]) as drain, \
+             mock.patch('api.management.commands.run_ingest_jobs.time.sleep', side_effect=[None, StopIteration]), \
+             mock.patch('api.management.commands.run_ingest_jobs.django.setup'), \
+             self.assertLogs('api.management.commands.run_ingest_jobs', level='ERROR'):
+            with self.assertRaises(StopIteration):
+                run_ingest_jobs.work(0, False)
+
+        self.assertEqual(drain.call_count, 2)
+
+    def test_unknown_job(self):
+
+        response = self.client.get(reverse('job_status', args=[999]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(INGEST_WORKERS=1, INGEST_JOB_POLL_INTERVAL=0.05)
+class Test_ZA_IngestWorkers(APITransactionTestCase):
+
+    def tearDown(self):
+
+        ingest_workers.stop()
+
+    def test_in_process_worker(self):
+
+        response = self.client.post(reverse('upload_price') + '?async=true', {"date_from": "2016-01-01",
+                                                                              "date_to": "2016-01-02",
+                                                                              "origin_code": "CNGGZ",
+                                                                              "destination_code": "EETLL",
+                                                                              "price": [217, 315]}, format='json')
+        job_id = response.data[0]['data']['job_id']
+
+        # drained by the thread woken by the commit of the job
+        self.assertTrue(wait_until(lambda: IngestJob.objects.get(pk=job_id).status == 'done'))
+        self.assertEqual(Prices.objects.count(), 2)
+
+
+class Test_ZB_SharedCache(APITestCase):
+
+    def test_atomic_incr(self):
+
+        shared = caches['default']
+        shared.set('api:test:counter', 1, timeout=None)
+
+        self.assertIsInstance(shared, DatabaseCache)
+        self.assertEqual(shared.incr('api:test:counter'), 2)
+        self.assertEqual(shared.get('api:test:counter'), 2)
+        with self.assertRaises(ValueError):
+            shared.incr('api:test:missing')
+
+    def test_event_after_commit(self):
+
+        sequence = current_sequence(shared_cache())
+
+        # the shared sequence is neither bumped nor locked before the commit
+        with CaptureQueriesContext(connection) as queries:
+            Prices.objects.create(orig_code='CNGGZ', dest_code='EETLL', day=datetime.date(2016, 1, 1), price=10)
+        self.assertFalse([query for query in queries.captured_queries if 'api_cache' in query['sql']])
+        self.assertEqual(current_sequence(shared_cache()), sequence)
+
+    def test_region_generation(self):
+
+        generation = closure_generation()
+
+        # bumped in the database cache seen by every worker
+        Ports.objects.create(code='NOOSL', name='Oslo', parent_slug='scandinavia')
+        self.assertGreater(caches['default'].get(GENERATION_CACHE_KEY), generation)
+
+    def test_cache_hit_queries(self):
+
+        rates_cache.clear()
+        clear_region_closure()
+        Regions.objects.create(slug='scandinavia', name='Scandinavia', parent_slug=None)
+        Ports.objects.create(code='SEGOT', name='Goteborg', parent_slug='scandinavia')
+
+        url = reverse('rates', args=("2016-01-01", "2016-01-02", "CNGGZ", "scandinavia"))
+        response = self.client.get(url)
+
+        # the shared generation is not looked up again, only the shared sequence
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data, response.data)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        rates_cache.clear()
+        clear_region_closure()
+
+    @override_settings(CACHES=LOCAL_CACHES, WEB_CONCURRENCY=2)
+    def test_process_local_cache(self):
+
+        # refused by the checks and disabled at runtime with several workers
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['api.E001'])
+        self.assertEqual(rates_cache.max_size, 0)
+
+        with self.settings(WEB_CONCURRENCY=1):
+            self.assertEqual(check_shared_cache(None), [])
+            self.assertEqual(rates_cache.max_size, settings.RATES_CACHE_SIZE)
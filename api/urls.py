@@ -16,6 +16,9 @@ urlpatterns = [
     # scheme view
     path('schema/', get_schema_view(title="Rate API"), name="schema_view"),
 
+    # POST average_price for each day of many routes
+    path('rates/batch/', views.RatesBatchViewSet.as_view(), name="rates_batch"),
+
     # GET average_price for each day
     path('rates/<str:date_from>/<str:date_to>/<str:origin>/<str:destination>/', views.rates, name="rates"),
 
@@ -25,11 +28,26 @@ urlpatterns = [
     # GET average_price for each day
     path('rates_sql/<str:date_from>/<str:date_to>/<str:origin>/<str:destination>/', views.rates_sql, name="rates_sql"),
 
+    # GET average, min, max and count over the date range
+    path('rates_summary/<str:date_from>/<str:date_to>/<str:origin>/<str:destination>/', views.rates_summary, name="rates_summary"),
+
+    # GET p10, median and p90 for each day
+    path('rates_percentile/<str:date_from>/<str:date_to>/<str:origin>/<str:destination>/', views.rates_percentile, name="rates_percentile"),
+
+    # GET counters of the rates response cache
+    path('rates_cache/', views.rates_cache_stats, name="rates_cache_stats"),
+
     # POST upload_price
     path('upload_price/', views.UploadPriceViewSet.as_view(), name="upload_price"),
 
     # POST upload_usd_price
     path('upload_usd_price/', views.UploadUsdPriceViewSet.as_view(), name="upload_usd_price"),
 
+    # GET state of an upload queued with ?async=true
+    path('jobs/<int:job_id>/', views.job_status, name="job_status"),
+
+    # POST CSV or NDJSON file of prices
+    path('upload_price_stream/', views.UploadPriceStreamViewSet.as_view(), name="upload_price_stream"),
+
 
 ]
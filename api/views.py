@@ -1,41 +1,82 @@
 # Django imports
 from django.conf import settings
-from django.db import connection
+from django.db.models import QuerySet
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.urls import reverse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
 
 # REST imports
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.generics import GenericAPIView
+from rest_framework.views import APIView
 
 # local imports
 from api.serializers import *
-from api.models import Ports, Prices, Regions
+from api.models import DailyLaneSketch, IngestJob, Ports, Prices, Regions
+from api.rates_cache import cache_rates, rates_cache
+from api.etags import BACKEND_HEADER, conditional_rates
+from api.query import BACKENDS, STREAM_CHUNK_SIZE, batch_daily_totals, get_backend, slug_to_code
+from api.sketches import TDigest
+from api.renderers import ColumnarJSONRenderer, CSVRenderer, NDJSONRenderer, json_line
+from api.fx import FxRateMissing, convert_to_usd
+from api.jobs import PRICE_JOB, USD_PRICE_JOB, enqueue_job
+from api.ingest import CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE, dates_between, decode_lines, ingest_stream, insert_prices
 
 # other imports
 import os
-import json
-import requests
 import datetime
-import pandas as pd
+import functools
 
 
-################################## configuration file
-# open configuration file
-config_file = open(settings.CONFIGURATION_FILE)
-# get the configuration data from the file
-config_data = json.load(config_file)
-# close the config file
-config_file.close()
+# days with fewer prices than this are reported as null by rates_null
+NULL_PRICE_THRESHOLD = 3
 
-# Configuration of exchange rate API
-exchange_rates_url  = config_data['exchange_rates']['url']
-exchange_app_id     = config_data['exchange_rates']['app_id']
+# formats of the rates endpoints
+RATES_RENDERERS = [JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer, ColumnarJSONRenderer, CSVRenderer]
 
+# formats answered with one array per column
+COLUMNAR_FORMATS = [ColumnarJSONRenderer.format, CSVRenderer.format]
+
+# percentiles of each day returned by rates_percentile
+PERCENTILES = [("p10", 0.1), ("median", 0.5), ("p90", 0.9)]
+
+# headers reporting the exchange rate table used by a USD upload, and the
+# past days it converted because the currency has no stored history
+FX_AGE_HEADER       = 'X-FX-Rates-Age'
+FX_STALE_HEADER     = 'X-FX-Rates-Stale'
+FX_BACKDATED_HEADER = 'X-FX-Rates-Backdated'
+
+
+def data_error(message):
+    '''
+    Takes the message and
+    returns the data error status with error code
+
+    Parameters:
+        message (dict)      : The response message from serializer.
+
+    Returns:
+        dict: returns error status with error code
+    '''
+
+    error_status = {
+                    "status": "error",
+                    "data": {
+                        "http_code": "400 BAD REQUEST",
+                        "errors": [{
+                            "error_code": 2000,
+                            "error_message": message
+                            }]
+                        }
+                    }
+
+    return error_status
 
 def get_error_message(error_type, message):
     '''
@@ -52,18 +93,23 @@ def get_error_message(error_type, message):
 
     if error_type == "DATA_ERROR":
 
-        error_status = [{
-                        "status": "error",
-                        "data": {
-                            "http_code": "400 BAD REQUEST",
-                            "errors": [{
-                                "error_code": 2000,
-                                "error_message": message
-                                }]
-                            }
-                        }]
+        error_status = [data_error(message)]
         return Response(error_status, status=status.HTTP_400_BAD_REQUEST)
 
+    elif error_type == "NOT_FOUND":
+
+        error_status = [{
+            "status": "error",
+            "data": {
+                "http_code": "404 NOT FOUND",
+                "errors": [{
+                    "error_code": 2004,
+                    "error_message": message
+                    }]
+                }
+            }]
+        return Response(error_status, status=status.HTTP_404_NOT_FOUND)
+
     else:
         error_status = [{
             "status": "error",
@@ -78,122 +124,270 @@ def get_error_message(error_type, message):
 
     return Response(error_status, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-def slug_to_code(slug):
+def batch_daily_rates(items):
     '''
-    Takes slug as input and
-    finds code from the database
+    Takes the validated items of a batch request and
+    aggregates the prices per day of every item with one query
 
     Parameters:
-        slug (str)  : The slug.
+        items (list)    : The list of dictionary with date_from, date_to, origin, destination and window.
 
     Returns:
-        list: returns list of codes
+        list: returns one list of rows with day, price_sum and price_count per item
+    '''
+
+    # rolling windows read their leading days too
+    windows = [(window_start(item['date_from'], item.get('window')), item['date_to'], item['origin'], item['destination'])
+               for item in items]
+
+    # grouped per item and day inside the database
+    return [rolling_rates(daily_rows, item['date_from'], item['date_to'], item.get('window'))
+            for item, daily_rows in zip(items, batch_daily_totals(windows))]
 
+def window_start(date_from, window=None):
+    '''
+    Takes the first day of a response and its rolling window in days,
+    and returns the first day to read, window - 1 days earlier
     '''
 
-    # if slug present in parent_slug column enter
-    if Ports.objects.filter(parent_slug=slug).exists():
-        # filter out the code list for corresponding slug
-        code_list = list(Ports.objects.filter(parent_slug=slug).values_list("code", flat=True))
-    else:
-        # convert slug to a list
-        code_list = [slug]
+    if not window:
+        return date_from
 
-    return code_list
+    return date_from - datetime.timedelta(days=window - 1)
 
-def db_query(sql_query, input):
+def rolling_rates(daily_rows, date_from, date_to, window=None):
     '''
-    Takes the sql_query and the inputs,
-    and query the database
+    Takes the per day aggregated rows starting at window_start(date_from)
+    and sums them over a rolling window, so the averages are weighted
+    by the number of prices of each day and not an average of averages
 
     Parameters:
-        sql_query (str) : The sql_query.
-        input (tuple)   : The inputs for the sql_query.
+        daily_rows (list)   : The rows with day, price_sum and price_count.
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        window (int)        : The rolling window in days.
 
     Returns:
-        list: returns list of dictionary with columns as keys
+        list: returns one row per day of the range with prices in its window
     '''
-    # connecting to database
-    with connection.cursor() as cursor:
-        # execute query along with inputs
-        cursor.execute(sql_query, input)
-        # make cursor response data into list of dictionaries
-        query_data = cursor_fetch_all(cursor)
 
-    return query_data
+    if not window:
+        return daily_rows
+
+    # imported on first use, workers without rolling windows never load NumPy
+    import numpy as np
+
+    first_day = window_start(date_from, window)
+    length = (date_to - first_day).days + 1
+
+    # days, sums and counts as arrays, raw SQL may return days as text
+    daily_rows = [(str(row['day'])[:10], row['price_sum'], row['price_count']) for row in daily_rows]
+    days, day_sums, day_counts = zip(*daily_rows) if daily_rows else ((), (), ())
+    offsets = (np.array(days, dtype='datetime64[D]') - np.datetime64(first_day, 'D')).astype(np.int64)
+
+    # sum and count of every day from the first leading day
+    price_sums = np.zeros(length, dtype=np.int64)
+    price_counts = np.zeros(length, dtype=np.int64)
+    np.add.at(price_sums, offsets, np.array(day_sums, dtype=np.int64))
+    np.add.at(price_counts, offsets, np.array(day_counts, dtype=np.int64))
+
+    # window totals ending on each day of the range from the cumulative sums
+    cumulative_sums = np.concatenate([[0], np.cumsum(price_sums)])
+    cumulative_counts = np.concatenate([[0], np.cumsum(price_counts)])
+    window_sums = cumulative_sums[window:] - cumulative_sums[:-window]
+    window_counts = cumulative_counts[window:] - cumulative_counts[:-window]
 
-def cursor_fetch_all(cursor):
+    return [{"day": date_from + datetime.timedelta(days=int(offset)),
+             "price_sum": int(window_sums[offset]),
+             "price_count": int(window_counts[offset])}
+            for offset in np.flatnonzero(window_counts)]
+
+def daily_percentiles(date_from, date_to, origin, destination):
     '''
-    Takes cursor object as input and
-     combines the rows and columns into list of dictionary
+    Takes the date range and the origin and destination slugs,
+    and merges the quantile sketches of every lane per day
 
     Parameters:
-        cursor (object) : The cursor object.
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (str)        : The origin port or region slug.
+        destination (str)   : The destination port or region slug.
 
     Returns:
-        list: returns list of dictionary with columns as keys
-            and rows as values
+        list: returns one dictionary per day with the PERCENTILES
     '''
 
-    # obtain the column names
-    column_names = [col[0] for col in cursor.description]
-    # initialize empty list
+    # obtain corresponding code for slugs
+    origin      = slug_to_code(slug=origin)
+    destination = slug_to_code(slug=destination)
+
+    sketches = DailyLaneSketch.objects.filter(
+                                    day__range=[date_from, date_to],
+                                    orig_code__in=origin,
+                                    dest_code__in=destination
+                                    ).values_list('day', 'centroids').order_by('day')
+
+    # one merged sketch per day
+    daily_sketches = dict()
+    for day, centroids in sketches:
+        if day in daily_sketches:
+            daily_sketches[day].merge(TDigest.loads(centroids))
+        else:
+            daily_sketches[day] = TDigest.loads(centroids)
+
     result_list = list()
-    # for each rows in response data
-    for row in cursor.fetchall():
-        # convert into
-        result_dict = dict(zip(column_names, row))
-        # append to result_list
-        result_list.append(result_dict)
+    for day in sorted(daily_sketches):
+        row = {"day": str(day)}
+        for name, quantile in PERCENTILES:
+            # rounded into integer like the prices
+            row[name] = int(round(daily_sketches[day].quantile(quantile)))
+        result_list.append(row)
 
     return result_list
 
-def exchange_rates(amount, currency_code):
+def format_daily_rate(row, null_threshold=None):
     '''
-    Convert amount into USD
+    Takes one per day aggregated row and
+    converts it into the dictionary returned by the rates API
 
     Parameters:
-        amount (int)        : The amount to convert.
-        currency_code (str) : The currency of the input amount.
+        row (dict)              : The row with day, price_sum and price_count.
+        null_threshold (int)    : The minimum number of prices for a non null day.
 
     Returns:
-        float: returns amount converted into USD
+        dict: returns dictionary with day and average_price
     '''
-    # parameters to GET
-    PARAMS = {'app_id':exchange_app_id}
-    # base url
-    URL = exchange_rates_url
-    # GET request
-    r = requests.get(url = URL, params = PARAMS)
-    # extracting data in json format
-    data = r.json()
-    # USD rate of corresponding currency
-    USD_rate = data['rates'][currency_code.upper()]
-    # convert amount into USD
-    usd_amount = amount/USD_rate
 
-    return usd_amount
+    # days with too few prices are reported as null
+    if null_threshold is not None and row['price_count'] < null_threshold:
+        average_price = "null"
+    else:
+        # average truncated into integer
+        average_price = int(row['price_sum']) // int(row['price_count'])
 
+    return {
+            "day": str(row['day']),
+            "average_price": average_price
+            }
 
-@api_view(['GET'])
-def rates(request, date_from, date_to, origin, destination):
+def format_daily_rates(daily_rows, null_threshold=None):
     '''
-    API endpoint that returns a list with the average prices for each day
-    on a route between Port Codes origin and destination.
+    Takes the per day aggregated rows and
+    converts them into the list returned by the rates API
 
     Parameters:
-        date_from (date)    : The from date.
-        date_to (date)      : The to date.
-        origin (str)        : The origin port.
-        destination (str)   : The destination port.
+        daily_rows (list)       : The rows with day, price_sum and price_count.
+        null_threshold (int)    : The minimum number of prices for a non null day.
 
+    Returns:
+        list: returns list of dictionary with day and average_price
+    '''
+
+    return [format_daily_rate(row, null_threshold) for row in daily_rows]
+
+def format_daily_columns(daily_rows, null_threshold=None):
+    '''
+    Takes the per day aggregated rows and
+    converts them into one list per column
+
+    Parameters:
+        daily_rows (list)       : The rows with day, price_sum and price_count.
+        null_threshold (int)    : The minimum number of prices for a non null day.
 
     Returns:
-        list: returns a list with the average prices for each day
-            on a route between Port Codes origin and destination
+        dict: returns the list of days and the list of average_price
+    '''
 
-    Curl:
-        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates/2016-01-01/2016-01-01/CNSGH/north_europe_main/
+    # tuples straight from the database
+    if isinstance(daily_rows, QuerySet):
+        daily_rows = daily_rows.values_list('day', 'price_sum', 'price_count')
+    else:
+        daily_rows = [(row['day'], row['price_sum'], row['price_count']) for row in daily_rows]
+
+    # split the rows into columns
+    days, price_sums, price_counts = zip(*daily_rows) if daily_rows else ((), (), ())
+
+    # days with too few prices are reported as null, others truncated into integer
+    average_prices = ["null" if null_threshold is not None and price_count < null_threshold
+                      else int(price_sum) // int(price_count)
+                      for price_sum, price_count in zip(price_sums, price_counts)]
+
+    return {
+            "days": [str(day) for day in days],
+            "average_price": average_prices
+            }
+
+def rates_response(request, daily_rows, null_threshold=None):
+    '''
+    Takes the per day aggregated rows and
+    returns them in the format negotiated with the client
+
+    Parameters:
+        request (Request)       : The request.
+        daily_rows (list)       : The rows with day, price_sum and price_count.
+        null_threshold (int)    : The minimum number of prices for a non null day.
+
+    Returns:
+        Response: returns the rates as JSON, columnar JSON, CSV or NDJSON stream
+    '''
+
+    # stream the days as they come off the cursor
+    if is_streamed(request):
+        if isinstance(daily_rows, QuerySet):
+            daily_rows = daily_rows.iterator(STREAM_CHUNK_SIZE)
+        return stream_daily_rates(daily_rows, null_threshold)
+
+    # one array per column, without building a dictionary per day
+    if request.accepted_renderer.format in COLUMNAR_FORMATS:
+        return Response(format_daily_columns(daily_rows, null_threshold), status=status.HTTP_200_OK)
+
+    success = [{
+                "status": "success",
+                "data": format_daily_rates(daily_rows, null_threshold)
+                }]
+
+    return Response(success, status=status.HTTP_200_OK)
+
+def stream_daily_rates(daily_rows, null_threshold=None):
+    '''
+    Takes the per day aggregated rows and
+    streams them as newline delimited JSON
+
+    Parameters:
+        daily_rows (iterator)   : The rows with day, price_sum and price_count.
+        null_threshold (int)    : The minimum number of prices for a non null day.
+
+    Returns:
+        StreamingHttpResponse: returns one line per day, sent as the rows are fetched
+    '''
+
+    lines = (json_line(format_daily_rate(row, null_threshold)) for row in daily_rows)
+
+    return StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
+
+def is_streamed(request):
+    '''
+    Checks whether the request asked for newline delimited JSON
+    '''
+    return request.accepted_renderer.format == NDJSONRenderer.format
+
+def rates_endpoint(request, date_from, date_to, origin, destination, backend, null_threshold=None):
+    '''
+    Takes the request of a rates endpoint and the backend answering it,
+    validates it, reads the per day totals from the backend
+    and returns them in the format negotiated with the client
+
+    Parameters:
+        request (Request)       : The request.
+        date_from (str)         : The from date.
+        date_to (str)           : The to date.
+        origin (str)            : The origin port or region slug.
+        destination (str)       : The destination port or region slug.
+        backend (RatesBackend)  : The backend of api.query.
+        null_threshold (int)    : The minimum number of prices for a non null day.
+
+    Returns:
+        Response: returns the rates with the backend name in the X-Rates-Backend header
     '''
 
     # converting data into dictionary format to serialiser
@@ -203,6 +397,10 @@ def rates(request, date_from, date_to, origin, destination):
             "destination":destination
             }
 
+    # optional rolling window in days
+    if 'window' in request.query_params:
+        data['window'] = request.query_params['window']
+
     # check data with serializer
     serializer = RatesSerializer(data=data)
 
@@ -211,44 +409,52 @@ def rates(request, date_from, date_to, origin, destination):
         # return error message
         return get_error_message("DATA_ERROR", str(serializer.errors))
 
-    # obtain corresponding code for slugs
-    origin      = slug_to_code(slug=origin)
-    destination = slug_to_code(slug=destination)
+    # rolling window in days, its leading days are read as well
+    window = serializer.validated_data.get('window')
+    date_from, date_to = serializer.validated_data['date_from'], serializer.validated_data['date_to']
 
-    # Query the model
-    filtered_queryset = Prices.objects.filter(
-                                        day__range=[date_from, date_to],
-                                        orig_code__in=origin,
-                                        dest_code__in=destination
-                                        )
-
-    if filtered_queryset:
-        # retrieving from database and converting into dataframe
-        # df = pd.DataFrame(list(filtered_queryset.values('day', 'price')))
-        df = pd.DataFrame(list(filtered_queryset.values('day', 'price', 'orig_code', 'dest_code')))
-        # find average of same day and convert into integer
-        mean_df = df.groupby(df['day']).mean().astype(int)
-        # reset index and convert index into column
-        mean_df.reset_index(level=0, inplace=True)
-        # rename column
-        mean_df = mean_df.rename(columns={'price': 'average_price'})
-        # convert date to string
-        mean_df["day"] = mean_df["day"].astype(str)
-        # convert result into list of dictionary
-        result_dict = mean_df.to_dict(orient='records')
-    else:
-        result_dict = []
+    # rows of a rolling window are all needed before the first day is sent
+    daily_rows = backend.daily_rates(window_start(date_from, window), date_to, origin, destination,
+                                     streamed=is_streamed(request) and not window)
 
-    success = [{
-                "status": "success",
-                "data": result_dict
-                }]
+    response = rates_response(request, rolling_rates(daily_rows, date_from, date_to, window), null_threshold)
+    response[BACKEND_HEADER] = backend.name
 
+    return response
 
-    return Response(success, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@renderer_classes(RATES_RENDERERS)
+@cache_rates('rates')
+@conditional_rates('rates', backend=get_backend)
+def rates(request, date_from, date_to, origin, destination):
+    '''
+    API endpoint that returns a list with the average prices for each day
+    on a route between Port Codes origin and destination.
+
+    Parameters:
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (str)        : The origin port.
+        destination (str)   : The destination port.
+
+
+    Returns:
+        list: returns a list with the average prices for each day
+            on a route between Port Codes origin and destination
+
+    Curl:
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates/2016-01-01/2016-01-01/CNSGH/north_europe_main/
+    '''
+
+    # per day totals from the backend of settings.RATES_ENGINE
+    return rates_endpoint(request, date_from, date_to, origin, destination, get_backend())
 
 
 @api_view(['GET'])
+@renderer_classes(RATES_RENDERERS)
+@cache_rates('rates_null')
+@conditional_rates('rates_null', backend=get_backend)
 def rates_null(request, date_from, date_to, origin, destination):
     '''
     API endpoint that returns a list with the average prices for each day
@@ -271,6 +477,66 @@ def rates_null(request, date_from, date_to, origin, destination):
         curl -X GET -H 'Content-Type: application/json' http://localhost:8000/api/rates_null/2016-01-01/2016-01-01/CNGGZ/EETLL/
     '''
 
+    # per day totals from the backend of settings.RATES_ENGINE,
+    # days with less than 3 prices replaced by null
+    return rates_endpoint(request, date_from, date_to, origin, destination, get_backend(),
+                          null_threshold=NULL_PRICE_THRESHOLD)
+
+
+@api_view(['GET'])
+@renderer_classes(RATES_RENDERERS)
+@cache_rates('rates_sql')
+@conditional_rates('rates_sql', backend=functools.partial(get_backend, 'sql'))
+def rates_sql(request, date_from, date_to, origin, destination):
+    '''
+    API endpoint that returns a list with the average prices for each day
+    on a route between Port Codes origin and destination,
+    using raw SQL instead of using ORM querying tool.
+
+    Parameters:
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (str)        : The origin port.
+        destination (str)   : The destination port.
+
+
+    Returns:
+        list: returns a list with the average prices for each day
+            on a route between Port Codes origin and destination
+
+    Curl:
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates_sql/2016-01-01/2016-01-01/CNSGH/north_europe_main/
+    '''
+
+    # per day totals from raw SQL with the port codes bound as parameters
+    return rates_endpoint(request, date_from, date_to, origin, destination, BACKENDS['sql'])
+
+
+@api_view(['GET'])
+@cache_rates('rates_summary')
+@conditional_rates('rates_summary')
+def rates_summary(request, date_from, date_to, origin, destination):
+    '''
+    API endpoint that returns the average, minimum and maximum price
+    and the number of prices over the whole date range
+    on a route between Port Codes origin and destination,
+    answered from per lane prefix sums whatever the length of the range.
+
+    Parameters:
+        date_from (date)    : The from date.
+        date_to (date)      : The to date.
+        origin (str)        : The origin port.
+        destination (str)   : The destination port.
+
+
+    Returns:
+        list: returns the average_price, min_price, max_price and price_count
+            on a route between Port Codes origin and destination
+
+    Curl:
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates_summary/2016-01-01/2016-12-31/CNGGZ/scandinavia/
+    '''
+
     # converting data into dictionary format to serialiser
     data = {"date_from":date_from,
             "date_to":date_to,
@@ -287,50 +553,30 @@ def rates_null(request, date_from, date_to, origin, destination):
         return get_error_message("DATA_ERROR", str(serializer.errors))
 
 
-    # obtain corresponding code for slugs
-    origin      = slug_to_code(slug=origin)
-    destination = slug_to_code(slug=destination)
+    # imported on first use, the index is built with NumPy
+    from api.summary import summary_index
 
-    # Query the model
-    filtered_queryset = Prices.objects.filter(
-                                        day__range=[date_from, date_to],
-                                        orig_code__in=origin,
-                                        dest_code__in=destination
-                                        )
-    if filtered_queryset:
-        # retrieving from database and converting into dataframe
-        df = pd.DataFrame(list(filtered_queryset.values('day', 'price'))).set_index('day')
-        # find average of same day and convert into integer
-        mean_df = df.groupby(df.index).mean().astype(int)
-        # find day in number less than 3
-        bool_df = df.groupby('day').count() < 3
-        # replace above days value by null
-        mean_df[bool_df['price']] = "null"
-        # reset index and convert index into column
-        mean_df.reset_index(level=0, inplace=True)
-        # rename column
-        mean_df = mean_df.rename(columns={'price': 'average_price'})
-        # convert date to string
-        mean_df["day"] = mean_df["day"].astype(str)
-        # convert result into list of dictionary
-        result_dict = mean_df.to_dict(orient='records')
-    else:
-        result_dict = []
+    # summary of every lane between the ports of origin and destination
+    summary = summary_index.summary(parse_date(date_from), parse_date(date_to),
+                                    slug_to_code(origin), slug_to_code(destination))
 
     success = [{
                 "status": "success",
-                "data": result_dict
+                "data": summary
                 }]
 
     return Response(success, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
-def rates_sql(request, date_from, date_to, origin, destination):
+@cache_rates('rates_percentile')
+@conditional_rates('rates_percentile')
+def rates_percentile(request, date_from, date_to, origin, destination):
     '''
-    API endpoint that returns a list with the average prices for each day
-    on a route between Port Codes origin and destination,
-    using raw SQL instead of using ORM querying tool.
+    API endpoint that returns a list with the 10th percentile, median
+    and 90th percentile price for each day on a route between
+    Port Codes origin and destination, merged from the quantile
+    sketch of each lane and day without reading the raw prices.
 
     Parameters:
         date_from (date)    : The from date.
@@ -340,11 +586,11 @@ def rates_sql(request, date_from, date_to, origin, destination):
 
 
     Returns:
-        list: returns a list with the average prices for each day
+        list: returns a list with the percentiles for each day
             on a route between Port Codes origin and destination
 
     Curl:
-        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates_sql/2016-01-01/2016-01-01/CNSGH/north_europe_main/
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates_percentile/2016-01-01/2016-01-02/CNGGZ/scandinavia/
     '''
 
     # converting data into dictionary format to serialiser
@@ -362,47 +608,176 @@ def rates_sql(request, date_from, date_to, origin, destination):
         # return error message
         return get_error_message("DATA_ERROR", str(serializer.errors))
 
-    # obtain corresponding code for slugs
-    origin      = slug_to_code(slug=origin)
-    destination = slug_to_code(slug=destination)
 
-    # inputs to be given to cursor along with query
-    input = (date_from, date_to)
-    # format origin and destination into tuple like string structure ie: ('CNGGZ')
-    origin = str(origin).replace("[","(").replace("]",")")
-    destination = str(destination).replace("[","(").replace("]",")")
-
-    # sql query
-    sql_query = ''' SELECT  orig_code, dest_code, day, price
-                    FROM api_prices
-                    WHERE ( day BETWEEN %s AND %s AND orig_code IN {0} AND dest_code IN {1} )
-                    '''.format( origin, destination)
-
-    # query data after querying
-    query_data = db_query(sql_query, input)
-
-    # if query_data is not empty enter
-    if query_data:
-        # retrieving from database and converting into dataframe
-        df = pd.DataFrame(query_data)
-        # find average of same day and convert into integer
-        mean_df = df.groupby(df['day']).mean().astype(int)
-        # reset index and convert index into column
-        mean_df.reset_index(level=0, inplace=True)
-        # rename column
-        mean_df = mean_df.rename(columns={'price': 'average_price'})
-        # convert date to string
-        mean_df["day"] = mean_df["day"].astype(str)
-        # convert result into list of dictionary
-        result_dict = mean_df.to_dict(orient='records')
-    else:
-        result_dict = []
+    success = [{
+                "status": "success",
+                "data": daily_percentiles(date_from, date_to, origin, destination)
+                }]
+
+    return Response(success, status=status.HTTP_200_OK)
+
+
+class RatesBatchViewSet(GenericAPIView):
+    """
+    API endpoint that returns the average prices for each day
+    of many routes and date ranges at once, in the order of the input
+
+    Parameters:
+        list of:
+            date_from (date)        : The from date.
+            date_to (date)          : The to date.
+            origin (str)            : The origin port or region.
+            destination (str)       : The destination port or region.
+            null_threshold (int)    : Optional, days with less prices are null.
+
+    Returns:
+        list: returns the rates or the errors of each item
+
+    Curl:
+        curl -X POST -d '''[{"date_from": "2016-01-01",
+                             "date_to": "2016-01-02",
+                             "origin": "CNGGZ",
+                             "destination": "EETLL"},
+                            {"date_from": "2016-01-01",
+                             "date_to": "2016-01-31",
+                             "origin": "china_main",
+                             "destination": "north_europe_main",
+                             "null_threshold": 3}]''' -H "Content-Type: application/json" http://localhost:8000/api/rates/batch/
+
+    """
+
+    queryset = ''
+    serializer_class = RatesBatchItemSerializer
+
+    def post(self, request, *args, **kwargs):
+
+        # obtain the data
+        data = request.data
+
+        # the body is a list of items
+        if not isinstance(data, list):
+            return get_error_message("DATA_ERROR", "expected a list of rates requests")
+
+        # bound the work of a single request
+        if len(data) > settings.RATES_BATCH_MAX_ITEMS:
+            return get_error_message("DATA_ERROR", "at most {0} rates requests per batch".format(settings.RATES_BATCH_MAX_ITEMS))
+
+        # check each item with serializer
+        item_serializers = [RatesBatchItemSerializer(data=item) for item in data]
+        items = [serializer.validated_data for serializer in item_serializers if serializer.is_valid()]
+
+        # aggregate the valid items together
+        daily_rows = iter(batch_daily_rates(items))
+
+        # results in the order of the input
+        result_list = list()
+        for serializer in item_serializers:
+            if serializer.errors:
+                result_list.append(data_error(str(serializer.errors)))
+            else:
+                result_list.append({
+                                    "status": "success",
+                                    "data": format_daily_rates(next(daily_rows),
+                                                null_threshold=serializer.validated_data.get('null_threshold'))
+                                    })
+
+        success = [{
+                    "status": "success",
+                    "data": result_list
+                    }]
+
+        return Response(success, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def rates_cache_stats(request):
+    '''
+    API endpoint that returns the hit, miss and eviction counters
+    of the rates response cache of the worker serving the request
+
+    Returns:
+        list: returns the counters and the size of the cache
+
+    Curl:
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/rates_cache/
+    '''
 
     success = [{
                 "status": "success",
-                "data": result_dict
+                "data": rates_cache.info()
                 }]
 
+    return Response(success, status=status.HTTP_200_OK)
+
+
+def is_async(request):
+    '''
+    Checks whether an upload asks to be queued,
+    with ?async=true or a `Prefer: respond-async` header
+    '''
+
+    return request.query_params.get('async', '').lower() in ['1', 'true'] or \
+           'respond-async' in request.META.get('HTTP_PREFER', '')
+
+
+def queued_response(request, job):
+    '''
+    Takes a queued job and returns the 202 response
+    pointing at its status endpoint
+    '''
+
+    url = request.build_absolute_uri(reverse('job_status', args=[job.pk]))
+
+    queued = [{
+                "status": True,
+                "data": {
+                        "message": "Data queued for ingestion",
+                        "job_id": job.pk,
+                        "url": url
+                        }
+              }]
+
+    response = Response(queued, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = url
+
+    return response
+
+
+@api_view(['GET'])
+def job_status(request, job_id):
+    '''
+    API endpoint that returns the state and row counts
+    of an upload queued with ?async=true
+
+    Parameters:
+        job_id (int)    : The job id returned by the upload.
+
+    Returns:
+        list: returns the job, its status is queued, running, done or failed
+
+    Curl:
+        curl -X GET -H 'Content-Type: application/json'  http://localhost:8000/api/jobs/1/
+    '''
+
+    job = IngestJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return get_error_message("NOT_FOUND", "job {0} not found".format(job_id))
+
+    success = [{
+                "status": "success",
+                "data": {
+                        "job_id": job.pk,
+                        "kind": job.kind,
+                        "status": job.status,
+                        "rows": job.rows,
+                        "inserted": job.inserted,
+                        "attempts": job.attempts,
+                        "error": job.error,
+                        "created": job.created,
+                        "started": job.started,
+                        "finished": job.finished
+                        }
+                }]
 
     return Response(success, status=status.HTTP_200_OK)
 
@@ -445,40 +820,48 @@ class UploadPriceViewSet(GenericAPIView):
             # return error message
             return get_error_message("DATA_ERROR", str(serializer.errors))
 
-        # inputs from API
-        prices              = data['price']
+        # inputs from API, the prices as validated so numeric strings are int
+        prices              = serializer.validated_data['price']
         date_to             = data['date_to']
         date_from           = data['date_from']
         origin_code         = data['origin_code']
         destination_code    = data['destination_code']
 
-        # if date length does not match
-        if date_from != date_to:
-            # generate a list of dates
-            date_range = pd.date_range(start=date_from, end=date_to).date.tolist()
+        # generate a list of dates
+        date_range = dates_between(serializer.validated_data['date_from'], serializer.validated_data['date_to'])
 
         # if generated date length and price doesnt match
         if len(date_range) != len(prices):
             # return error response
             return get_error_message("DATA_ERROR", "price and generated date length does not match")
 
+        # inserted later by the ingest workers
+        if is_async(request):
+            job = enqueue_job(PRICE_JOB, {"origin_code": origin_code,
+                                          "destination_code": destination_code,
+                                          "date_from": str(serializer.validated_data['date_from']),
+                                          "date_to": str(serializer.validated_data['date_to']),
+                                          "price": prices}, len(prices))
+            return queued_response(request, job)
+
         try:
-            # obtain each date and price in list
-            for date, price in zip(date_range, prices):
-                # insert into database
-                p = Prices( orig_code   = origin_code,
-                            dest_code   = destination_code,
-                            day         = date,
-                            price       = price,
-                            )
-                # saving assigined data
-                p.save()
+            # one row for each date and price in list
+            rows = [(origin_code, destination_code, date, price) for date, price in zip(date_range, prices)]
+
+            # inserted in batches with their daily lane rollup, all or nothing
+            insert_prices(rows)
 
             # response messages
             saved_status = True
             message = "Data successfully ingested"
             status_code = status.HTTP_201_CREATED
 
+        except FxRateMissing as error:
+            # days older than the exchange rate history
+            saved_status = True
+            message = "Failed to ingest data, {0}".format(error)
+            status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+
         except:
             # response messages
             saved_status = True
@@ -537,8 +920,8 @@ class UploadUsdPriceViewSet(GenericAPIView):
             # return error message
             return get_error_message("DATA_ERROR", str(serializer.errors))
 
-        # inputs from API
-        prices              = data['price']
+        # inputs from API, the prices as validated so numeric strings are int
+        prices              = serializer.validated_data['price']
         date_to             = data['date_to']
         date_from           = data['date_from']
         origin_code         = data['origin_code']
@@ -546,38 +929,48 @@ class UploadUsdPriceViewSet(GenericAPIView):
         currency_code       = data['currency_code']
 
 
-        # if date length does not match
-        if date_from != date_to:
-            # generate a list of dates
-            date_range = pd.date_range(start=date_from, end=date_to).date.tolist()
+        # generate a list of dates
+        date_range = dates_between(serializer.validated_data['date_from'], serializer.validated_data['date_to'])
 
         # if generated date length and price doesnt match
         if len(date_range) != len(prices):
             # return error response
             return get_error_message("DATA_ERROR", "price and generated date length does not match")
 
+        # converted and inserted later by the ingest workers
+        if is_async(request):
+            job = enqueue_job(USD_PRICE_JOB, {"origin_code": origin_code,
+                                              "destination_code": destination_code,
+                                              "date_from": str(serializer.validated_data['date_from']),
+                                              "date_to": str(serializer.validated_data['date_to']),
+                                              "price": prices,
+                                              "currency_code": currency_code}, len(prices))
+            return queued_response(request, job)
+
+        # status of the exchange rate API table if it was used
+        fx_status = None
 
         try:
-            # obtain each date and price in list
-            for date, price in zip(date_range, prices):
+            # convert prices into USD at the rate of their own day
+            usd_prices, fx_status = convert_to_usd(prices, currency_code, date_range)
 
-                # convert price into USD
-                price = exchange_rates(price, currency_code)
+            # one row for each date and price in list
+            rows = [(origin_code, destination_code, date, price) for date, price in zip(date_range, usd_prices)]
 
-                # insert into database
-                p = Prices( orig_code   = origin_code,
-                            dest_code   = destination_code,
-                            day         = date,
-                            price       = price,
-                            )
-                # saving assigined data
-                p.save()
+            # inserted in batches with their daily lane rollup, all or nothing
+            insert_prices(rows)
 
             # response messages
             saved_status = True
             message = "Data successfully ingested"
             status_code = status.HTTP_201_CREATED
 
+        except FxRateMissing as error:
+            # days older than the exchange rate history
+            saved_status = True
+            message = "Failed to ingest data, {0}".format(error)
+            status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+
         except:
             # response messages
             saved_status = True
@@ -592,4 +985,59 @@ class UploadUsdPriceViewSet(GenericAPIView):
                             }
                    }]
 
-        return Response(success, status=status_code)
+        response = Response(success, status=status_code)
+
+        # age of the exchange rate table, stale when the API could not be reached for long
+        if fx_status is not None:
+            response[FX_AGE_HEADER] = "" if fx_status['age_seconds'] is None else str(fx_status['age_seconds'])
+            response[FX_STALE_HEADER] = "true" if fx_status['stale'] else "false"
+            response[FX_BACKDATED_HEADER] = str(fx_status['backdated'])
+
+        return response
+
+
+class UploadPriceStreamViewSet(APIView):
+    """
+    API endpoint where you can upload a CSV or NDJSON file of prices
+    of any lanes and days, read and loaded chunk by chunk as it streams in
+
+    Parameters:
+        body (file)     : The rows, orig_code,dest_code,day,price with
+                          Content-Type text/csv, or one object or array
+                          per line with Content-Type application/x-ndjson.
+
+    Returns:
+        dict: returns the rows read, inserted and rejected, the details
+            of the first rejected rows and the rows per second
+
+    Curl:
+        curl -X POST --data-binary @prices.csv -H "Content-Type: text/csv" http://localhost:8000/api/upload_price_stream/
+
+    """
+
+    def post(self, request, *args, **kwargs):
+
+        # media type without its charset
+        media_type = request.content_type.split(';')[0].strip()
+        if media_type not in [CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE]:
+            return get_error_message("DATA_ERROR", "Content-Type must be {0} or {1}".format(CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE))
+
+        # read from the socket, the body is never buffered
+        if request.stream is None:
+            return get_error_message("DATA_ERROR", "empty body")
+
+        report = None
+
+        try:
+            # every chunk is committed once loaded
+            for report in ingest_stream(decode_lines(request.stream), media_type):
+                pass
+
+            status_code = status.HTTP_201_CREATED if report["inserted"] else status.HTTP_400_BAD_REQUEST
+
+        except:
+            # the report of the chunks loaded before the failure
+            report = dict(report or {}, message="Failed to ingest data")
+            status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+
+        return Response(report, status=status_code)
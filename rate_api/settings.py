@@ -98,6 +98,26 @@ DATABASES = {
 #     }
 # }
 
+##################################### Cache
+# shared by all the processes serving the API, the rates cache, region closure,
+# NumPy engine and summary index of each worker follow the uploads and region
+# changes of the others through it, its table is created with
+# `python manage.py createcachetable`
+CACHES = {
+    'default': {
+        'BACKEND': 'api.cache.DatabaseCache',
+        'LOCATION': 'api_cache',
+        'OPTIONS': {
+            # the invalidation events are kept with the cached responses
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# worker processes serving the API, read from the environment as gunicorn does,
+# a cache private to each process is refused when there are several
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
 ##################################### Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -136,6 +156,76 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 CONFIGURATION_FILE = os.path.join(BASE_DIR, '.configs/config.json')
 
+# region pairs (origin slug, destination slug) kept aggregated per day in
+# api_regionpairrollup, ie: [('china_main', 'north_europe_main')],
+# run `python manage.py rebuild_rollup` after changing it
+MATERIALIZED_REGION_PAIRS = []
+
+# seconds a worker trusts the generation of the region tree read from the
+# shared cache, region changes made by other workers are seen within it
+REGION_GENERATION_CHECK_INTERVAL = 1.0
+
+# rates responses kept in the LRU of each worker, 0 disables the cache,
+# CACHES alias of the tier shared by the workers, which must not be private
+# to each process, and how long it keeps the upload invalidation events
+RATES_CACHE_SIZE            = 1024
+RATES_CACHE_ALIAS           = 'default'
+RATES_CACHE_EVENT_TIMEOUT   = 24 * 3600
+
+# backend answering rates and rates_null, see api.query: 'orm', 'sql' for
+# raw SQL, or 'numpy' to keep api_prices in memory in each worker as sorted
+# NumPy arrays per lane, rates_sql always uses 'sql'
+RATES_ENGINE = 'orm'
+
+# directory of the api_prices snapshot memory mapped by the 'numpy' engine,
+# written by `python manage.py write_price_snapshot`, None to read the database
+RATES_SNAPSHOT_DIR = None
+
+# most routes accepted by one /api/rates/batch/ request
+RATES_BATCH_MAX_ITEMS = 500
+
+# rows per INSERT statement of the uploads
+UPLOAD_BATCH_SIZE = 500
+
+# rows validated and loaded at once by the streamed uploads
+INGEST_CHUNK_SIZE = 10000
+
+# rejected rows detailed in the report of a streamed upload
+INGEST_MAX_REJECTED_ROWS = 100
+
+# threads of each process draining the jobs of the uploads queued with ?async=true,
+# started once the process has jobs, 0 when separate processes of manage.py
+# run_ingest_jobs drain them
+INGEST_WORKERS = 1
+
+# queued uploads inserted in one transaction
+INGEST_JOB_BATCH_SIZE = 20
+
+# seconds between two looks for jobs queued by other processes
+INGEST_JOB_POLL_INTERVAL = 1.0
+
+# seconds after which a running job of a dead worker is run again
+INGEST_JOB_TIMEOUT = 600
+
+
+# days a rate of the FxRate history converts after its own day, older days
+# without one are rejected unless the currency has no history at all
+FX_RATE_MAX_AGE_DAYS = 7
+
+# exchange rate table of the USD uploads for the last FX_RATE_MAX_AGE_DAYS and
+# future days without a stored rate, and for the currencies without history,
+# 'api.fx.StubFxRateProvider' serves FX_STUB_RATES instead of calling
+# the API of CONFIGURATION_FILE; a background thread of each worker fetches
+# it every FX_RATE_TTL seconds with (connect, read) FX_HTTP_TIMEOUT, a table
+# older than FX_RATE_STALE_TTL is reported as stale, and FX_BREAKER_FAILURES
+# failed fetches in a row stop the calls for FX_BREAKER_RESET seconds
+FX_RATE_PROVIDER    = 'api.fx.HTTPFxRateProvider'
+FX_RATE_TTL         = 3600
+FX_RATE_STALE_TTL   = 24 * 3600
+FX_HTTP_TIMEOUT     = (3.05, 5)
+FX_BREAKER_FAILURES = 3
+FX_BREAKER_RESET    = 60
+FX_STUB_RATES       = {'USD': 1.0}
 
 ######################################## Error logging configuration
 LOGGING = {